@@ -35,11 +35,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'warehouse.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'warehouse.middleware.ReadYourWritesMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -70,9 +72,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR/'db.sqlite3',
+        # Записи в SQLite идут по очереди (warehouse.services.reservations.serialize_writes): ждём блокировку
+        # дольше стандартных 5 секунд, чтобы параллельные отгрузки не падали с "database is locked"
+        'OPTIONS': {'timeout': 30},
+        # Тестовая база — файл, а не общая память: в памяти SQLite блокирует таблицы без ожидания timeout,
+        # и тесты параллельных отгрузок падали бы с "database table is locked"
+        'TEST': {'NAME': BASE_DIR/'test_db.sqlite3'},
     }
 }
 
+# Справочники (warehouse.services.reference) хранятся в кэше в базе: он общий для всех воркеров
+# и создаётся миграцией; на проде можно указать memcached/redis в local_settings
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'warehouse_reference_cache',
+    },
+}
+
+REFERENCE_CACHE_ALIAS = 'reference'
+
+# Реплика для отчётов (warehouse.routers.ReplicaRouter): чтения вью с ReplicaReadsMixin/@replica_reads_view идут
+# на алиас REPLICA_DATABASE_ALIAS, если он есть в DATABASES; без него всё читается из default.
+# REPLICA_LAG_TOLERANCE — на сколько секунд реплика может отставать: столько пользователь после своей записи
+# читает из default. Локально реплику изображает второй файл SQLite, его обновляет manage.py sync_replica:
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': BASE_DIR / 'replica.sqlite3',
+#     'TEST': {'MIRROR': 'default'},
+# }
+DATABASE_ROUTERS = [ 'warehouse.routers.ReplicaRouter' ]
+REPLICA_DATABASE_ALIAS = 'replica'
+REPLICA_LAG_TOLERANCE = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -111,6 +146,32 @@ STATIC_URL = 'static/'
 # STATIC_ROOT = BASE_DIR / 'static'
 STATICFILES_DIRS = [BASE_DIR / 'static',]
 
+# Страница добавления продуктов в лот отправляет 4 поля на строку: 1000 полей по умолчанию — это 250 строк
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
+# Файлы результатов фоновых задач (выгрузки); отдаются через warehouse:job_download
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Архив записей истории, убранных manage.py compact_history (gzip, JSON по строке на запись)
+HISTORY_ARCHIVE_DIR = BASE_DIR / 'history_archive'
+
+# Побочные эффекты сохранений (проводки продаж и оплат лотов) пишутся событиями в OutboxEvent и выполняются
+# сразу после коммита; с False — только исполнителем manage.py process_outbox. Повторы после ошибок — всегда он
+OUTBOX_PROCESS_ON_COMMIT = True
+
+# Фоновые задачи (выгрузки, импорт, приёмка лота на склад) ставятся в таблицу Job и выполняются отдельным
+# процессом manage.py run_worker — он обязателен рядом с веб-сервером, иначе задачи остаются в очереди.
+# С True задача выполняется сразу после коммита в процессе веб-сервера (разработка, установка без исполнителя)
+JOBS_RUN_ON_COMMIT = False
+
+# Правила уровней покупателей (warehouse.services.consumers.TierRule), от старшего к младшему; по умолчанию
+# DEFAULT_TIER_RULES. После смены правил уровни пересчитывает manage.py recompute_consumers
+# CONSUMER_TIER_RULES = [
+#     { 'level': 3, 'min_revenue': 300000, 'min_orders': 10, 'max_unpaid': 100000, 'active_days': 365 },
+#     { 'level': 2, 'min_revenue': 50000, 'min_orders': 3 },
+# ]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -120,6 +181,11 @@ MATERIALIZECSS_ICON_SET = 'fontawesome'
 
 TEMPLATE_STRING_IF_INVALID = 'Invalid Variable'
 
+# Учёт запросов к базе (warehouse.middleware.QueryInstrumentationMiddleware)
+QUERY_BUDGET_MODE = 'log'  # 'raise' — падать при превышении бюджета запросов вью
+QUERY_STATS_HEADER = True
+QUERY_SLOW_REQUEST_MS = 1000
+
 try:
     from .local_settings import *
 except ImportError:
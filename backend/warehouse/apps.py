@@ -8,5 +8,6 @@ class WarehouseConfig(AppConfig):
 
     def ready(self):
         import warehouse.signals
+        import warehouse.tasks
         post_save.connect(warehouse.signals.create_cost_in_and_out_product_in_warehouse, sender='warehouse.Order')
         post_save.connect(warehouse.signals.create_cost_out_for_buy_lot, sender='warehouse.Lot')
\ No newline at end of file
@@ -18,6 +18,37 @@ from .models import (
     Cost,
 )
 from django.db.models import Exists, OuterRef
+from django.forms.models import ModelChoiceIterator
+
+from django.template.defaultfilters import floatformat
+
+from .services.reference import get_product_list
+from .services.stock import sellable_products
+
+
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    # Варианты выбора из кэша справочников: выпадающий список строится без запроса к базе
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for reference in self.field.get_references():
+            yield (reference.pk, self.field.label_from_instance(reference))
+
+    def __len__(self):
+        return len(self.field.get_references()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.get_references())
+
+
+class ProductChoiceField(forms.ModelChoiceField):
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, **kwargs):
+        super().__init__(queryset=Product.objects.all(), **kwargs)
+
+    def get_references(self):
+        return get_product_list()
 
 
 class CategoryForm(forms.ModelForm):
@@ -39,6 +70,8 @@ class ProductForm(forms.ModelForm):
 
 
 class ProductInLotForm(forms.ModelForm):
+    product = ProductChoiceField(label='Товар')
+
     class Meta:
         model = ProductInLot
         fields = (
@@ -109,15 +142,17 @@ class WarehouseForm(forms.ModelForm):
 
 
 class ProductInWarehouseForm(forms.ModelForm):
+    product = ProductChoiceField(label='Продукт')
+
     class Meta:
         model = ProductInWarehouse
-        exclude = ['warehouse']
+        exclude = ['warehouse', 'lot', 'order']
 
 
 class ConsumerForm(forms.ModelForm):
     class Meta:
         model = Consumer
-        exclude = ['total_cost', 'level']
+        exclude = ['total_cost', 'order_count', 'last_order_date', 'unpaid_amount', 'level']
 
 
 class OrderForm(forms.ModelForm):
@@ -136,7 +171,8 @@ class OrderForm(forms.ModelForm):
 
     class Meta:
         model = Order
-        exclude = ['consumer', 'warehouse']
+        # Склад заказа нужен для резерва: строки заказа без склада ничего не резервируют
+        exclude = ['consumer']
 
 
 class OrderUpdateForm(forms.ModelForm):
@@ -144,6 +180,7 @@ class OrderUpdateForm(forms.ModelForm):
     STATUS_CHOICES = [
         ('paid', 'оплачен'),
         ('shipped', 'отгружен'),
+        ('cancelled', 'отменён'),
     ]
 
     status = forms.ChoiceField(
@@ -158,11 +195,8 @@ class OrderUpdateForm(forms.ModelForm):
 
 
 class ProductInOrderForm(forms.ModelForm):
-    available_products = Product.objects.filter(
-        productinwarehouse__isnull=False).distinct()
-
     product = forms.ModelChoiceField(
-        queryset=available_products,
+        queryset=Product.objects.none(),
         label='Товары на складе',
     )
 
@@ -170,6 +204,29 @@ class ProductInOrderForm(forms.ModelForm):
         model = ProductInOrder
         exclude = ['order']
 
+    def __init__(self, *args, warehouse_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Только товары с доступным (не зарезервированным) остатком на складе заказа; товар изменяемой строки
+        # остаётся в списке, даже если весь его остаток занят этой же строкой
+        self.fields['product'].queryset = sellable_products(warehouse_id, keep_product_id=self.instance.product_id)
+        self.fields['product'].label_from_instance = lambda product: (
+            f'{product.name} — доступно {floatformat(product.available_quantity or 0, -2)}, '
+            f'рц {floatformat(product.retail_price, -2)}'
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        product = cleaned_data.get('product')
+        quantity = cleaned_data.get('quantity')
+        if product is not None and quantity is not None:
+            available = product.available_quantity or 0
+            if self.instance.pk and product.pk == self.instance.product_id:
+                # Свой резерв строки доступен ей самой
+                available += getattr(getattr(self.instance, 'reservation', None), 'quantity', 0)
+            if quantity > available:
+                self.add_error('quantity', f'На складе доступно только {floatformat(available, -2)}')
+        return cleaned_data
+
 
 class CostForm(forms.ModelForm):
     date_created = forms.DateField(
@@ -181,7 +238,7 @@ class CostForm(forms.ModelForm):
 
     class Meta:
         model = Cost
-        fields = '__all__'
+        exclude = Cost.SOURCE_FIELDS
 
 
 
@@ -195,4 +252,15 @@ class BalanceForm(forms.Form):
     date_to = forms.DateField(
         label='Дата конца периода',
         initial=current_date,
-    )
\ No newline at end of file
+    )
+
+class ImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл csv (первая строка — названия колонок, разделитель «,» или «;», кодировка UTF-8)',
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith('.csv'):
+            raise forms.ValidationError('Нужен файл в формате csv')
+        return file
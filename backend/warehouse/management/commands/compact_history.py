@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.services.history import HISTORY_MODELS, RETENTION_DAYS, CHUNK_SIZE, get_cutoff, compact_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Сжимает историю simple_history старше срока хранения: смены статуса остаются, серии прочих правок '
+        'сворачиваются до последней; убранные записи пишутся в gzip-архив. Прерванный запуск продолжается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=RETENTION_DAYS, help='Срок хранения полной истории, дней')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Объектов за один проход')
+        parser.add_argument('--models', nargs='*', default=None,
+                            help='Только эти модели: product, lot, order, ...')
+        parser.add_argument('--restart', action='store_true', help='Начать заново, не продолжая прошлый запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        models = HISTORY_MODELS
+        if options[ 'models' ]:
+            names = { model._meta.model_name: model for model in HISTORY_MODELS }
+            unknown = set(options[ 'models' ]) - set(names)
+            if unknown:
+                raise CommandError(f'Нет истории у моделей: {", ".join(sorted(unknown))}')
+            models = [ names[ name ] for name in options[ 'models' ] ]
+
+        cutoff = get_cutoff(options[ 'days' ])
+
+        def progress(model, last_object_id, removed):
+            self.stdout.write(f'\r{model._meta.model_name}: до объекта {last_object_id}, убрано {removed}', ending='')
+
+        total = 0
+        for model in models:
+            removed = compact_history(
+                model,
+                cutoff,
+                chunk_size=options[ 'chunk_size' ],
+                restart=options[ 'restart' ],
+                dry_run=options[ 'dry_run' ],
+                progress=progress,
+            )
+            total += removed
+            self.stdout.write(f'\r{model._meta.model_name}: убрано записей истории {removed}')
+        verb = 'Можно убрать' if options[ 'dry_run' ] else 'Убрано в архив'
+        self.stdout.write(self.style.SUCCESS(f'{verb}: {total}'))
@@ -0,0 +1,32 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.models import Category
+from warehouse.services.synthetic import DEFAULT_SCALE, generate_dataset, scaled
+
+
+class Command(BaseCommand):
+    help = 'Генерирует воспроизводимый синтетический набор данных склада (для нагрузочных замеров)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Seed генератора: один seed — один набор')
+        parser.add_argument('--scale', type=float, default=1.0, help='Множитель всех объёмов по умолчанию')
+        parser.add_argument('--prefix', default='bench', help='Префикс наименований (должен быть новым)')
+        for field in DEFAULT_SCALE._fields:
+            parser.add_argument(f'--{field.replace("_", "-")}', type=int, default=None,
+                                help=f'Переопределить {field} (по умолчанию {getattr(DEFAULT_SCALE, field)})')
+
+    def handle(self, *args, **options):
+        if Category.objects.filter(name__startswith=f'{options[ "prefix" ]} ').exists():
+            raise CommandError(f'Данные с префиксом "{options[ "prefix" ]}" уже есть, укажите другой --prefix')
+        scale = scaled(DEFAULT_SCALE, options[ 'scale' ])
+        scale = scale._replace(**{
+            field: options[ field ] for field in scale._fields if options[ field ] is not None
+        })
+        try:
+            counts = generate_dataset(scale, seed=options[ 'seed' ], prefix=options[ 'prefix' ])
+        except ValidationError as e:
+            raise CommandError('Набор не прошёл проверку и откачен:\n' + '\n'.join(e.messages))
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
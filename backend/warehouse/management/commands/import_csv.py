@@ -0,0 +1,41 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.services.imports import CHUNK_SIZE, import_products, import_lot_lines
+
+ERRORS_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт из csv: справочник продуктов (products) или товары в лот (lot_lines)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=[ 'products', 'lot_lines' ])
+        parser.add_argument('path', help='Файл csv')
+        parser.add_argument('--lot', type=int, default=None, help='Лот, для lot_lines')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Строк в пакете')
+
+    def handle(self, *args, **options):
+        if options[ 'kind' ] == 'lot_lines' and options[ 'lot' ] is None:
+            raise CommandError('Для lot_lines нужен --lot')
+
+        def progress(report):
+            self.stdout.write(f'\r{report.rows} строк, {report.get_rows_per_second()} строк/с', ending='')
+
+        try:
+            with open(options[ 'path' ], 'rb') as file:
+                if options[ 'kind' ] == 'products':
+                    report = import_products(file, chunk_size=options[ 'chunk_size' ], progress=progress)
+                else:
+                    report = import_lot_lines(file, options[ 'lot' ], chunk_size=options[ 'chunk_size' ],
+                                              progress=progress)
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+
+        self.stdout.write('')
+        for error in report.errors[ :ERRORS_SHOWN ]:
+            self.stdout.write(self.style.WARNING(f'Строка {error.line} ({error.name}): {error.message}'))
+        if report.error_count > ERRORS_SHOWN:
+            self.stdout.write(f'... и ещё {report.error_count - ERRORS_SHOWN}')
+        style = self.style.WARNING if report.error_count else self.style.SUCCESS
+        self.stdout.write(style(report.summary()))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from warehouse.services.outbox import BATCH_SIZE, process_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет события outbox (проводки после сохранений): новые, если они не выполнены после коммита, '
+        'и повторы после ошибок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Событий за один проход')
+        parser.add_argument('--poll', type=float, default=2, help='Пауза между опросами, сек.')
+        parser.add_argument('--once', action='store_true', help='Выполнить ожидающие события и завершиться')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed = process_outbox(batch_size=options[ 'batch_size' ])
+                if processed:
+                    self.stdout.write(f'Выполнено событий: {processed}')
+                if options[ 'once' ]:
+                    break
+                time.sleep(options[ 'poll' ])
+        except KeyboardInterrupt:
+            self.stdout.write('Остановка')
+        self.stdout.write(self.style.SUCCESS('Исполнитель outbox остановлен'))
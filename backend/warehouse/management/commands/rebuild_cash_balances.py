@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from warehouse.services.cash import rebuild_cash_balances
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные итоги DailyCashBalance по Cost'
+
+    def handle(self, *args, **options):
+        count = rebuild_cash_balances()
+        self.stdout.write(self.style.SUCCESS(f'Дневные итоги пересчитаны: {count} дней'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from warehouse.services.fifo import rebuild_cost_layers
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт слои FIFO и списания с них по журналу движений ProductInWarehouse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warehouse', type=int, default=None, help='Пересчитать только указанный склад')
+
+    def handle(self, *args, **options):
+        count = rebuild_cost_layers(warehouse_id=options[ 'warehouse' ])
+        self.stdout.write(self.style.SUCCESS(f'Слои FIFO пересчитаны: {count} движений'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from warehouse.services.search import create_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт полнотекстовый индекс продуктов (наименование, описание, категория)'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Индекс поиска пересчитан: {count} продуктов'))
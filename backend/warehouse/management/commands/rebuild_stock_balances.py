@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from warehouse.services.stock import rebuild_stock_balances
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу остатков StockBalance по журналу движений ProductInWarehouse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warehouse', type=int, default=None, help='Пересчитать только указанный склад')
+
+    def handle(self, *args, **options):
+        created = rebuild_stock_balances(warehouse_id=options[ 'warehouse' ])
+        self.stdout.write(self.style.SUCCESS(f'Остатки пересчитаны: {created} строк'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from warehouse.services.consumers import CHUNK_SIZE, recompute_parallel
+
+
+class Command(BaseCommand):
+    help = (
+        'Полный пересчёт статистики покупателей (сумма покупок, число заказов, дата последнего заказа, долг) '
+        'и уровней по правилам. Нужен после загрузок в обход сигналов (import_csv, generate_data) и смены правил'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Покупателей в одном пакете')
+        parser.add_argument('--workers', type=int, default=4, help='Число параллельных исполнителей')
+        parser.add_argument('--mode', choices=[ 'thread', 'process' ], default='thread',
+                            help='Пул потоков или процессов')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated = recompute_parallel(chunk_size=options[ 'chunk_size' ], workers=options[ 'workers' ],
+                                     mode=options[ 'mode' ])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано покупателей: {updated} за {time.perf_counter() - start:.2f} с'
+        ))
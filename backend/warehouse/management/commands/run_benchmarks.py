@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from warehouse.services.benchmark import ITERATIONS, WARMUP, run_benchmarks, compare_results
+
+
+class Command(BaseCommand):
+    help = 'Замеряет горячие экраны тестовым клиентом: p50/p95, число запросов; результат сохраняется в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=ITERATIONS, help='Замеров на экран')
+        parser.add_argument('--warmup', type=int, default=WARMUP, help='Прогревочных запросов на экран')
+        parser.add_argument('--output', default=None, help='Файл результата (по умолчанию benchmarks/<дата>.json)')
+        parser.add_argument('--compare', default=None, help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--host', default='localhost', help='Host запроса, должен быть в ALLOWED_HOSTS')
+        parser.add_argument('--only', nargs='*', default=None, help='Запустить только указанные замеры')
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(
+            iterations=options[ 'iterations' ],
+            warmup=options[ 'warmup' ],
+            host=options[ 'host' ],
+            only=options[ 'only' ],
+        )
+
+        self.stdout.write(f'{"замер":<28} {"код":>4} {"p50 мс":>9} {"p95 мс":>9} {"запросов":>9}')
+        for result in report[ 'results' ]:
+            self.stdout.write(
+                f'{result[ "name" ]:<28} {result[ "status" ]:>4} {result[ "p50_ms" ]:>9.1f} '
+                f'{result[ "p95_ms" ]:>9.1f} {result[ "queries" ]:>9}'
+            )
+
+        if options[ 'compare' ]:
+            previous = json.loads(Path(options[ 'compare' ]).read_text(encoding='utf-8'))
+            self.stdout.write('\nИзменение относительно прошлого прогона:')
+            for delta in compare_results(previous, report):
+                self.stdout.write(
+                    f'{delta[ "name" ]:<28} p50 {delta[ "p50_ms" ]:+.1f} мс, p95 {delta[ "p95_ms" ]:+.1f} мс, '
+                    f'запросов {delta[ "queries" ]:+d}'
+                )
+
+        output = Path(options[ 'output' ] or f'benchmarks/{now().strftime("%Y-%m-%d-%H%M%S")}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'Результат сохранён в {output}'))
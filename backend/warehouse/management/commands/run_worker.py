@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from warehouse.services.jobs import claim_job, execute_job, requeue_stale_jobs, worker_name
+
+REQUEUE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Фоновый исполнитель задач из таблицы Job: пул потоков или процессов, без внешнего брокера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Задач одновременно')
+        parser.add_argument('--mode', choices=[ 'thread', 'process' ], default='thread',
+                            help='thread — выгрузки и ввод-вывод, process — тяжёлые расчёты на нескольких ядрах')
+        parser.add_argument('--poll', type=float, default=2, help='Пауза между опросами пустой очереди, сек.')
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и завершиться')
+
+    def handle(self, *args, **options):
+        workers = max(1, options[ 'workers' ])
+        process_mode = options[ 'mode' ] == 'process'
+        executor_class = ProcessPoolExecutor if process_mode else ThreadPoolExecutor
+        name = worker_name()
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}')
+        self.stdout.write(f'Исполнитель {name}: {workers} ({options[ "mode" ]})')
+
+        running = set()
+        last_requeue = time.monotonic()
+        with executor_class(max_workers=workers) as executor:
+            try:
+                while True:
+                    # Берём задачи, пока есть свободные места в пуле
+                    while len(running) < workers:
+                        job_id = claim_job(name)
+                        if job_id is None:
+                            break
+                        if process_mode:
+                            # Дочерний процесс не должен унаследовать открытое соединение с базой
+                            connections.close_all()
+                        running.add(executor.submit(execute_job, job_id))
+                        self.stdout.write(f'Задача #{job_id} взята в работу')
+
+                    if not running and options[ 'once' ]:
+                        break
+
+                    if running:
+                        done, running = wait(running, timeout=options[ 'poll' ], return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.stdout.write(f'Задача #{future.result()} завершена')
+                    else:
+                        time.sleep(options[ 'poll' ])
+
+                    if time.monotonic() - last_requeue > REQUEUE_INTERVAL:
+                        requeue_stale_jobs()
+                        last_requeue = time.monotonic()
+            except KeyboardInterrupt:
+                self.stdout.write('Остановка: ждём завершения начатых задач')
+        self.stdout.write(self.style.SUCCESS('Исполнитель остановлен'))
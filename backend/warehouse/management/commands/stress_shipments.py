@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.models import Category
+from warehouse.services.stress import DEFAULT_STRESS_SCALE, run_shipment_stress
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочная проверка отгрузок: заказы на один и тот же товар отгружаются параллельно в нескольких '
+        'потоках, затем проверяется, что остаток не ушёл в минус и сошёлся с журналом и слоями FIFO'
+    )
+
+    def add_arguments(self, parser):
+        for field in DEFAULT_STRESS_SCALE._fields:
+            parser.add_argument(f'--{field}', type=int, default=getattr(DEFAULT_STRESS_SCALE, field),
+                                help=f'По умолчанию {getattr(DEFAULT_STRESS_SCALE, field)}')
+        parser.add_argument('--seed', type=int, default=0, help='Seed генератора заказов')
+        parser.add_argument('--prefix', default='stress', help='Префикс наименований (должен быть новым)')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        if Category.objects.filter(name__startswith=f'{options[ "prefix" ]} ').exists():
+            raise CommandError(f'Данные с префиксом "{options[ "prefix" ]}" уже есть, укажите другой --prefix')
+        scale = DEFAULT_STRESS_SCALE._replace(**{ field: options[ field ] for field in DEFAULT_STRESS_SCALE._fields })
+        result = run_shipment_stress(scale, seed=options[ 'seed' ], prefix=options[ 'prefix' ], keep=options[ 'keep' ])
+
+        self.stdout.write(f'{scale.orders} заказов в {scale.threads} потоках за {result.seconds:.2f} с: '
+                          f'отгружено {result.outcomes[ "shipped" ]}, не хватило товара {result.outcomes[ "short" ]}, '
+                          f'ошибок блокировки {result.outcomes[ "locked" ]}')
+        for violation in result.violations:
+            self.stdout.write(self.style.ERROR(violation))
+        if result.violations or result.outcomes[ 'locked' ]:
+            raise CommandError('Остатки не сошлись или отгрузки упали на блокировке')
+        self.stdout.write(self.style.SUCCESS('Остатки сошлись'))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from warehouse.services.replica import get_replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в файл реплики (settings.REPLICA_DATABASE_ALIAS) — локальная замена '
+        'репликации; с --interval повторяет копирование, изображая отставание реплики'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Копировать каждые N секунд, пока не прервут')
+
+    def handle(self, *args, **options):
+        alias = get_replica_alias()
+        if alias is None:
+            raise CommandError('Реплика не настроена: нет алиаса REPLICA_DATABASE_ALIAS в DATABASES')
+        primary = connections[ DEFAULT_DB_ALIAS ]
+        replica = connections[ alias ]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica нужна только для локальной пары файлов SQLite')
+
+        while True:
+            start = time.perf_counter()
+            primary.ensure_connection()
+            replica.ensure_connection()
+            # Онлайн-копия через backup API SQLite: основная база остаётся доступной для записи
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f'{replica.settings_dict[ "NAME" ]}: скопировано за '
+                              f'{(time.perf_counter() - start) * 1000:.0f} мс')
+            if options[ 'interval' ] is None:
+                break
+            time.sleep(options[ 'interval' ])
@@ -0,0 +1,97 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .services.queries import record_queries, recorded_iterator, get_query_budget, QueryBudgetExceeded
+from .services.replica import track_writes, pin_primary, get_replica_alias
+
+logger = logging.getLogger('warehouse.queries')
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Считает запросы и время каждого запроса пользователя, отдаёт цифры в заголовках X-Query-Stats и Server-Timing
+    (видны в панели разработчика браузера) и проверяет бюджет запросов вью.
+
+    Настройки:
+        QUERY_BUDGET_MODE — 'log' (по умолчанию) пишет превышение в лог, 'raise' падает с QueryBudgetExceeded;
+        QUERY_STATS_HEADER — отдавать ли заголовки (по умолчанию True);
+        QUERY_SLOW_REQUEST_MS — запросы медленнее этого порога пишутся в лог с самыми медленными SQL.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budget_mode = getattr(settings, 'QUERY_BUDGET_MODE', 'log')
+        self.stats_header = getattr(settings, 'QUERY_STATS_HEADER', True)
+        self.slow_request_ms = getattr(settings, 'QUERY_SLOW_REQUEST_MS', 1000)
+
+    def __call__(self, request):
+        request.query_budget = None
+        start = time.perf_counter()
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        request.query_stats = recorder
+        streaming = getattr(response, 'streaming', False)
+
+        if self.stats_header:
+            # Заголовки потокового ответа уходят раньше тела: в них только запросы вью, итог — в логе по закрытию
+            partial = '; partial=1' if streaming else ''
+            response[ 'X-Query-Stats' ] = (
+                f'queries={recorder.count}; db-ms={recorder.get_duration_ms():.1f}; '
+                f'total-ms={total_ms:.1f}; duplicates={len(recorder.get_duplicates())}{partial}'
+            )
+            response[ 'Server-Timing' ] = (
+                f'db;dur={recorder.get_duration_ms():.1f};desc="{recorder.count} queries'
+                f'{" before streaming" if streaming else ""}", total;dur={total_ms:.1f}'
+            )
+
+        if streaming:
+            def on_close(completed):
+                total_ms = (time.perf_counter() - start) * 1000
+                logger.info('Streamed %s %s: %.1f ms, %s queries, %.1f db ms', request.method, request.path, total_ms,
+                            recorder.count, recorder.get_duration_ms())
+                # Исключение на прерванном клиентом потоке только заменило бы GeneratorExit: там лишь пишем в лог
+                self.check_request(request, recorder, total_ms, can_raise=completed)
+
+            response.streaming_content = recorded_iterator(response.streaming_content, recorder, on_close)
+            return response
+
+        self.check_request(request, recorder, total_ms)
+        return response
+
+    def check_request(self, request, recorder, total_ms, can_raise=True):
+        if total_ms > self.slow_request_ms:
+            logger.warning('Slow request %s %s: %.1f ms, %s', request.method, request.path, total_ms,
+                           recorder.summary())
+
+        budget = request.query_budget
+        if budget is not None and recorder.count > budget:
+            message = (
+                f'{request.method} {request.path}: {recorder.count} queries, budget {budget}. '
+                f'Duplicates: {recorder.summary()[ "duplicate_fingerprints" ]}'
+            )
+            if self.budget_mode == 'raise' and can_raise:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Query budget exceeded: %s', message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Запрос, который что-то записал в основную базу, ставит cookie: следующие REPLICA_LAG_TOLERANCE секунд
+    отчёты этого пользователя читают из основной базы, а не с отстающей реплики
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if get_replica_alias() is None:
+            return self.get_response(request)
+        with track_writes() as writes:
+            response = self.get_response(request)
+        if writes.count:
+            pin_primary(response)
+        return response
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_stock_balances(apps, schema_editor):
+    ProductInWarehouse = apps.get_model('warehouse', 'ProductInWarehouse')
+    StockBalance = apps.get_model('warehouse', 'StockBalance')
+    balances = {}
+    for movement in ProductInWarehouse.objects.order_by('date_created', 'pk').iterator():
+        key = (movement.product_id, movement.warehouse_id)
+        balance = balances.setdefault(key, StockBalance(product_id=key[0], warehouse_id=key[1], quantity=0))
+        quantity = movement.quantity or 0
+        if movement.transaction in ['in', 'return']:
+            balance.quantity += quantity
+            if movement.cost_price is not None:
+                balance.last_cost_price = movement.cost_price
+        else:
+            balance.quantity -= quantity
+        balance.last_date = movement.date_created
+    StockBalance.objects.bulk_create(balances.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0002_auto_20230718_1713'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Остаток')),
+                ('last_cost_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Последняя себестоимость')),
+                ('last_date', models.DateField(blank=True, null=True, verbose_name='Дата последнего движения')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productinwarehouse',
+            index=models.Index(fields=['product', 'warehouse', 'date_created'], name='warehouse_p_product_c61460_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockbalance',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.product', verbose_name='Продукт'),
+        ),
+        migrations.AddField(
+            model_name='stockbalance',
+            name='warehouse',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.warehouse', verbose_name='Склад'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stockbalance',
+            unique_together={('product', 'warehouse')},
+        ),
+        migrations.RunPython(fill_stock_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:40
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def fill_average_cost(apps, schema_editor):
+    ProductInWarehouse = apps.get_model('warehouse', 'ProductInWarehouse')
+    StockBalance = apps.get_model('warehouse', 'StockBalance')
+    state = {}
+    for movement in ProductInWarehouse.objects.order_by('date_created', 'pk').iterator():
+        key = (movement.product_id, movement.warehouse_id)
+        quantity, average_cost = state.get(key, (Decimal(0), None))
+        movement_quantity = movement.quantity or Decimal(0)
+        if movement.transaction in ['in', 'return']:
+            if movement.cost_price is not None:
+                held = max(quantity, Decimal(0))
+                if held + movement_quantity > 0:
+                    average_cost = (held * (average_cost or 0) + movement_quantity * movement.cost_price) \
+                                   / (held + movement_quantity)
+            quantity += movement_quantity
+        else:
+            quantity -= movement_quantity
+        state[key] = (quantity, average_cost)
+    for (product_id, warehouse_id), (_, average_cost) in state.items():
+        if average_cost is not None:
+            StockBalance.objects.filter(product_id=product_id, warehouse_id=warehouse_id).update(
+                average_cost=average_cost.quantize(Decimal('0.0001')),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0003_stockbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockbalance',
+            name='average_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True, verbose_name='Средняя себестоимость'),
+        ),
+        migrations.RunPython(fill_average_cost, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:41
+
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+COST_PRECISION = Decimal('0.01')
+
+
+def fill_cost_layers(apps, schema_editor):
+    # Проигрываем журнал движений по FIFO, как rebuild_cost_layers: приход — слой, расход — списание с головы очереди
+    ProductInWarehouse = apps.get_model('warehouse', 'ProductInWarehouse')
+    StockBalance = apps.get_model('warehouse', 'StockBalance')
+    CostLayer = apps.get_model('warehouse', 'CostLayer')
+    CostLayerConsumption = apps.get_model('warehouse', 'CostLayerConsumption')
+    average_costs = {
+        (product_id, warehouse_id): (average_cost or Decimal(0)).quantize(COST_PRECISION)
+        for product_id, warehouse_id, average_cost
+        in StockBalance.objects.values_list('product_id', 'warehouse_id', 'average_cost')
+    }
+    movements = ProductInWarehouse.objects.order_by('product_id', 'warehouse_id', 'date_created', 'pk')
+
+    CostLayer.objects.bulk_create([
+        CostLayer(
+            product_id=movement.product_id,
+            warehouse_id=movement.warehouse_id,
+            movement_id=movement.pk,
+            date_created=movement.date_created,
+            quantity=movement.quantity or Decimal(0),
+            remaining_quantity=movement.quantity or Decimal(0),
+            cost_price=movement.cost_price if movement.cost_price is not None
+            else average_costs.get((movement.product_id, movement.warehouse_id), Decimal(0)),
+            is_open=(movement.quantity or Decimal(0)) > 0,
+        )
+        for movement in movements.filter(transaction__in=[ 'in', 'return' ]).iterator()
+    ], batch_size=1000)
+    layers = { layer.movement_id: layer for layer in CostLayer.objects.all() }
+
+    queues = defaultdict(deque)
+    consumptions = [ ]
+    outgoing_costs = { }
+    for movement in movements.iterator():
+        key = (movement.product_id, movement.warehouse_id)
+        if movement.transaction in [ 'in', 'return' ]:
+            queues[ key ].append(layers[ movement.pk ])
+            continue
+        needed = movement.quantity or Decimal(0)
+        taken = [ ]
+        queue = queues[ key ]
+        while needed > 0 and queue:
+            layer = queue[ 0 ]
+            quantity = min(layer.remaining_quantity, needed)
+            layer.remaining_quantity -= quantity
+            needed -= quantity
+            taken.append((layer.pk, quantity, layer.cost_price))
+            if layer.remaining_quantity <= 0:
+                queue.popleft()
+        if needed > 0:
+            taken.append((None, needed, average_costs.get(key, Decimal(0))))
+        consumptions += [
+            CostLayerConsumption(movement_id=movement.pk, layer_id=layer_id, quantity=quantity, cost_price=cost_price)
+            for layer_id, quantity, cost_price in taken
+        ]
+        quantity = sum([ quantity for _, quantity, _ in taken ], Decimal(0))
+        if quantity:
+            total = sum([ quantity * cost_price for _, quantity, cost_price in taken ], Decimal(0))
+            outgoing_costs[ movement.pk ] = (total / quantity).quantize(COST_PRECISION)
+
+    for layer in layers.values():
+        layer.is_open = layer.remaining_quantity > 0
+    CostLayer.objects.bulk_update(list(layers.values()), [ 'remaining_quantity', 'is_open' ], batch_size=1000)
+    CostLayerConsumption.objects.bulk_create(consumptions, batch_size=1000)
+    for pk, cost_price in outgoing_costs.items():
+        ProductInWarehouse.objects.filter(pk=pk).update(cost_price=cost_price)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0004_stockbalance_average_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateField(verbose_name='Дата')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Количество')),
+                ('remaining_quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Остаток слоя')),
+                ('cost_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Себестоимость')),
+                ('is_open', models.BooleanField(default=True, verbose_name='Открыт')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='productinwarehouse',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='warehouse.lot', verbose_name='Лот'),
+        ),
+        migrations.CreateModel(
+            name='CostLayerConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Количество')),
+                ('cost_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Себестоимость')),
+                ('layer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consumptions', to='warehouse.costlayer', verbose_name='Слой')),
+                ('movement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='layer_consumptions', to='warehouse.productinwarehouse', verbose_name='Расход')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='costlayer',
+            name='movement',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layer', to='warehouse.productinwarehouse', verbose_name='Приход'),
+        ),
+        migrations.AddField(
+            model_name='costlayer',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.product', verbose_name='Продукт'),
+        ),
+        migrations.AddField(
+            model_name='costlayer',
+            name='warehouse',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.warehouse', verbose_name='Склад'),
+        ),
+        migrations.AddIndex(
+            model_name='costlayer',
+            index=models.Index(fields=['product', 'warehouse', 'is_open', 'id'], name='warehouse_c_product_00d687_idx'),
+        ),
+        migrations.RunPython(fill_cost_layers, migrations.RunPython.noop),
+    ]
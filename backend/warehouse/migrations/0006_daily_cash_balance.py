@@ -0,0 +1,56 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:42
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_daily_cash_balances(apps, schema_editor):
+    Cost = apps.get_model('warehouse', 'Cost')
+    DailyCashBalance = apps.get_model('warehouse', 'DailyCashBalance')
+    rows = Cost.objects.values('date_created', 'transaction').annotate(amount=Sum('amount')) \
+        .order_by('date_created', 'transaction')
+    days = []
+    cumulative = {'in': Decimal(0), 'out': Decimal(0)}
+    for row in rows:
+        if row['transaction'] not in cumulative:
+            continue
+        if not days or days[-1].date != row['date_created']:
+            days.append(DailyCashBalance(date=row['date_created'], cumulative_in=cumulative['in'],
+                                         cumulative_out=cumulative['out']))
+        day = days[-1]
+        amount = row['amount'] or Decimal(0)
+        cumulative[row['transaction']] += amount
+        if row['transaction'] == 'in':
+            day.total_in += amount
+            day.cumulative_in = cumulative['in']
+        else:
+            day.total_out += amount
+            day.cumulative_out = cumulative['out']
+    DailyCashBalance.objects.bulk_create(days, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0005_cost_layers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCashBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('total_in', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Приход за день')),
+                ('total_out', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Расход за день')),
+                ('cumulative_in', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Приход на конец дня')),
+                ('cumulative_out', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Расход на конец дня')),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.RunPython(fill_daily_cash_balances, migrations.RunPython.noop),
+    ]
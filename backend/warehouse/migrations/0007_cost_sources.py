@@ -0,0 +1,96 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:45
+
+import re
+
+from django.db import migrations, models
+
+
+LOT_PAYMENT_NAME = re.compile(r'^Оплата лота (\d+)$')
+LOT_COST_NAME = re.compile(r'^Затраты (\d+) на лот #(\d+)$')
+ORDER_NAME = re.compile(r'^Продажа (\d+)$')
+
+
+def link_cost_sources(apps, schema_editor):
+    # Старые проводки опознаются по сгенерированному имени; при дублях источник получает только первая
+    Cost = apps.get_model('warehouse', 'Cost')
+    Lot = apps.get_model('warehouse', 'Lot')
+    LotCost = apps.get_model('warehouse', 'LotCost')
+    Order = apps.get_model('warehouse', 'Order')
+    lot_ids = set(Lot.objects.values_list('pk', flat=True))
+    lot_costs = dict(LotCost.objects.values_list('pk', 'lot_id'))
+    order_ids = set(Order.objects.values_list('pk', flat=True))
+
+    linked = set()
+    costs = []
+    for cost in Cost.objects.order_by('pk').iterator():
+        match = LOT_PAYMENT_NAME.match(cost.name)
+        if match and int(match[1]) in lot_ids and ('lot_payment', int(match[1])) not in linked:
+            cost.lot_id = cost.lot_payment_id = int(match[1])
+            linked.add(('lot_payment', cost.lot_payment_id))
+            costs.append(cost)
+            continue
+        match = LOT_COST_NAME.match(cost.name)
+        if match and lot_costs.get(int(match[1])) == int(match[2]) and ('lot_cost', int(match[1])) not in linked:
+            cost.lot_cost_id = int(match[1])
+            cost.lot_id = int(match[2])
+            linked.add(('lot_cost', cost.lot_cost_id))
+            costs.append(cost)
+            continue
+        match = ORDER_NAME.match(cost.name)
+        if match and cost.transaction == 'in' and int(match[1]) in order_ids and ('order', int(match[1])) not in linked:
+            cost.order_id = int(match[1])
+            linked.add(('order', cost.order_id))
+            costs.append(cost)
+    Cost.objects.bulk_update(costs, ['lot', 'lot_payment', 'lot_cost', 'order'], batch_size=1000)
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0006_daily_cash_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cost',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='costs', to='warehouse.lot', verbose_name='Лот'),
+        ),
+        migrations.AddField(
+            model_name='cost',
+            name='lot_cost',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cost', to='warehouse.lotcost', verbose_name='Затрата на лот'),
+        ),
+        migrations.AddField(
+            model_name='cost',
+            name='lot_payment',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_cost', to='warehouse.lot', verbose_name='Оплата лота'),
+        ),
+        migrations.AddField(
+            model_name='cost',
+            name='order',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cost', to='warehouse.order', verbose_name='Продажа'),
+        ),
+        migrations.AddField(
+            model_name='historicalcost',
+            name='lot',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='warehouse.lot', verbose_name='Лот'),
+        ),
+        migrations.AddField(
+            model_name='historicalcost',
+            name='lot_cost',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='warehouse.lotcost', verbose_name='Затрата на лот'),
+        ),
+        migrations.AddField(
+            model_name='historicalcost',
+            name='lot_payment',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='warehouse.lot', verbose_name='Оплата лота'),
+        ),
+        migrations.AddField(
+            model_name='historicalcost',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='warehouse.order', verbose_name='Продажа'),
+        ),
+        migrations.RunPython(link_cost_sources, migrations.RunPython.noop),
+    ]
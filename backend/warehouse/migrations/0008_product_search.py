@@ -0,0 +1,57 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:46
+
+from django.db import migrations
+
+# DDL поискового индекса на момент миграции: миграция не зависит от текущего кода warehouse.services.search
+DOCUMENT_SELECT = (
+    "SELECT p.id, p.name, COALESCE(p.description, ''), COALESCE(c.name, '') "
+    "FROM warehouse_product p LEFT JOIN warehouse_category c ON c.id = p.category_id"
+)
+
+CREATE_STATEMENTS = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS warehouse_product_fts USING fts5("
+        "name, description, category_name, tokenize='unicode61 remove_diacritics 2')",
+        f"INSERT INTO warehouse_product_fts (rowid, name, description, category_name) {DOCUMENT_SELECT}",
+    ],
+    'mysql': [
+        'CREATE TABLE IF NOT EXISTS warehouse_productsearch ('
+        'product_id BIGINT NOT NULL PRIMARY KEY, '
+        'name VARCHAR(100) NOT NULL, '
+        'description LONGTEXT NOT NULL, '
+        'category_name VARCHAR(100) NOT NULL, '
+        'FULLTEXT INDEX warehouse_productsearch_fulltext (name, description, category_name)'
+        ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4',
+        f"REPLACE INTO warehouse_productsearch (product_id, name, description, category_name) {DOCUMENT_SELECT}",
+    ],
+}
+
+DROP_STATEMENTS = {
+    'sqlite': ['DROP TABLE IF EXISTS warehouse_product_fts'],
+    'mysql': ['DROP TABLE IF EXISTS warehouse_productsearch'],
+}
+
+
+def execute_statements(statements, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            cursor.execute(statement)
+
+
+def create_product_search(apps, schema_editor):
+    execute_statements(CREATE_STATEMENTS, schema_editor)
+
+
+def drop_product_search(apps, schema_editor):
+    execute_statements(DROP_STATEMENTS, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0007_cost_sources'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_search, drop_product_search),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0008_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cost',
+            index=models.Index(fields=['date_created', 'id'], name='warehouse_c_date_cr_897fdc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lot',
+            index=models.Index(fields=['date_created', 'id'], name='warehouse_l_date_cr_859ec4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['consumer', 'date_created', 'id'], name='warehouse_o_consume_87ffd4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinwarehouse',
+            index=models.Index(fields=['warehouse', 'date_created', 'id'], name='warehouse_p_warehou_16bbea_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:02
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # Таблица кэша справочников (CACHES['reference']); команда пропускает уже существующие таблицы
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0009_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
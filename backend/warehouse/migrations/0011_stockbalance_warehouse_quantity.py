@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0010_reference_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockbalance',
+            index=models.Index(fields=['warehouse', 'quantity'], name='warehouse_s_warehou_22a87e_idx'),
+        ),
+    ]
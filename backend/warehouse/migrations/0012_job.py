@@ -0,0 +1,39 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0011_stockbalance_warehouse_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32, verbose_name='Вид задачи')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('status', models.CharField(choices=[('queued', 'в очереди'), ('running', 'выполняется'), ('done', 'готово'), ('failed', 'ошибка')], default='queued', max_length=16, verbose_name='Статус')),
+                ('progress_done', models.PositiveIntegerField(default=0, verbose_name='Выполнено')),
+                ('progress_total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего')),
+                ('message', models.TextField(blank=True, default='', verbose_name='Сообщение')),
+                ('result_file', models.FileField(blank=True, null=True, upload_to='jobs/%Y/%m/', verbose_name='Результат')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('worker', models.CharField(blank=True, default='', max_length=64, verbose_name='Исполнитель')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='Последняя отметка')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+            ],
+            options={
+                'ordering': ['-date_created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'id'], name='warehouse_j_status_0fedf6_idx'),
+        ),
+    ]
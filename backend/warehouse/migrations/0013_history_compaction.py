@@ -0,0 +1,25 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0012_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryCompaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=100, unique=True, verbose_name='Модель')),
+                ('cutoff', models.DateTimeField(verbose_name='Граница хранения')),
+                ('last_object_id', models.BigIntegerField(default=0, verbose_name='Последний обработанный объект')),
+                ('rows_archived', models.PositiveBigIntegerField(default=0, verbose_name='Записей в архиве')),
+                ('finished', models.BooleanField(default=False, verbose_name='Завершено')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+        ),
+    ]
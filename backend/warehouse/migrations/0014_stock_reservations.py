@@ -0,0 +1,62 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_stock_reservations(apps, schema_editor):
+    # Строки открытых заказов со складом резервируют товар; резерв может превысить остаток — так и было
+    ProductInOrder = apps.get_model('warehouse', 'ProductInOrder')
+    StockReservation = apps.get_model('warehouse', 'StockReservation')
+    StockBalance = apps.get_model('warehouse', 'StockBalance')
+    lines = ProductInOrder.objects.filter(order__warehouse__isnull=False) \
+        .exclude(order__status__in=['shipped', 'cancelled']) \
+        .values_list('pk', 'product_id', 'order__warehouse_id', 'quantity')
+    StockReservation.objects.bulk_create([
+        StockReservation(order_line_id=pk, product_id=product_id, warehouse_id=warehouse_id, quantity=quantity)
+        for pk, product_id, warehouse_id, quantity in lines
+    ], batch_size=1000)
+    totals = StockReservation.objects.values('product_id', 'warehouse_id').annotate(total=Sum('quantity')) \
+        .order_by()
+    for row in totals:
+        balance, _ = StockBalance.objects.get_or_create(product_id=row['product_id'], warehouse_id=row['warehouse_id'])
+        balance.reserved = row['total']
+        balance.save(update_fields=['reserved'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0013_history_compaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockbalance',
+            name='reserved',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='В резерве'),
+        ),
+        migrations.AlterField(
+            model_name='historicalorder',
+            name='status',
+            field=models.CharField(choices=[('new', 'новый'), ('paid', 'оплачен'), ('not_paid', 'не оплачен'), ('shipped', 'отгружен'), ('cancelled', 'отменён')], default='new', max_length=32, verbose_name='Статус покупки'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('new', 'новый'), ('paid', 'оплачен'), ('not_paid', 'не оплачен'), ('shipped', 'отгружен'), ('cancelled', 'отменён')], default='new', max_length=32, verbose_name='Статус покупки'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('order_line', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='warehouse.productinorder', verbose_name='Строка заказа')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.product', verbose_name='Продукт')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.warehouse', verbose_name='Склад')),
+            ],
+        ),
+        migrations.RunPython(fill_stock_reservations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0014_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinwarehouse',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='warehouse.order', verbose_name='Заказ'),
+        ),
+    ]
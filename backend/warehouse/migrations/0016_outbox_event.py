@@ -0,0 +1,33 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0015_product_in_warehouse_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32, verbose_name='Вид события')),
+                ('key', models.CharField(max_length=128, unique=True, verbose_name='Ключ')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Данные')),
+                ('status', models.CharField(choices=[('pending', 'ожидает'), ('done', 'выполнено'), ('failed', 'ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить не раньше')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Выполнено')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['status', 'available_at', 'id'], name='warehouse_o_status_137f6b_idx'),
+        ),
+    ]
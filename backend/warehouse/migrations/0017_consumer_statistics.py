@@ -0,0 +1,79 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:16
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, When, Value, F, Q, Sum, Count, Max, Subquery, OuterRef, IntegerField, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils.timezone import localdate
+
+# Правила уровней на момент миграции (DEFAULT_TIER_RULES), если CONSUMER_TIER_RULES не задан в настройках
+TIER_RULES = [
+    {'level': 4, 'min_revenue': 1000000, 'min_orders': 20, 'max_unpaid': 100000, 'active_days': 365},
+    {'level': 3, 'min_revenue': 300000, 'min_orders': 10, 'max_unpaid': 100000, 'active_days': 365},
+    {'level': 2, 'min_revenue': 50000, 'min_orders': 3},
+]
+
+
+def fill_consumer_statistics(apps, schema_editor):
+    # Как recompute_consumers: без этого счётчики начинались бы с нуля, и первые же отмены и оплаты
+    # уже существующих заказов уводили бы их в минус
+    Consumer = apps.get_model('warehouse', 'Consumer')
+    Order = apps.get_model('warehouse', 'Order')
+    ProductInOrder = apps.get_model('warehouse', 'ProductInOrder')
+    Cost = apps.get_model('warehouse', 'Cost')
+    decimal = DecimalField(max_digits=12, decimal_places=2)
+
+    orders = Order.objects.filter(consumer=OuterRef('pk')).exclude(status='cancelled').order_by().values('consumer')
+    revenue = Cost.objects.filter(order__consumer=OuterRef('pk'), transaction='in').order_by() \
+        .values('order__consumer').annotate(total=Sum('amount')).values('total')
+    unpaid = ProductInOrder.objects.exclude(order__status='cancelled').filter(
+        order__cost__isnull=True, order__consumer=OuterRef('pk'),
+    ).order_by().values('order__consumer') \
+        .annotate(total=Sum(F('quantity') * F('product__retail_price'), output_field=decimal)).values('total')
+    Consumer.objects.update(
+        total_cost=Coalesce(Subquery(revenue), Value(0), output_field=decimal),
+        order_count=Coalesce(Subquery(orders.annotate(count=Count('pk')).values('count')), Value(0)),
+        last_order_date=Subquery(orders.annotate(last=Max('date_created')).values('last')),
+        unpaid_amount=Coalesce(Subquery(unpaid), Value(0), output_field=decimal),
+    )
+
+    today = localdate()
+    rules = sorted(getattr(settings, 'CONSUMER_TIER_RULES', None) or TIER_RULES, key=lambda rule: rule['level'],
+                   reverse=True)
+    whens = []
+    for rule in rules:
+        condition = Q(total_cost__gte=rule.get('min_revenue', 0), order_count__gte=rule.get('min_orders', 0))
+        if rule.get('max_unpaid') is not None:
+            condition &= Q(unpaid_amount__lte=rule['max_unpaid'])
+        if rule.get('active_days') is not None:
+            condition &= Q(last_order_date__gte=today - timedelta(days=rule['active_days']))
+        whens.append(When(condition, then=Value(rule['level'])))
+    Consumer.objects.update(level=Case(*whens, default=Value(1), output_field=IntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0016_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consumer',
+            name='last_order_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Дата последнего заказа'),
+        ),
+        migrations.AddField(
+            model_name='consumer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Заказов'),
+        ),
+        migrations.AddField(
+            model_name='consumer',
+            name='unpaid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Не оплачено'),
+        ),
+        migrations.RunPython(fill_consumer_statistics, migrations.RunPython.noop),
+    ]
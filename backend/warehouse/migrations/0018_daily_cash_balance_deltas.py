@@ -0,0 +1,21 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0017_consumer_statistics'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dailycashbalance',
+            name='cumulative_in',
+        ),
+        migrations.RemoveField(
+            model_name='dailycashbalance',
+            name='cumulative_out',
+        ),
+    ]
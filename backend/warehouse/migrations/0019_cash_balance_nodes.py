@@ -0,0 +1,50 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:46
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Как в warehouse.services.cash на момент миграции
+CASH_EPOCH = date(1970, 1, 1)
+CASH_TREE_SIZE = 2 ** 16
+
+
+def fill_cash_balance_nodes(apps, schema_editor):
+    # Узлы дерева из уже посчитанных дневных итогов: день прибавляется ко всем узлам, в которые входит
+    DailyCashBalance = apps.get_model('warehouse', 'DailyCashBalance')
+    CashBalanceNode = apps.get_model('warehouse', 'CashBalanceNode')
+    nodes = defaultdict(lambda: [ Decimal(0), Decimal(0) ])
+    for day, total_in, total_out in DailyCashBalance.objects.values_list('date', 'total_in', 'total_out').iterator():
+        index = (day - CASH_EPOCH).days + 1
+        if not 1 <= index <= CASH_TREE_SIZE:
+            raise ValueError(f'Дата {day} вне диапазона накопленных итогов кассы')
+        while index <= CASH_TREE_SIZE:
+            nodes[ index ][ 0 ] += total_in
+            nodes[ index ][ 1 ] += total_out
+            index += index & -index
+    CashBalanceNode.objects.bulk_create([
+        CashBalanceNode(node=node, total_in=total_in, total_out=total_out)
+        for node, (total_in, total_out) in sorted(nodes.items())
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0018_daily_cash_balance_deltas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashBalanceNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.PositiveIntegerField(unique=True, verbose_name='Узел')),
+                ('total_in', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Приход')),
+                ('total_out', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Расход')),
+            ],
+        ),
+        migrations.RunPython(fill_cash_balance_nodes, migrations.RunPython.noop),
+    ]
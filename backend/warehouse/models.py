@@ -1,5 +1,7 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, When, F, Sum, Value, DecimalField, Subquery, OuterRef
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from simple_history.models import HistoricalRecords
 
@@ -25,8 +27,11 @@ class Product(models.Model):
     history = HistoricalRecords()
 
 
-    def is_available_in_warehouse(self):
-        return ProductInWarehouse.objects.filter(product=self).exists()
+    def is_available_in_warehouse(self, warehouse_id=None):
+        balances = StockBalance.objects.filter(product=self, quantity__gt=0)
+        if warehouse_id is not None:
+            balances = balances.filter(warehouse_id=warehouse_id)
+        return balances.exists()
 
     def __str__(self):
         return f'{self.name}, вес: {round(self.weight)} кг. рц: {round(self.retail_price)}'
@@ -87,6 +92,42 @@ class LotCost(models.Model):
         return f"{self.date_created} - {round(self.amount_spent)}"
 
 
+def lot_aggregate(model, expression):
+    # Агрегат по строкам лота коррелированным подзапросом, без GROUP BY по самому лоту
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(lot=OuterRef('pk'))
+            .order_by()
+            .values('lot')
+            .annotate(total=Sum(expression))
+            .values('total')
+        ),
+        Value(0),
+        output_field=DecimalField(),
+    )
+
+
+class LotQuerySet(models.QuerySet):
+    TOTALS_FIELDS = [
+        'total_lot_purchase_price',
+        'products_quantity',
+        'products_weight',
+        'total_lot_amount_spent',
+        'total',
+    ]
+
+    def with_totals(self):
+        return self.annotate(
+            total_lot_purchase_price=lot_aggregate(ProductInLot, F('quantity')*F('purchase_price')),
+            products_quantity=lot_aggregate(ProductInLot, F('quantity')),
+            products_weight=lot_aggregate(ProductInLot, F('quantity')*F('product__weight')),
+            total_lot_amount_spent=lot_aggregate(LotCost, F('amount_spent')),
+        ).annotate(
+            total=F('total_lot_purchase_price') + F('total_lot_amount_spent'),
+        )
+
+
 class Lot(models.Model):
     STATUS_CHOICES = [
         ('new', 'новый'),
@@ -101,20 +142,33 @@ class Lot(models.Model):
     status = models.CharField(verbose_name='Статус', max_length=32, choices=STATUS_CHOICES, default='new')
     history = HistoricalRecords()
 
+    objects = LotQuerySet.as_manager()
+
+    def load_totals(self):
+        # Если лот получен без with_totals(), досчитываем итоги одним запросом
+        if not hasattr(self, 'total'):
+            totals = Lot.objects.filter(pk=self.pk).with_totals().values(*LotQuerySet.TOTALS_FIELDS).get()
+            self.__dict__.update(totals)
+
     def get_total_lot_purchase_price(self):
-        return sum([ p.get_total_purchase_price() for p in self.productinlot_set.all() ])
+        self.load_totals()
+        return self.total_lot_purchase_price
 
     def get_products_quantity(self):
-        return sum([ p.quantity for p in self.productinlot_set.all() ])
+        self.load_totals()
+        return self.products_quantity
 
     def get_products_weight(self):
-        return sum([ p.get_total_weight() for p in self.productinlot_set.all() ])
+        self.load_totals()
+        return self.products_weight
 
     def get_total_lot_amount_spent(self):
-        return sum([ c.amount_spent for c in self.lotcost_set.all() ])
+        self.load_totals()
+        return self.total_lot_amount_spent
 
     def get_total(self):
-        return self.get_total_lot_purchase_price() + self.get_total_lot_amount_spent()
+        self.load_totals()
+        return self.total
 
     def get_status_display(self):
         status_display = dict(self.STATUS_CHOICES)
@@ -129,6 +183,9 @@ class Lot(models.Model):
     
     class Meta:
         ordering = [ '-date_created' ]
+        indexes = [
+            models.Index(fields=[ 'date_created', 'id' ]),
+        ]
 
 
 """
@@ -136,18 +193,69 @@ class Lot(models.Model):
 """
 
 
+def signed_movement(value, prefix=''):
+    # Приход и возврат со знаком плюс, отгрузка и списание со знаком минус
+    return Case(
+        When(**{ f'{prefix}transaction__in': ProductInWarehouse.INCOMING_TRANSACTIONS }, then=value),
+        default=-value,
+        output_field=DecimalField(max_digits=20, decimal_places=4),
+    )
+
+
+class WarehouseQuerySet(models.QuerySet):
+    VALUATION_FIELDS = [ 'total_quantity', 'total_cost_price', 'total_retail_price', 'total_weight' ]
+
+    def with_valuation(self):
+        """
+        Оценка склада по строкам StockBalance (по строке на товар), а не по всему журналу движений:
+        себестоимость — остаток по средней себестоимости, розница и вес — по текущим данным продукта
+        """
+        prefix = 'stockbalance__'
+        quantity = F(f'{prefix}quantity')
+        valuation = {
+            'total_quantity': quantity,
+            'total_cost_price': quantity*Coalesce(F(f'{prefix}average_cost'), Value(0)),
+            'total_retail_price': quantity*F(f'{prefix}product__retail_price'),
+            'total_weight': quantity*F(f'{prefix}product__weight'),
+        }
+        return self.annotate(**{
+            name: Coalesce(Sum(value, output_field=DecimalField()), Value(0), output_field=DecimalField())
+            for name, value in valuation.items()
+        })
+
+
 class Warehouse(models.Model):
     name = models.CharField(verbose_name='Наименование', max_length=100, unique=True)
     description = models.TextField(verbose_name='Описание', null=True, blank=True)
 
+    objects = WarehouseQuerySet.as_manager()
+
+    def load_valuation(self):
+        # Если склад получен без with_valuation(), досчитываем оценку одним запросом
+        if not hasattr(self, 'total_retail_price'):
+            valuation = (
+                Warehouse.objects
+                .filter(pk=self.pk)
+                .with_valuation()
+                .values(*WarehouseQuerySet.VALUATION_FIELDS)
+                .get()
+            )
+            self.__dict__.update(valuation)
+
     def get_total_warehouse_cost_price(self):
-        return sum([ p.get_total_cost_price() for p in self.productinwarehouse_set.all() ])
+        self.load_valuation()
+        return self.total_cost_price
 
     def get_total_warehouse_retail_price(self):
-        return sum([ p.get_total_retail_price() for p in self.productinwarehouse_set.all() ])
+        self.load_valuation()
+        return self.total_retail_price
+
+    def get_total_warehouse_weight(self):
+        self.load_valuation()
+        return self.total_weight
 
     def get_product_count(self):
-        return self.productinwarehouse_set.values('product').distinct().count()
+        return self.stockbalance_set.filter(quantity__gt=0).count()
 
     def __str__(self):
         return f"{self.name}"
@@ -160,12 +268,16 @@ class ProductInWarehouse(models.Model):
         ('return', 'возврат'),
         ('write_off', 'списание'),
     ]
+    INCOMING_TRANSACTIONS = [ 'in', 'return' ]
     product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE)
     date_created = models.DateField(verbose_name='Дата', auto_now_add=True)
     warehouse = models.ForeignKey(Warehouse, verbose_name='Склад', on_delete=models.CASCADE)
     quantity = models.DecimalField(verbose_name='Количество', max_digits=10, decimal_places=2, null=True)
     cost_price = models.DecimalField(verbose_name='Себестоимость', max_digits=10, decimal_places=2, null=True)
     transaction = models.CharField(verbose_name='Транзакция', max_length=10, choices=TRANSACTION_CHOICES)
+    lot = models.ForeignKey(Lot, verbose_name='Лот', on_delete=models.SET_NULL, null=True, blank=True)
+    # Отгрузка заказа: по этой ссылке заказ отгружается один раз
+    order = models.ForeignKey('Order', verbose_name='Заказ', on_delete=models.SET_NULL, null=True, blank=True)
 
     def get_total_cost_price(self):
         if self.transaction in [ 'in', 'return' ]:
@@ -196,12 +308,95 @@ class ProductInWarehouse(models.Model):
         return transaction_display.get(self.transaction, self.transaction)
 
     def clean(self):
-        if self.get_total_quantity() < 0:
+        if self.quantity is not None and self.quantity < 0:
             raise ValidationError('Количество не может быть отрицательным!')
+        # Расход не может увести остаток склада в минус; окончательно это проверяет services.shipment под блокировкой
+        if self.pk is None and self.transaction not in self.INCOMING_TRANSACTIONS and self.quantity \
+                and self.product_id is not None and self.warehouse_id is not None:
+            on_hand = StockBalance.objects.filter(product_id=self.product_id, warehouse_id=self.warehouse_id) \
+                .values_list('quantity', flat=True).first() or 0
+            if self.quantity > on_hand:
+                raise ValidationError(f'На складе только {round(on_hand, 2)}')
 
     def __str__(self):
         return f"{self.product}, Кол-во: {round(self.quantity)} шт."
 
+    class Meta:
+        indexes = [
+            models.Index(fields=[ 'product', 'warehouse', 'date_created' ]),
+            models.Index(fields=[ 'warehouse', 'date_created', 'id' ]),
+        ]
+
+
+class StockBalance(models.Model):
+    """
+    Остаток товара на складе, поддерживается сигналами из движений ProductInWarehouse
+    """
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE)
+    warehouse = models.ForeignKey(Warehouse, verbose_name='Склад', on_delete=models.CASCADE)
+    quantity = models.DecimalField(verbose_name='Остаток', max_digits=12, decimal_places=2, default=0)
+    reserved = models.DecimalField(verbose_name='В резерве', max_digits=12, decimal_places=2, default=0)
+    average_cost = models.DecimalField(verbose_name='Средняя себестоимость', max_digits=14, decimal_places=4,
+                                       null=True, blank=True)
+    last_cost_price = models.DecimalField(verbose_name='Последняя себестоимость', max_digits=10, decimal_places=2,
+                                          null=True, blank=True)
+    last_date = models.DateField(verbose_name='Дата последнего движения', null=True, blank=True)
+
+    def get_available(self):
+        # Можно обещать в новые заказы: остаток за вычетом резерва открытых заказов
+        return self.quantity - self.reserved
+
+    def __str__(self):
+        return f"{self.product} - {self.warehouse}: {round(self.quantity)} шт."
+
+    class Meta:
+        unique_together = [ 'product', 'warehouse' ]
+        indexes = [
+            models.Index(fields=[ 'warehouse', 'quantity' ]),
+        ]
+
+
+class CostLayer(models.Model):
+    """
+    Слой FIFO: приход товара на склад с его себестоимостью и неизрасходованным остатком
+    """
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE)
+    warehouse = models.ForeignKey(Warehouse, verbose_name='Склад', on_delete=models.CASCADE)
+    movement = models.OneToOneField(ProductInWarehouse, verbose_name='Приход', on_delete=models.CASCADE,
+                                    related_name='cost_layer')
+    date_created = models.DateField(verbose_name='Дата')
+    quantity = models.DecimalField(verbose_name='Количество', max_digits=12, decimal_places=2)
+    remaining_quantity = models.DecimalField(verbose_name='Остаток слоя', max_digits=12, decimal_places=2)
+    cost_price = models.DecimalField(verbose_name='Себестоимость', max_digits=10, decimal_places=2)
+    is_open = models.BooleanField(verbose_name='Открыт', default=True)
+
+    def __str__(self):
+        return f"{self.product} - {self.date_created}: {round(self.remaining_quantity)} из {round(self.quantity)}"
+
+    class Meta:
+        # Очередь открытых слоёв пары (продукт, склад) читается по индексу начиная с самого старого
+        indexes = [
+            models.Index(fields=[ 'product', 'warehouse', 'is_open', 'id' ]),
+        ]
+
+
+class CostLayerConsumption(models.Model):
+    """
+    Списание со слоя FIFO отгрузкой или списанием; layer пуст, если товара на складе не хватило
+    """
+    movement = models.ForeignKey(ProductInWarehouse, verbose_name='Расход', on_delete=models.CASCADE,
+                                 related_name='layer_consumptions')
+    layer = models.ForeignKey(CostLayer, verbose_name='Слой', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='consumptions')
+    quantity = models.DecimalField(verbose_name='Количество', max_digits=12, decimal_places=2)
+    cost_price = models.DecimalField(verbose_name='Себестоимость', max_digits=10, decimal_places=2)
+
+    def get_total_cost_price(self):
+        return self.quantity*self.cost_price
+
+    def __str__(self):
+        return f"{self.movement_id} <- {self.layer_id}: {round(self.quantity)} x {self.cost_price}"
+
 
 """
 Модели для продажи
@@ -211,7 +406,11 @@ class ProductInWarehouse(models.Model):
 class Consumer(models.Model):
     name = models.CharField(verbose_name='Наименование', max_length=100, unique=True)
     description = models.TextField(verbose_name='Описание', null=True, blank=True)
+    # Статистика покупателя ведётся приращениями F() (services.consumers), level — по правилам уровней
     total_cost = models.DecimalField(verbose_name='Сумма покупок', max_digits=12, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(verbose_name='Заказов', default=0)
+    last_order_date = models.DateField(verbose_name='Дата последнего заказа', null=True, blank=True)
+    unpaid_amount = models.DecimalField(verbose_name='Не оплачено', max_digits=12, decimal_places=2, default=0)
     level = models.IntegerField(verbose_name='Уровень', default=1)
 
     def __str__(self):
@@ -224,7 +423,10 @@ class Order(models.Model):
         ('paid', 'оплачен'),
         ('not_paid', 'не оплачен'),
         ('shipped', 'отгружен'),
+        ('cancelled', 'отменён'),
     ]
+    # В этих статусах строки заказа не держат резерв на складе
+    RELEASED_STATUSES = ( 'shipped', 'cancelled' )
     date_created = models.DateField(auto_now_add=True)
     description = models.TextField(verbose_name='Описание', null=True, blank=True)
     update_date = models.DateField(auto_now=True)
@@ -234,10 +436,22 @@ class Order(models.Model):
     history = HistoricalRecords()
 
     def get_total_order_retail_price(self):
-        return sum([ p.get_total_retail_price() for p in self.productinorder_set.all() ])
-    
+        return self.productinorder_set.aggregate(
+            total=Coalesce(Sum(F('quantity')*F('product__retail_price')), Value(0), output_field=DecimalField())
+        )[ 'total' ]
+
     def get_total_order_cost_price(self):
-        return sum([ p.get_total_cost_price() for p in self.productinorder_set.all() ])
+        # Себестоимость всего заказа по средней себестоимости склада одним запросом
+        return self.productinorder_set.aggregate(
+            total=Coalesce(
+                Sum(F('quantity')*ProductInOrder.average_cost_subquery(self.warehouse_id)),
+                Value(0),
+                output_field=DecimalField(),
+            )
+        )[ 'total' ]
+
+    def get_margin(self):
+        return self.get_total_order_retail_price() - self.get_total_order_cost_price()
 
     def get_total_order_weight(self):
         return sum([ p.get_total_weight() for p in self.productinorder_set.all() ])
@@ -246,11 +460,20 @@ class Order(models.Model):
         status_display = dict(self.STATUS_CHOICES)
         return status_display.get(self.status, self.status)
 
+    def save(self, *args, **kwargs):
+        # Сигналы заказа берут резерв и проводят отгрузку; при ValidationError откатывается и сам заказ,
+        # где бы ни сохраняли — в форме, админке, shell или импорте
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.date_created} - {self.consumer}"
     
     class Meta:
         ordering = [ '-date_created' ]
+        indexes = [
+            models.Index(fields=[ 'consumer', 'date_created', 'id' ]),
+        ]
 
 
 class ProductInOrder(models.Model):
@@ -260,28 +483,77 @@ class ProductInOrder(models.Model):
     quantity = models.DecimalField(verbose_name='Количество', max_digits=10, decimal_places=2)
     history = HistoricalRecords()
 
+    def save(self, *args, **kwargs):
+        # Резерв берётся в post_save: строка без резерва не должна остаться записанной, если остатка не хватило
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def get_total_retail_price(self):
         return self.quantity*self.product.retail_price
 
+    @staticmethod
+    def average_cost_subquery(warehouse_id=None):
+        # Средняя себестоимость товара на складе заказа; если склад не выбран — на складе с наибольшим остатком
+        balances = StockBalance.objects.filter(product=OuterRef('product'))
+        if warehouse_id is not None:
+            balances = balances.filter(warehouse_id=warehouse_id)
+        return Subquery(balances.order_by('-quantity').values('average_cost')[:1])
+
+    def get_average_cost(self):
+        balances = StockBalance.objects.filter(product_id=self.product_id)
+        if self.order.warehouse_id is not None:
+            balances = balances.filter(warehouse_id=self.order.warehouse_id)
+        return balances.order_by('-quantity').values_list('average_cost', flat=True).first() or 0
+
     def get_total_cost_price(self):
-        cost_price = ProductInWarehouse.objects.get(product=self.product).cost_price
-        return self.quantity*cost_price
+        return self.quantity*self.get_average_cost()
 
     def get_total_weight(self):
         return self.quantity*self.product.weight
 
+    @staticmethod
+    def warehouse_quantity_subquery(warehouse_id=None):
+        # Остаток товара на складе заказа; без склада — суммарный остаток на всех складах
+        balances = StockBalance.objects.filter(product=OuterRef('product'))
+        if warehouse_id is not None:
+            balances = balances.filter(warehouse_id=warehouse_id)
+        total = balances.values('product').annotate(total=Sum('quantity')).values('total')[:1]
+        return Coalesce(Subquery(total), Value(0), output_field=DecimalField())
+
     def get_product_quantity_in_warehouse(self):
-        return sum([ p.get_total_quantity() for p in self.product.productinwarehouse_set.all() ])
+        if hasattr(self, 'warehouse_quantity'):
+            return self.warehouse_quantity
+        balances = StockBalance.objects.filter(product_id=self.product_id)
+        if self.order.warehouse_id is not None:
+            balances = balances.filter(warehouse_id=self.order.warehouse_id)
+        return balances.aggregate(total=Sum('quantity'))[ 'total' ] or 0
 
     def clean(self):
         super().clean()
-        if not self.product.is_available_in_warehouse():
+        warehouse_id = self.order.warehouse_id if self.order_id else None
+        # Без продукта (не прошёл выбор в форме) ошибка уже есть у поля
+        if self.product_id is not None and not self.product.is_available_in_warehouse(warehouse_id):
             raise ValidationError(f"Продукт {self.product} недоступен на складе.")
 
     def __str__(self):
         return f"{self.product} {round(self.product.retail_price)} ({round(self.quantity)})"
 
 
+class StockReservation(models.Model):
+    """
+    Резерв строки заказа на складе заказа; сумма резервов по товару и складу хранится в StockBalance.reserved
+    """
+    order_line = models.OneToOneField(ProductInOrder, verbose_name='Строка заказа', on_delete=models.CASCADE,
+                                      related_name='reservation')
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE)
+    warehouse = models.ForeignKey(Warehouse, verbose_name='Склад', on_delete=models.CASCADE)
+    quantity = models.DecimalField(verbose_name='Количество', max_digits=10, decimal_places=2)
+    date_created = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.order_line_id}: {self.product_id} - {self.warehouse_id} ({self.quantity})"
+
+
 """
 Модели баланса
 """
@@ -298,11 +570,160 @@ class Cost(models.Model):
     amount = models.DecimalField(verbose_name='Сумма', max_digits=12, decimal_places=2)
     transaction = models.CharField(verbose_name='Вид прихода', max_length=10, choices=TRANSACTION_CHOICES)
     date_created = models.DateField(verbose_name='Дата создания', default=timezone.now)
+    # Источник проводки: по ним проверяется, проведена ли уже оплата лота, затрата на лот или продажа
+    lot = models.ForeignKey(Lot, verbose_name='Лот', on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='costs')
+    lot_payment = models.OneToOneField(Lot, verbose_name='Оплата лота', on_delete=models.SET_NULL, null=True,
+                                       blank=True, related_name='payment_cost')
+    lot_cost = models.OneToOneField(LotCost, verbose_name='Затрата на лот', on_delete=models.SET_NULL, null=True,
+                                    blank=True, related_name='cost')
+    order = models.OneToOneField(Order, verbose_name='Продажа', on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='cost')
     history = HistoricalRecords()
 
+    SOURCE_FIELDS = [ 'lot', 'lot_payment', 'lot_cost', 'order' ]
+
     def __str__(self):
         return f"Расход {self.name} - {round(self.amount)}"
     
     class Meta:
         ordering = [ '-date_created' ]
-    
\ No newline at end of file
+        indexes = [
+            models.Index(fields=[ 'date_created', 'id' ]),
+        ]
+    
+
+
+class DailyCashBalance(models.Model):
+    """
+    Дневной итог по Cost, поддерживается сигналами. Накопленные суммы хранит CashBalanceNode: запись задним
+    числом меняет одну строку дня и O(log дней) узлов, а не все последующие дни
+    """
+    date = models.DateField(verbose_name='Дата', unique=True)
+    total_in = models.DecimalField(verbose_name='Приход за день', max_digits=14, decimal_places=2, default=0)
+    total_out = models.DecimalField(verbose_name='Расход за день', max_digits=14, decimal_places=2, default=0)
+
+    def get_balance(self):
+        return self.total_in - self.total_out
+
+    def __str__(self):
+        return f"{self.date}: {round(self.get_balance())}"
+
+    class Meta:
+        ordering = [ '-date' ]
+
+
+class CashBalanceNode(models.Model):
+    """
+    Узел дерева Фенвика над дневными итогами (warehouse.services.cash): узел node держит сумму дней
+    (node - lowbit(node), node], где день 1 — CASH_EPOCH. Итог на дату — сумма не более 16 узлов
+    """
+    node = models.PositiveIntegerField(verbose_name='Узел', unique=True)
+    total_in = models.DecimalField(verbose_name='Приход', max_digits=16, decimal_places=2, default=0)
+    total_out = models.DecimalField(verbose_name='Расход', max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.node}: {round(self.total_in - self.total_out)}"
+
+
+"""
+Фоновые задачи
+"""
+
+
+class Job(models.Model):
+    """
+    Задача для фонового исполнителя (manage.py run_worker): выгрузки и проводки, которые не укладываются в запрос
+    """
+    STATUS_CHOICES = [
+        ('queued', 'в очереди'),
+        ('running', 'выполняется'),
+        ('done', 'готово'),
+        ('failed', 'ошибка'),
+    ]
+    kind = models.CharField(verbose_name='Вид задачи', max_length=32)
+    params = models.JSONField(verbose_name='Параметры', default=dict, blank=True)
+    status = models.CharField(verbose_name='Статус', max_length=16, choices=STATUS_CHOICES, default='queued')
+    progress_done = models.PositiveIntegerField(verbose_name='Выполнено', default=0)
+    progress_total = models.PositiveIntegerField(verbose_name='Всего', null=True, blank=True)
+    message = models.TextField(verbose_name='Сообщение', blank=True, default='')
+    result_file = models.FileField(verbose_name='Результат', upload_to='jobs/%Y/%m/', null=True, blank=True)
+    attempts = models.PositiveIntegerField(verbose_name='Попыток', default=0)
+    worker = models.CharField(verbose_name='Исполнитель', max_length=64, blank=True, default='')
+    date_created = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name='Начало', null=True, blank=True)
+    heartbeat = models.DateTimeField(verbose_name='Последняя отметка', null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name='Окончание', null=True, blank=True)
+
+    def get_status_display(self):
+        status_display = dict(self.STATUS_CHOICES)
+        return status_display.get(self.status, self.status)
+
+    def get_progress_percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.progress_total:
+            return None
+        return min(100, int(self.progress_done * 100 / self.progress_total))
+
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} - {self.get_status_display()}"
+
+    class Meta:
+        ordering = [ '-date_created' ]
+        indexes = [
+            models.Index(fields=[ 'status', 'id' ]),
+        ]
+
+
+class HistoryCompaction(models.Model):
+    """
+    Точка продолжения сжатия истории одной модели (manage.py compact_history): на каком объекте остановились
+    """
+    model_label = models.CharField(verbose_name='Модель', max_length=100, unique=True)
+    cutoff = models.DateTimeField(verbose_name='Граница хранения')
+    last_object_id = models.BigIntegerField(verbose_name='Последний обработанный объект', default=0)
+    rows_archived = models.PositiveBigIntegerField(verbose_name='Записей в архиве', default=0)
+    finished = models.BooleanField(verbose_name='Завершено', default=False)
+    date_updated = models.DateTimeField(verbose_name='Дата изменения', auto_now=True)
+
+    def __str__(self):
+        return f"{self.model_label} до {self.cutoff:%Y-%m-%d} - {self.last_object_id}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Побочный эффект сохранения (проводка продажи, оплаты лота), записанный в той же транзакции, что и само
+    изменение. Выполняется после коммита или исполнителем manage.py process_outbox; ключ не даёт записать
+    одно и то же событие дважды
+    """
+    STATUS_CHOICES = [
+        ('pending', 'ожидает'),
+        ('done', 'выполнено'),
+        ('failed', 'ошибка'),
+    ]
+    kind = models.CharField(verbose_name='Вид события', max_length=32)
+    key = models.CharField(verbose_name='Ключ', max_length=128, unique=True)
+    payload = models.JSONField(verbose_name='Данные', default=dict, blank=True)
+    status = models.CharField(verbose_name='Статус', max_length=16, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(verbose_name='Попыток', default=0)
+    last_error = models.TextField(verbose_name='Последняя ошибка', blank=True, default='')
+    available_at = models.DateTimeField(verbose_name='Выполнить не раньше', default=timezone.now)
+    date_created = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    processed_at = models.DateTimeField(verbose_name='Выполнено', null=True, blank=True)
+
+    def get_status_display(self):
+        status_display = dict(self.STATUS_CHOICES)
+        return status_display.get(self.status, self.status)
+
+    def __str__(self):
+        return f"{self.key} - {self.get_status_display()}"
+
+    class Meta:
+        # Исполнитель выбирает ожидающие события, чьё время подошло, по порядку записи
+        indexes = [
+            models.Index(fields=[ 'status', 'available_at', 'id' ]),
+        ]
@@ -0,0 +1,22 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from .services.replica import get_read_alias, get_replica_alias
+
+
+class ReplicaRouter:
+    """
+    Чтения внутри replica_reads() идут на реплику (settings.REPLICA_DATABASE_ALIAS), всё остальное — в default.
+    Запись всегда в default: объект, прочитанный с реплики, сохраняется в основную базу
+    """
+    def db_for_read(self, model, **hints):
+        return get_read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной базы, связи между объектами из них допустимы
+        databases = { DEFAULT_DB_ALIAS, get_replica_alias() }
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,160 @@
+import math
+import statistics
+import time
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils.timezone import now
+
+from ..models import Category, Product, Lot, Warehouse, ProductInWarehouse, Consumer, Order, Cost, Job
+from .jobs import claim, execute_job, worker_name
+from .queries import record_queries
+
+ITERATIONS = 20
+WARMUP = 2
+
+# run_jobs: запрос только ставит фоновую задачу, в замер входит и её выполнение, как это сделал бы run_worker
+BenchmarkCase = namedtuple('BenchmarkCase', [ 'name', 'method', 'url', 'data', 'rollback', 'run_jobs' ],
+                           defaults=[ False ])
+
+
+def busiest(queryset, relation, **filters):
+    return queryset.filter(**filters).annotate(rows=Count(relation)).order_by('-rows', 'pk').first()
+
+
+def benchmark_cases():
+    """
+    Горячие экраны на самых "тяжёлых" объектах набора данных; POST выполняется в откатываемой транзакции
+    """
+    cases = [ ]
+    warehouse = busiest(Warehouse.objects.all(), 'stockbalance')
+    lot = busiest(Lot.objects.all(), 'productinlot')
+    delivered_lot = busiest(Lot.objects.all(), 'productinlot', status='delivered')
+    consumer = busiest(Consumer.objects.all(), 'order')
+    order = busiest(Order.objects.all(), 'productinorder')
+
+    def add(name, url_name, method='get', data=None, rollback=False, run_jobs=False, **kwargs):
+        cases.append(BenchmarkCase(name, method, reverse(f'warehouse:{url_name}', kwargs=kwargs or None), data,
+                                   rollback, run_jobs))
+
+    if warehouse is not None:
+        add('warehouse_detail', 'warehouse_detail', pk=warehouse.pk)
+        add('warehouse_movements', 'productinwarehouse_list', warehouse_id=warehouse.pk)
+    if lot is not None:
+        add('lot_detail', 'lot_detail', pk=lot.pk)
+    if warehouse is not None and delivered_lot is not None:
+        add('lot_to_warehouse_preview', 'lot_to_warehouse_detail', warehouse_id=warehouse.pk, lot_id=delivered_lot.pk)
+        add('lot_to_warehouse_receive', 'lot_to_warehouse_detail', method='post', data={ }, rollback=True,
+            run_jobs=True, warehouse_id=warehouse.pk, lot_id=delivered_lot.pk)
+    if consumer is not None:
+        add('consumer_detail', 'consumer_detail', pk=consumer.pk)
+    add('balance', 'balance_list')
+    add('lot_list', 'lot_list')
+    add('cost_list', 'cost_list')
+    add('category_list_csv', 'category_list', data={ 'format': 'csv' })
+    add('warehouse_list_csv', 'warehouse_list', data={ 'format': 'csv' })
+    if lot is not None:
+        add('lot_detail_csv', 'lot_detail', data={ 'format': 'csv' }, pk=lot.pk)
+    if order is not None:
+        add('order_detail_csv', 'order_detail', data={ 'format': 'csv' }, pk=order.pk)
+    return cases
+
+
+def percentile(values, percent):
+    # Ближайший ранг: на 20 замерах p95 — это второй по величине замер
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[ index ]
+
+
+def run_submitted_jobs(last_job_id):
+    # Задачи, поставленные запросом, выполняются здесь же; чужие задачи из очереди не трогаем
+    for job_id in Job.objects.filter(pk__gt=last_job_id, status='queued').order_by('pk').values_list('pk', flat=True):
+        if claim(job_id, worker_name()):
+            execute_job(job_id)
+
+
+def request_once(client, case):
+    method = getattr(client, case.method)
+    last_job_id = Job.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    start = time.perf_counter()
+    with record_queries() as recorder:
+        response = method(case.url, case.data or { })
+        # Потоковый ответ (csv) собирается при чтении, поэтому читаем его внутри замера
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        else:
+            response.content
+        if case.run_jobs:
+            run_submitted_jobs(last_job_id)
+    return response.status_code, (time.perf_counter() - start) * 1000, recorder
+
+
+def run_case(client, case, iterations=ITERATIONS, warmup=WARMUP):
+    timings = [ ]
+    queries = [ ]
+    db_timings = [ ]
+    status = None
+    for i in range(warmup + iterations):
+        with transaction.atomic():
+            status, elapsed, recorder = request_once(client, case)
+            if case.rollback:
+                transaction.set_rollback(True)
+        if i < warmup:
+            continue
+        timings.append(elapsed)
+        queries.append(recorder.count)
+        db_timings.append(recorder.get_duration_ms())
+    return {
+        'name': case.name,
+        'method': case.method.upper(),
+        'url': case.url,
+        'params': case.data or { },
+        'status': status,
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': int(statistics.median(queries)),
+        'max_queries': max(queries),
+        'db_p50_ms': round(percentile(db_timings, 50), 2),
+    }
+
+
+def dataset_size():
+    return {
+        model._meta.model_name: model.objects.count()
+        for model in (Category, Product, Lot, Warehouse, ProductInWarehouse, Consumer, Order, Cost)
+    }
+
+
+def run_benchmarks(iterations=ITERATIONS, warmup=WARMUP, host='localhost', only=None):
+    client = Client(HTTP_HOST=host)
+    cases = [ case for case in benchmark_cases() if not only or case.name in only ]
+    return {
+        'started': now().isoformat(),
+        'dataset': dataset_size(),
+        'iterations': iterations,
+        'warmup': warmup,
+        'results': [ run_case(client, case, iterations, warmup) for case in cases ],
+    }
+
+
+def compare_results(previous, current):
+    # Изменение p50/p95 и числа запросов относительно прошлого прогона, по имени замера
+    previous_results = { result[ 'name' ]: result for result in previous.get('results', [ ]) }
+    for result in current[ 'results' ]:
+        before = previous_results.get(result[ 'name' ])
+        if before is None:
+            continue
+        yield {
+            'name': result[ 'name' ],
+            'p50_ms': round(result[ 'p50_ms' ] - before[ 'p50_ms' ], 2),
+            'p95_ms': round(result[ 'p95_ms' ] - before[ 'p95_ms' ], 2),
+            'queries': result[ 'queries' ] - before[ 'queries' ],
+        }
@@ -0,0 +1,164 @@
+from collections import namedtuple, defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Sum, DecimalField
+
+from ..models import Cost, DailyCashBalance, CashBalanceNode
+
+CashChange = namedtuple('CashChange', [ 'date', 'transaction', 'amount' ])
+
+TOTAL_FIELDS = { 'in': 'total_in', 'out': 'total_out' }
+REBUILD_BATCH_SIZE = 1000
+
+# Накопленные итоги — дерево Фенвика по дням от CASH_EPOCH (CashBalanceNode): изменение дня задним числом
+# прибавляется к не более чем CASH_TREE_DEPTH + 1 узлам, итог на дату — сумма не более CASH_TREE_DEPTH узлов.
+# 2 ** 16 дней — до 2149 года
+CASH_EPOCH = date(1970, 1, 1)
+CASH_TREE_DEPTH = 16
+CASH_TREE_SIZE = 2 ** CASH_TREE_DEPTH
+
+
+def cost_date(value):
+    # Cost.date_created по умолчанию получает datetime из timezone.now — приводим так же, как при сохранении
+    return Cost._meta.get_field('date_created').to_python(value)
+
+
+def cash_changes(costs, sign=1):
+    for cost in costs:
+        if cost.transaction not in TOTAL_FIELDS or cost.date_created is None:
+            continue
+        yield CashChange(
+            date=cost_date(cost.date_created),
+            transaction=cost.transaction,
+            amount=sign * (cost.amount or Decimal(0)),
+        )
+
+
+def day_index(day):
+    # Номер дня в дереве, с 1; даты до CASH_EPOCH и после последнего дня дерево не вмещает
+    index = (day - CASH_EPOCH).days + 1
+    if not 1 <= index <= CASH_TREE_SIZE:
+        raise ValueError(f'Дата {day} вне диапазона накопленных итогов кассы')
+    return index
+
+
+def update_nodes(index):
+    # Узлы, в сумму которых входит день index
+    while index <= CASH_TREE_SIZE:
+        yield index
+        index += index & -index
+
+
+def prefix_nodes(index):
+    # Узлы, сумма которых — итог дней 1..index
+    while index > 0:
+        yield index
+        index -= index & -index
+
+
+def node_totals(day_totals):
+    # (день, тип) -> сумма превращается в узел -> { поле: сумма }
+    nodes = defaultdict(lambda: defaultdict(Decimal))
+    for (day, movement_transaction), amount in day_totals.items():
+        for node in update_nodes(day_index(day)):
+            nodes[ node ][ TOTAL_FIELDS[ movement_transaction ] ] += amount
+    return nodes
+
+
+def apply_cash_changes(changes):
+    # Суммируем изменения по (дню, типу): один UPDATE на день и один на тип по всем затронутым узлам дерева
+    totals = defaultdict(Decimal)
+    for change in changes:
+        totals[ (change.date, change.transaction) ] += change.amount
+    totals = { key: amount for key, amount in totals.items() if amount }
+    if not totals:
+        return
+    nodes = node_totals(totals)
+
+    with transaction.atomic():
+        DailyCashBalance.objects.bulk_create(
+            [ DailyCashBalance(date=day) for day in sorted({ day for day, _ in totals }) ],
+            ignore_conflicts=True,
+        )
+        for (day, movement_transaction), amount in sorted(totals.items()):
+            total_field = TOTAL_FIELDS[ movement_transaction ]
+            DailyCashBalance.objects.filter(date=day).update(**{ total_field: F(total_field) + amount })
+
+        CashBalanceNode.objects.bulk_create([ CashBalanceNode(node=node) for node in sorted(nodes) ],
+                                            ignore_conflicts=True)
+        # Все затронутые узлы — одним UPDATE с CASE по номеру узла
+        for total_field in TOTAL_FIELDS.values():
+            amounts = sorted((node, fields[ total_field ]) for node, fields in nodes.items() if fields[ total_field ])
+            if not amounts:
+                continue
+            CashBalanceNode.objects.filter(node__in=[ node for node, _ in amounts ]).update(**{
+                total_field: F(total_field) + Case(
+                    *[ When(node=node, then=Value(amount)) for node, amount in amounts ],
+                    output_field=DecimalField(max_digits=16, decimal_places=2),
+                ),
+            })
+
+
+def prefix_index(day):
+    # Как day_index, но для границ запроса: даты вне дерева прижимаются к его краям
+    return min(max((day - CASH_EPOCH).days + 1, 0), CASH_TREE_SIZE)
+
+
+def prefix_totals(*indexes):
+    """
+    Приход и расход за дни 1..index для каждого index — одним запросом по узлам дерева
+    """
+    paths = { index: list(prefix_nodes(index)) for index in indexes }
+    rows = CashBalanceNode.objects.filter(node__in={ node for path in paths.values() for node in path }) \
+        .values_list('node', 'total_in', 'total_out')
+    nodes = { node: (total_in, total_out) for node, total_in, total_out in rows }
+    empty = (Decimal(0), Decimal(0))
+    return [
+        (sum((nodes.get(node, empty)[ 0 ] for node in paths[ index ]), Decimal(0)),
+         sum((nodes.get(node, empty)[ 1 ] for node in paths[ index ]), Decimal(0)))
+        for index in indexes
+    ]
+
+
+def get_period_totals(date_from, date_to):
+    # Приход и расход за [date_from, date_to]: разность двух накопленных итогов
+    if date_from > date_to:
+        return Decimal(0), Decimal(0)
+    before, through = prefix_totals(prefix_index(date_from) - 1, prefix_index(date_to))
+    return through[ 0 ] - before[ 0 ], through[ 1 ] - before[ 1 ]
+
+
+def get_total_balance():
+    # Корень дерева (узел CASH_TREE_SIZE) держит сумму всех дней
+    (total_in, total_out), = prefix_totals(CASH_TREE_SIZE)
+    return total_in - total_out
+
+
+def rebuild_cash_balances():
+    # Полный пересчёт из Cost: агрегат по дням в SQL, строки дней и узлы дерева — одним проходом по датам
+    rows = (
+        Cost.objects
+        .values('date_created', 'transaction')
+        .annotate(amount=Sum('amount'))
+        .order_by('date_created', 'transaction')
+    )
+    days = [ ]
+    totals = { }
+    with transaction.atomic():
+        DailyCashBalance.objects.all().delete()
+        CashBalanceNode.objects.all().delete()
+        for row in rows.iterator():
+            movement_transaction = row[ 'transaction' ]
+            if movement_transaction not in TOTAL_FIELDS:
+                continue
+            if not days or days[ -1 ].date != row[ 'date_created' ]:
+                days.append(DailyCashBalance(date=row[ 'date_created' ]))
+            setattr(days[ -1 ], TOTAL_FIELDS[ movement_transaction ], row[ 'amount' ] or Decimal(0))
+            totals[ (row[ 'date_created' ], movement_transaction) ] = row[ 'amount' ] or Decimal(0)
+        DailyCashBalance.objects.bulk_create(days, batch_size=REBUILD_BATCH_SIZE)
+        CashBalanceNode.objects.bulk_create([
+            CashBalanceNode(node=node, **fields) for node, fields in sorted(node_totals(totals).items())
+        ], batch_size=REBUILD_BATCH_SIZE)
+    return len(days)
@@ -0,0 +1,238 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, When, Value, F, Q, Sum, Count, Max, Subquery, OuterRef, IntegerField, DecimalField
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.timezone import localdate
+
+from ..models import Consumer, Order, ProductInOrder, Cost
+from .reservations import serialize_writes
+
+CHUNK_SIZE = 1000
+BASE_LEVEL = 1
+
+# Правило уровня: покупатель получает level, если выполнены все заданные условия. Правила проверяются
+# от старшего уровня к младшему, первое подходящее побеждает; не подошло ни одно — BASE_LEVEL.
+# max_unpaid и active_days (был заказ за столько дней) необязательны
+TierRule = namedtuple('TierRule', [ 'level', 'min_revenue', 'min_orders', 'max_unpaid', 'active_days' ],
+                      defaults=[ 0, 0, None, None ])
+
+DEFAULT_TIER_RULES = (
+    TierRule(level=4, min_revenue=1000000, min_orders=20, max_unpaid=100000, active_days=365),
+    TierRule(level=3, min_revenue=300000, min_orders=10, max_unpaid=100000, active_days=365),
+    TierRule(level=2, min_revenue=50000, min_orders=3),
+)
+
+
+def get_tier_rules():
+    # settings.CONSUMER_TIER_RULES — список словарей с полями TierRule
+    rules = getattr(settings, 'CONSUMER_TIER_RULES', None)
+    rules = [ TierRule(**rule) for rule in rules ] if rules is not None else DEFAULT_TIER_RULES
+    return sorted(rules, key=lambda rule: rule.level, reverse=True)
+
+
+def rule_condition(rule, today):
+    condition = Q(total_cost__gte=rule.min_revenue, order_count__gte=rule.min_orders)
+    if rule.max_unpaid is not None:
+        condition &= Q(unpaid_amount__lte=rule.max_unpaid)
+    if rule.active_days is not None:
+        condition &= Q(last_order_date__gte=today - timedelta(days=rule.active_days))
+    return condition
+
+
+def level_expression(rules=None, today=None):
+    """
+    Правила уровней одним CASE: уровень считается в самой базе, и для одного покупателя, и для всех сразу
+    """
+    today = today or localdate()
+    return Case(
+        *[ When(rule_condition(rule, today), then=Value(rule.level)) for rule in (rules or get_tier_rules()) ],
+        default=Value(BASE_LEVEL),
+        output_field=IntegerField(),
+    )
+
+
+def refresh_levels(consumers, today=None):
+    return consumers.update(level=level_expression(today=today))
+
+
+def bump(consumer_id, revenue=0, orders=0, unpaid=0, order_date=None):
+    """
+    Приращение статистики покупателя одним UPDATE с F(): параллельные проводки не теряют друг друга.
+    Уровень пересчитывается отдельным UPDATE — в одном запросе CASE видел бы значения до приращения
+    """
+    fields = { }
+    if revenue:
+        fields[ 'total_cost' ] = F('total_cost') + revenue
+    if orders:
+        fields[ 'order_count' ] = F('order_count') + orders
+    if unpaid:
+        fields[ 'unpaid_amount' ] = F('unpaid_amount') + unpaid
+    if order_date is not None:
+        fields[ 'last_order_date' ] = Greatest(Coalesce(F('last_order_date'), Value(order_date)), Value(order_date))
+    if not fields:
+        return
+    consumers = Consumer.objects.filter(pk=consumer_id)
+    consumers.update(**fields)
+    refresh_levels(consumers)
+
+
+def counts_as_order(status):
+    return status != 'cancelled'
+
+
+def is_unpaid(order):
+    # Не оплачен — заказ без проводки продажи, кроме отменённых
+    return counts_as_order(order.status) and not Cost.objects.filter(order_id=order.pk).exists()
+
+
+def unpaid_lines():
+    return ProductInOrder.objects.exclude(order__status='cancelled').filter(order__cost__isnull=True)
+
+
+def line_amount(line):
+    return (line.quantity or 0) * line.product.retail_price
+
+
+def last_order_date(consumer_id):
+    # Максимум не откатить приращением: после отмены или удаления заказа дата читается заново
+    return Order.objects.filter(consumer_id=consumer_id).exclude(status='cancelled') \
+        .aggregate(last=Max('date_created'))[ 'last' ]
+
+
+def order_saved(order, previous=None):
+    if previous is None:
+        if counts_as_order(order.status):
+            bump(order.consumer_id, orders=1, order_date=order.date_created)
+        return
+    was_counted, counted = counts_as_order(previous.status), counts_as_order(order.status)
+    if was_counted == counted:
+        return
+    sign = 1 if counted else -1
+    # Отмена и возврат в работу: неоплаченная сумма заказа уходит из долга и возвращается
+    unpaid = Decimal(0)
+    if not Cost.objects.filter(order_id=order.pk).exists():
+        unpaid = sign * order.get_total_order_retail_price()
+    if counted:
+        bump(order.consumer_id, orders=1, unpaid=unpaid, order_date=order.date_created)
+        return
+    consumers = Consumer.objects.filter(pk=order.consumer_id)
+    consumers.update(order_count=F('order_count') - 1, unpaid_amount=F('unpaid_amount') + unpaid,
+                     last_order_date=last_order_date(order.consumer_id))
+    refresh_levels(consumers)
+
+
+def order_deleted(order):
+    # Долг по строкам снимается их pre_delete
+    consumers = Consumer.objects.filter(pk=order.consumer_id)
+    if counts_as_order(order.status):
+        consumers.update(order_count=F('order_count') - 1)
+    consumers.update(last_order_date=last_order_date(order.consumer_id))
+    refresh_levels(consumers)
+
+
+def line_saved(line, previous=None):
+    if not is_unpaid(line.order):
+        return
+    delta = line_amount(line)
+    if previous is not None:
+        delta -= line_amount(previous)
+    bump(line.order.consumer_id, unpaid=delta)
+
+
+def line_deleted(line):
+    if is_unpaid(line.order):
+        bump(line.order.consumer_id, unpaid=-line_amount(line))
+
+
+def sale_posted(order, amount):
+    # Сумма продажи считается по текущим ценам, как и долг, поэтому долг уходит ровно на неё
+    bump(order.consumer_id, revenue=amount, unpaid=-amount)
+
+
+def price_changed(product_id, old_price, new_price):
+    # Долг по неоплаченным строкам считается по текущей цене: переоцениваем его у всех затронутых покупателей
+    rows = unpaid_lines().filter(product_id=product_id).values('order__consumer_id') \
+        .annotate(quantity=Sum('quantity')).order_by()
+    for row in rows:
+        bump(row[ 'order__consumer_id' ], unpaid=row[ 'quantity' ] * (new_price - old_price))
+
+
+def pk_ranges(queryset, chunk_size=CHUNK_SIZE):
+    # Границы пакетов (первый и последний pk) читаются только по индексу pk, без выборки строк
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        rest = pks if last is None else pks.filter(pk__gt=last)
+        first = rest.first()
+        if first is None:
+            return
+        end = list(rest[ chunk_size - 1:chunk_size ]) or [ rest.last() ]
+        last = end[ 0 ]
+        yield first, last
+
+
+def statistics_subqueries():
+    decimal = DecimalField(max_digits=12, decimal_places=2)
+    # order_by() снимает сортировку моделей по умолчанию: иначе она попала бы в GROUP BY подзапросов
+    orders = Order.objects.filter(consumer=OuterRef('pk')).exclude(status='cancelled').order_by().values('consumer')
+    revenue = Cost.objects.filter(order__consumer=OuterRef('pk'), transaction='in').order_by() \
+        .values('order__consumer').annotate(total=Sum('amount')).values('total')
+    unpaid = unpaid_lines().filter(order__consumer=OuterRef('pk')).order_by().values('order__consumer') \
+        .annotate(total=Sum(F('quantity') * F('product__retail_price'), output_field=decimal)).values('total')
+    return {
+        'total_cost': Coalesce(Subquery(revenue), Value(0), output_field=decimal),
+        'order_count': Coalesce(Subquery(orders.annotate(count=Count('pk')).values('count')), Value(0)),
+        'last_order_date': Subquery(orders.annotate(last=Max('date_created')).values('last')),
+        'unpaid_amount': Coalesce(Subquery(unpaid), Value(0), output_field=decimal),
+    }
+
+
+def recompute_consumers(first_pk, last_pk, today=None):
+    """
+    Полный пересчёт статистики и уровня покупателей из диапазона pk: по одному UPDATE с подзапросами
+    на статистику и на уровень. Возвращает число покупателей
+    """
+    consumers = Consumer.objects.filter(pk__gte=first_pk, pk__lte=last_pk)
+    with transaction.atomic():
+        serialize_writes()
+        updated = consumers.update(**statistics_subqueries())
+        refresh_levels(consumers, today=today)
+    return updated
+
+
+def recompute_chunk(bounds, today=None):
+    # Для пула потоков или процессов: своё соединение закрывается после пакета
+    try:
+        return recompute_consumers(*bounds, today=today)
+    finally:
+        connection.close()
+
+
+def recompute_all(consumers=None, chunk_size=CHUNK_SIZE, today=None):
+    consumers = consumers if consumers is not None else Consumer.objects.all()
+    return sum(recompute_consumers(first, last, today=today) for first, last in pk_ranges(consumers, chunk_size))
+
+
+def recompute_parallel(consumers=None, chunk_size=CHUNK_SIZE, workers=4, mode='thread'):
+    """
+    Пересчёт пакетами в пуле потоков или процессов. На MySQL (InnoDB) UPDATE блокирует только строки
+    своего диапазона pk, поэтому пакеты с непересекающимися диапазонами пишутся одновременно. На SQLite
+    запись всё равно идёт по очереди (serialize_writes), параллельно выполняются только чтения подзапросов
+    """
+    consumers = consumers if consumers is not None else Consumer.objects.all()
+    today = localdate()
+    ranges = list(pk_ranges(consumers, chunk_size))
+    if mode == 'process':
+        # Дочерние процессы не должны унаследовать открытое соединение родителя
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        return sum(executor.map(partial(recompute_chunk, today=today), ranges))
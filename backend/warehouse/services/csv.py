@@ -1,24 +1,106 @@
 import csv
 from urllib.parse import quote
 
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils.timezone import now
+from django.views.generic.detail import SingleObjectMixin
 
-from ..models import Product
+from ..models import Product, Warehouse, ProductInWarehouse
+from .keyset import iterate_in_chunks
 
+SIGNATURE_ROWS = [
+    [ ],  # Пустая строка
+    [ '', 'Ответственный', '______', '______' ],
+    [ '', 'Принял', '______', '______' ],
+]
+
+# Справочник продуктов подписывают поимённо
+PRODUCT_SIGNATURE_ROWS = [
+    [ ],  # Пустая строка
+    [ '', 'Ответственный', '______', 'Иванов А.Н' ],
+    [ '', 'Принял', '______', 'Петров К.Е.' ],
+]
+
+
+class Echo:
+    # csv.writer пишет строку в "файл" и возвращает то, что вернул write, — этого достаточно для генератора
+    def write(self, value):
+        return value
+
+
+def get_attribute(obj, attribute):
+    # 'product.name' -> obj.product.name, методы вызываются без аргументов
+    value = obj
+    for name in attribute.split('.'):
+        value = getattr(value, name)
+        if callable(value):
+            value = value()
+    return value
 
-def product_to_csv(request):
-    filename = f'Справочник продуктов от {now().strftime("%Y-%m-%d")}.csv'
-    response = HttpResponse(content_type='text/csv')
-    response[ 'Content-Disposition' ] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
 
-    writer = csv.writer(response)
-    writer.writerow([ "#", "Наименование", "Розничная цена", "Вес кг." ])
+def table_rows(objects, columns, columns_attributes):
+    yield columns
+    for obj in objects:
+        yield [ get_attribute(obj, attribute) for attribute in columns_attributes ]
 
-    products = Product.objects.all()
-    for product in products:
-        writer.writerow([ product.id, product.name, product.retail_price, product.weight ])
-    writer.writerow([ ])  # Пустая строка
-    writer.writerow([ '', 'Ответственный', '______', 'Иванов А.Н' ])
-    writer.writerow([ '', 'Принял', '______', 'Петров К.Е.' ])
+
+def queryset_rows(queryset, columns, columns_attributes, **chunk_options):
+    return table_rows(iterate_in_chunks(queryset, **chunk_options), columns, columns_attributes)
+
+
+def stream_csv(filename, rows):
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response[ 'Content-Disposition' ] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
     return response
+
+
+class CsvExportMixin:
+    """
+    Выгрузка в csv по ?format=csv: вью описывает строки в get_csv_rows, ответ отдаётся потоком
+    """
+    csv_filename = 'export'
+
+    def get_csv_filename(self):
+        return f'{self.csv_filename} от {now().strftime("%Y-%m-%d")}.csv'
+
+    def get_csv_rows(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'csv':
+            if isinstance(self, SingleObjectMixin):
+                self.object = self.get_object()
+            return stream_csv(self.get_csv_filename(), self.get_csv_rows())
+        return super().get(request, *args, **kwargs)
+
+
+PRODUCT_CSV_COLUMNS = [ '#', 'Наименование', 'Розничная цена', 'Вес кг.' ]
+PRODUCT_CSV_COLUMNS_ATTRIBUTES = [ 'pk', 'name', 'retail_price', 'weight' ]
+
+
+def product_rows(signature_rows=PRODUCT_SIGNATURE_ROWS):
+    # Выгрузка всего справочника идёт порциями из базы, а не через кэш справочников: память не растёт с каталогом
+    yield from queryset_rows(Product.objects.all(), PRODUCT_CSV_COLUMNS, PRODUCT_CSV_COLUMNS_ATTRIBUTES)
+    yield from signature_rows
+
+
+def product_to_csv(request):
+    return stream_csv(f'Справочник продуктов от {now().strftime("%Y-%m-%d")}.csv', product_rows())
+
+
+def warehouse_rows():
+    yield [ ]
+    # Движения всех складов читаются одним потоком по (склад, pk) и раскладываются по складам
+    products_in_warehouse = iterate_in_chunks(
+        ProductInWarehouse.objects.select_related('product'),
+        ordering=('warehouse_id', 'pk'),
+    )
+    product_in_warehouse = next(products_in_warehouse, None)
+    for warehouse in Warehouse.objects.order_by('pk'):
+        yield [ warehouse.id, warehouse.name, warehouse.description ]
+        yield [ '', 'Список продуктов на складе' ]
+        while product_in_warehouse is not None and product_in_warehouse.warehouse_id == warehouse.pk:
+            yield [ '', product_in_warehouse.product.name, product_in_warehouse.quantity ]
+            product_in_warehouse = next(products_in_warehouse, None)
+    yield from SIGNATURE_ROWS
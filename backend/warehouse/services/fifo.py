@@ -0,0 +1,164 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, F
+
+from ..models import ProductInWarehouse, StockBalance, CostLayer, CostLayerConsumption
+from .keyset import iterate_in_chunks
+
+LAYER_BATCH_SIZE = 100
+COST_PRECISION = Decimal('0.01')
+
+
+def is_incoming(movement):
+    return movement.transaction in ProductInWarehouse.INCOMING_TRANSACTIONS
+
+
+def fallback_cost_price(product_id, warehouse_id):
+    # Возврат без себестоимости и расход сверх остатка оцениваем по средней себестоимости склада
+    average_cost = StockBalance.objects.filter(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+    ).values_list('average_cost', flat=True).first()
+    return (average_cost or Decimal(0)).quantize(COST_PRECISION)
+
+
+def build_layer(movement):
+    quantity = movement.quantity or Decimal(0)
+    cost_price = movement.cost_price
+    if cost_price is None:
+        cost_price = fallback_cost_price(movement.product_id, movement.warehouse_id)
+    return CostLayer(
+        product_id=movement.product_id,
+        warehouse_id=movement.warehouse_id,
+        movement=movement,
+        date_created=movement.date_created,
+        quantity=quantity,
+        remaining_quantity=quantity,
+        cost_price=cost_price,
+        is_open=quantity > 0,
+    )
+
+
+def create_cost_layers(movements):
+    # Приходы становятся в конец очереди слоёв своей пары (продукт, склад)
+    layers = [ build_layer(movement) for movement in movements if is_incoming(movement) ]
+    CostLayer.objects.bulk_create(layers, batch_size=LAYER_BATCH_SIZE)
+    return layers
+
+
+def consume_layers(movement):
+    # Забираем слои с головы очереди порциями; закрытые слои в индекс (продукт, склад, is_open) больше не попадают,
+    # поэтому каждый слой читается не более одного раза за свою жизнь, сколько бы приходов ни было у товара
+    needed = movement.quantity or Decimal(0)
+    consumptions = [ ]
+    with transaction.atomic():
+        open_layers = CostLayer.objects.select_for_update().filter(
+            product_id=movement.product_id,
+            warehouse_id=movement.warehouse_id,
+            is_open=True,
+        ).order_by('pk')
+        while needed > 0:
+            layers = list(open_layers[ :LAYER_BATCH_SIZE ])
+            if not layers:
+                break
+            for layer in layers:
+                quantity = min(layer.remaining_quantity, needed)
+                layer.remaining_quantity -= quantity
+                layer.is_open = layer.remaining_quantity > 0
+                needed -= quantity
+                consumptions.append(CostLayerConsumption(
+                    movement=movement,
+                    layer=layer,
+                    quantity=quantity,
+                    cost_price=layer.cost_price,
+                ))
+                if needed <= 0:
+                    break
+            CostLayer.objects.bulk_update(layers, [ 'remaining_quantity', 'is_open' ])
+        if needed > 0:
+            # Товара в слоях не хватило: фиксируем непокрытое количество без слоя
+            consumptions.append(CostLayerConsumption(
+                movement=movement,
+                layer=None,
+                quantity=needed,
+                cost_price=fallback_cost_price(movement.product_id, movement.warehouse_id),
+            ))
+        CostLayerConsumption.objects.bulk_create(consumptions)
+
+        quantity = sum([ c.quantity for c in consumptions ], Decimal(0))
+        if quantity:
+            total = sum([ c.get_total_cost_price() for c in consumptions ], Decimal(0))
+            movement.cost_price = (total / quantity).quantize(COST_PRECISION)
+            ProductInWarehouse.objects.filter(pk=movement.pk).update(cost_price=movement.cost_price)
+    return consumptions
+
+
+def release_layers(movement):
+    # Отмена расхода: возвращаем количество в слои, из которых оно было взято
+    with transaction.atomic():
+        consumptions = list(
+            CostLayerConsumption.objects
+            .filter(movement_id=movement.pk, layer__isnull=False)
+            .values('layer_id')
+            .annotate(quantity=Sum('quantity'))
+            .order_by()
+        )
+        for consumption in consumptions:
+            CostLayer.objects.filter(pk=consumption[ 'layer_id' ]).update(
+                remaining_quantity=F('remaining_quantity') + consumption[ 'quantity' ],
+                is_open=True,
+            )
+        CostLayerConsumption.objects.filter(movement_id=movement.pk).delete()
+
+
+def adjust_layer(movement):
+    # Изменение прихода: слой сохраняет уже сделанные списания, меняется только неизрасходованная часть
+    layer = CostLayer.objects.select_for_update().filter(movement_id=movement.pk).first()
+    if layer is None:
+        create_cost_layers([ movement ])
+        return
+    quantity = movement.quantity or Decimal(0)
+    layer.product_id = movement.product_id
+    layer.warehouse_id = movement.warehouse_id
+    layer.remaining_quantity = max(layer.remaining_quantity + quantity - layer.quantity, Decimal(0))
+    layer.quantity = quantity
+    if movement.cost_price is not None:
+        layer.cost_price = movement.cost_price
+    layer.is_open = layer.remaining_quantity > 0
+    layer.save()
+
+
+def sync_cost_layers(movement, previous=None):
+    with transaction.atomic():
+        if previous is not None:
+            if is_incoming(previous) and is_incoming(movement):
+                adjust_layer(movement)
+                return
+            if is_incoming(previous):
+                CostLayer.objects.filter(movement_id=movement.pk).delete()
+            else:
+                release_layers(previous)
+        if is_incoming(movement):
+            create_cost_layers([ movement ])
+        else:
+            consume_layers(movement)
+
+
+def rebuild_cost_layers(warehouse_id=None):
+    # Полный пересчёт FIFO по журналу: слои и списания создаются заново в порядке движений
+    movements = ProductInWarehouse.objects.all()
+    if warehouse_id is not None:
+        movements = movements.filter(warehouse_id=warehouse_id)
+    with transaction.atomic():
+        CostLayer.objects.filter(movement__in=movements).delete()
+        CostLayerConsumption.objects.filter(movement__in=movements).delete()
+        ordering = ('product_id', 'warehouse_id', 'date_created', 'pk')
+        count = 0
+        for movement in iterate_in_chunks(movements, ordering=ordering):
+            if is_incoming(movement):
+                create_cost_layers([ movement ])
+            else:
+                consume_layers(movement)
+            count += 1
+    return count
@@ -0,0 +1,136 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.timezone import now
+
+from ..models import Product, ProductInLot, LotCost, Lot, Order, ProductInOrder, Cost, HistoryCompaction
+
+HISTORY_MODELS = ( Product, ProductInLot, LotCost, Lot, Order, ProductInOrder, Cost )
+RETENTION_DAYS = 180
+CHUNK_SIZE = 500  # объектов (не записей истории) за один проход
+DELETE_BATCH_SIZE = 500
+STATUS_FIELD = 'status'
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'HISTORY_ARCHIVE_DIR', settings.BASE_DIR / 'history_archive'))
+
+
+def get_cutoff(days=RETENTION_DAYS):
+    return now() - timedelta(days=days)
+
+
+def status_history(obj):
+    # История для страницы объекта: порядок и поля — в запросе, а не разворотом всего списка в Python
+    return obj.history.order_by('history_date', 'history_id').only('history_id', 'history_date', STATUS_FIELD)
+
+
+def compaction_victims(records, status_field=None):
+    """
+    Записи истории одного объекта (по возрастанию даты), которые можно убрать: из каждой серии правок
+    без смены статуса остаётся последняя. Создание, удаление и каждая смена статуса сохраняются
+    """
+    victims = [ ]
+    run = [ ]
+    previous = None
+    for record in records:
+        status_changed = (
+            status_field is not None and previous is not None and record[ status_field ] != previous[ status_field ]
+        )
+        if record[ 'history_type' ] != '~' or status_changed:
+            victims.extend(run[ :-1 ])
+            run = [ ]
+        else:
+            run.append(record)
+        previous = record
+    victims.extend(run[ :-1 ])
+    return victims
+
+
+def write_archive(model, cutoff, object_ids, records):
+    """
+    Убранные записи пишутся в gzip с JSON по строке на запись. Имя файла зависит только от модели,
+    границы и объектов пакета, поэтому повтор пакета после сбоя перезаписывает тот же файл
+    """
+    directory = get_archive_dir() / model._meta.label_lower
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{cutoff:%Y%m%d%H%M%S}-{object_ids[ 0 ]}-{object_ids[ -1 ]}.jsonl.gz'
+    temporary = path.with_suffix('.tmp')
+    with gzip.open(temporary, 'wt', encoding='utf-8') as archive:
+        for record in records:
+            archive.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False))
+            archive.write('\n')
+    os.replace(temporary, path)
+    return path
+
+
+def get_checkpoint(model, cutoff, restart=False):
+    # Незавершённое сжатие продолжается со своей границей, иначе начинается заново с новой
+    checkpoint, created = HistoryCompaction.objects.get_or_create(
+        model_label=model._meta.label_lower,
+        defaults={ 'cutoff': cutoff },
+    )
+    if not created and (restart or checkpoint.finished):
+        checkpoint.cutoff = cutoff
+        checkpoint.last_object_id = 0
+        checkpoint.finished = False
+        checkpoint.save()
+    return checkpoint
+
+
+def compact_history(model, cutoff, chunk_size=CHUNK_SIZE, restart=False, dry_run=False, progress=None):
+    """
+    Сжимает историю модели старше cutoff пакетами объектов по возрастанию id. После каждого пакета
+    запоминается последний объект, так что прерванный запуск продолжается с места остановки.
+    Возвращает число убранных записей
+    """
+    history = model.history.model
+    status_field = STATUS_FIELD if any(field.name == STATUS_FIELD for field in model._meta.fields) else None
+    if dry_run:
+        checkpoint = HistoryCompaction(model_label=model._meta.label_lower, cutoff=cutoff)
+    else:
+        checkpoint = get_checkpoint(model, cutoff, restart)
+    cutoff = checkpoint.cutoff
+    removed = 0
+
+    while True:
+        old_history = history.objects.filter(history_date__lt=cutoff)
+        object_ids = list(
+            old_history.filter(id__gt=checkpoint.last_object_id)
+            .order_by('id').values_list('id', flat=True).distinct()[ :chunk_size ]
+        )
+        if not object_ids:
+            break
+        records = old_history.filter(id__in=object_ids).order_by('id', 'history_date', 'history_id').values()
+        victims = [ ]
+        for _, object_records in groupby(records, key=itemgetter('id')):
+            victims.extend(compaction_victims(object_records, status_field))
+
+        if not dry_run:
+            if victims:
+                write_archive(model, cutoff, object_ids, victims)
+            with transaction.atomic():
+                victim_ids = [ victim[ 'history_id' ] for victim in victims ]
+                for start in range(0, len(victim_ids), DELETE_BATCH_SIZE):
+                    history.objects.filter(history_id__in=victim_ids[ start:start + DELETE_BATCH_SIZE ]).delete()
+                checkpoint.last_object_id = object_ids[ -1 ]
+                checkpoint.rows_archived += len(victims)
+                checkpoint.save()
+        else:
+            checkpoint.last_object_id = object_ids[ -1 ]
+        removed += len(victims)
+        if progress:
+            progress(model, checkpoint.last_object_id, removed)
+
+    if not dry_run:
+        checkpoint.finished = True
+        checkpoint.save()
+    return removed
@@ -0,0 +1,300 @@
+import codecs
+import csv
+import time
+from collections import namedtuple
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from ..models import Category, Product, Lot
+from . import consumers
+from .lot import LotLineInput, validate_lot_lines, insert_lot_lines
+from .reference import invalidate_reference, invalidate_products
+from .search import index_products
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+SNIFF_SIZE = 64 * 1024
+
+# Колонки файла поставщика -> поле; названия совпадают с колонками наших выгрузок в csv
+PRODUCT_COLUMNS = {
+    'наименование': 'name',
+    'name': 'name',
+    'категория': 'category',
+    'category': 'category',
+    'розничная цена': 'retail_price',
+    'retail_price': 'retail_price',
+    'вес кг.': 'weight',
+    'вес': 'weight',
+    'weight': 'weight',
+    'описание': 'description',
+    'description': 'description',
+}
+LOT_LINE_COLUMNS = {
+    'наименование': 'name',
+    'name': 'name',
+    'товар': 'name',
+    'количество': 'quantity',
+    'quantity': 'quantity',
+    'закупочная цена': 'purchase_price',
+    'purchase_price': 'purchase_price',
+    'описание': 'description',
+    'description': 'description',
+}
+
+ImportRowError = namedtuple('ImportRowError', [ 'line', 'name', 'message' ])
+
+
+class ImportReport:
+    """
+    Итог импорта: счётчики, скорость и ошибки по строкам (первые MAX_REPORTED_ERRORS)
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.error_count = 0
+        self.errors = [ ]
+        self.started = time.monotonic()
+        self.finished = None
+
+    def add_error(self, line, name, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(ImportRowError(line, name, message))
+
+    def finish(self):
+        self.finished = time.monotonic()
+        return self
+
+    def get_elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def get_rows_per_second(self):
+        elapsed = self.get_elapsed()
+        return round(self.rows / elapsed) if elapsed else self.rows
+
+    def summary(self):
+        return (
+            f'Строк: {self.rows}, добавлено: {self.created}, обновлено: {self.updated}, '
+            f'без изменений: {self.unchanged}, ошибок: {self.error_count}; '
+            f'{self.get_elapsed():.1f} с, {self.get_rows_per_second()} строк/с'
+        )
+
+    def error_rows(self):
+        yield [ 'Строка', 'Наименование', 'Ошибка' ]
+        for error in self.errors:
+            yield list(error)
+
+
+def read_csv_rows(binary_file, columns):
+    """
+    Потоково читает csv: файл декодируется по мере чтения, в памяти только текущая строка.
+    Возвращает (номер строки в файле, словарь поле -> значение); разделитель , или ; определяется по началу файла
+    """
+    sample = binary_file.read(SNIFF_SIZE)
+    binary_file.seek(0)
+    sample = sample.decode('utf-8-sig', errors='ignore')
+    try:
+        dialect = csv.Sniffer().sniff(sample.split('\n', 1)[ 0 ], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    text = codecs.getreader('utf-8-sig')(binary_file)
+    reader = csv.reader(text, dialect)
+    header = next(reader, None)
+    if header is None:
+        raise ValidationError('Файл пуст')
+    fields = [ columns.get(column.strip().lower()) for column in header ]
+    if 'name' not in fields:
+        raise ValidationError('В файле нет колонки "Наименование"')
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        values = { field: value.strip() for field, value in zip(fields, row) if field }
+        yield reader.line_num, values
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def normalize_number(value):
+    # В прайсах поставщиков встречаются "1 250,50": пробелы разрядов и запятая вместо точки
+    if value is None:
+        return value
+    return value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+
+
+@lru_cache(maxsize=None)
+def get_form_field(model, name, min_value=None):
+    # Поле формы создаётся один раз на импорт, а не на каждую строку файла
+    kwargs = { 'min_value': min_value } if min_value is not None else { }
+    return model._meta.get_field(name).formfield(**kwargs)
+
+
+def clean_field(model, name, value, min_value=None):
+    # Проверка полем формы модели: те же ограничения и сообщения, что и в формах
+    try:
+        return get_form_field(model, name, min_value).clean(value)
+    except ValidationError as e:
+        verbose_name = model._meta.get_field(name).verbose_name
+        raise ValidationError([ f'{verbose_name}: {message}' for message in e.messages ])
+
+
+def clean_product_row(values):
+    # Необязательные колонки, которых нет в файле, не затирают значения существующих продуктов
+    product = { }
+    errors = [ ]
+    cleaners = [
+        ('name', lambda: clean_field(Product, 'name', values.get('name'))),
+        ('category', lambda: clean_field(Category, 'name', values.get('category'))),
+        ('retail_price', lambda: clean_field(Product, 'retail_price', normalize_number(values.get('retail_price')),
+                                             min_value=Decimal(0))),
+    ]
+    if 'weight' in values:
+        cleaners.append(('weight', lambda: clean_field(Product, 'weight', normalize_number(values[ 'weight' ]) or '0',
+                                                       min_value=Decimal(0))))
+    for name, cleaner in cleaners:
+        try:
+            product[ name ] = cleaner()
+        except ValidationError as e:
+            errors.extend(e.messages)
+    if errors:
+        raise ValidationError(errors)
+    if 'description' in values:
+        product[ 'description' ] = values[ 'description' ] or None
+    return product
+
+
+def get_or_create_categories(names):
+    names = list(names)
+    categories = Category.objects.in_bulk(names, field_name='name')
+    missing = [ Category(name=name) for name in names if name not in categories ]
+    if missing:
+        # Наименование уникально, поэтому созданные категории находим по нему, без pk из bulk_create
+        Category.objects.bulk_create(missing, ignore_conflicts=True)
+        categories.update(Category.objects.in_bulk([ category.name for category in missing ], field_name='name'))
+    return categories
+
+
+def upsert_products(rows):
+    """
+    Вставляет новые и обновляет изменившиеся продукты одного пакета по уникальному наименованию.
+    rows: наименование -> очищенная строка. Возвращает (добавлено, обновлено, pk затронутых продуктов)
+    """
+    categories = get_or_create_categories({ row[ 'category' ] for row in rows.values() })
+    existing = Product.objects.in_bulk(list(rows), field_name='name')
+
+    to_create = [ ]
+    to_update = [ ]
+    update_fields = set()
+    repriced = [ ]
+    for name, row in rows.items():
+        # Категорию сравниваем по category_id, чтобы не читать её у каждого продукта
+        category = categories[ row.pop('category') ]
+        values = dict(row, category_id=category.pk)
+        product = existing.get(name)
+        if product is None:
+            to_create.append(Product(**values))
+            continue
+        changed = [ field for field, value in values.items() if getattr(product, field) != value ]
+        if changed:
+            if 'retail_price' in changed:
+                repriced.append((product, product.retail_price))
+            for field in changed:
+                setattr(product, field, values[ field ])
+            update_fields.update('category' if field == 'category_id' else field for field in changed)
+            to_update.append(product)
+
+    if to_update:
+        Product.objects.bulk_update(to_update, sorted(update_fields), batch_size=CHUNK_SIZE)
+        Product.history.bulk_history_create(to_update, batch_size=CHUNK_SIZE, update=True)
+        # bulk_update не вызывает reprice_unpaid_orders: долг покупателей переоцениваем в той же транзакции
+        for product, old_price in repriced:
+            consumers.price_changed(product.pk, old_price, product.retail_price)
+    created = [ ]
+    if to_create:
+        Product.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+        created = list(Product.objects.filter(name__in=[ product.name for product in to_create ]))
+        Product.history.bulk_history_create(created, batch_size=CHUNK_SIZE)
+    return len(created), len(to_update), [ product.pk for product in created + to_update ]
+
+
+def import_products(binary_file, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Импорт справочника продуктов (и категорий) из csv. Каждый пакет — своя транзакция: строки с ошибками
+    пропускаются и попадают в отчёт, остальные записываются; повторный импорт того же файла ничего не меняет
+    """
+    report = ImportReport()
+    for chunk in chunked(read_csv_rows(binary_file, PRODUCT_COLUMNS), chunk_size):
+        rows = { }
+        for line, values in chunk:
+            report.rows += 1
+            try:
+                row = clean_product_row(values)
+            except ValidationError as e:
+                report.add_error(line, values.get('name', ''), '; '.join(e.messages))
+                continue
+            # Повтор наименования внутри пакета: побеждает последняя строка, как и между пакетами
+            rows[ row[ 'name' ] ] = row
+
+        if rows:
+            with transaction.atomic():
+                created, updated, product_ids = upsert_products(rows)
+                # bulk-операции не вызывают сигналы: справочники и поисковый индекс обновляем сами
+                index_products(product_ids)
+                invalidate_reference('categories')
+                invalidate_products(*product_ids, created=created > 0)
+            report.created += created
+            report.updated += updated
+            report.unchanged += len(rows) - created - updated
+        if progress:
+            progress(report)
+    return report.finish()
+
+
+def import_lot_lines(binary_file, lot_id, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Импорт упаковочного листа в лот: продукты ищутся по наименованию, пакетами. Лот заполняется целиком
+    или никак: при ошибках транзакция откатывается, а в отчёте — ошибки по всем строкам файла
+    """
+    report = ImportReport()
+    with transaction.atomic():
+        lot = Lot.objects.select_for_update().get(pk=lot_id)
+        for chunk in chunked(read_csv_rows(binary_file, LOT_LINE_COLUMNS), chunk_size):
+            report.rows += len(chunk)
+            product_ids = dict(
+                Product.objects.filter(name__in={ values.get('name') for _, values in chunk })
+                .values_list('name', 'pk')
+            )
+            inputs = [ ]
+            for line, values in chunk:
+                product_id = product_ids.get(values.get('name'))
+                if product_id is None:
+                    report.add_error(line, values.get('name', ''), 'Продукт не найден')
+                    continue
+                inputs.append(LotLineInput(
+                    line, str(product_id), normalize_number(values.get('quantity')),
+                    normalize_number(values.get('purchase_price')), values.get('description', ''),
+                ))
+            lines, errors = validate_lot_lines(inputs)
+            for error in errors:
+                report.add_error(error.number, error.product, error.message)
+            if not report.error_count:
+                report.created += len(insert_lot_lines(lot, lines))
+            if progress:
+                progress(report)
+        if report.error_count:
+            report.created = 0
+            transaction.set_rollback(True)
+    return report.finish()
@@ -0,0 +1,186 @@
+import csv
+import logging
+import os
+import socket
+import tempfile
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from ..models import Job
+
+logger = logging.getLogger('warehouse.jobs')
+
+HEARTBEAT_INTERVAL = 1000  # строк/шагов между отметками прогресса
+STALE_AFTER = timedelta(minutes=15)
+CLAIM_ATTEMPTS = 5
+
+JOB_HANDLERS = { }
+
+
+class JobHandler:
+    def __init__(self, kind, title, func):
+        self.kind = kind
+        self.title = title
+        self.func = func
+
+
+def job_handler(kind, title):
+    """
+    Регистрирует функцию func(context, **params) как обработчик задач вида kind
+    """
+    def decorator(func):
+        JOB_HANDLERS[ kind ] = JobHandler(kind, title, func)
+        return func
+    return decorator
+
+
+def get_job_title(kind):
+    handler = JOB_HANDLERS.get(kind)
+    return handler.title if handler else kind
+
+
+class JobContext:
+    """
+    То, что обработчик видит о своей задаче: отметки прогресса и сохранение файла результата
+    """
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, done, total=None, message=None):
+        fields = { 'progress_done': done, 'heartbeat': now() }
+        if total is not None:
+            fields[ 'progress_total' ] = total
+        if message is not None:
+            fields[ 'message' ] = message
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(self.job, name, value)
+
+    def save_result(self, filename, path):
+        with open(path, 'rb') as result:
+            self.job.result_file.save(filename, File(result), save=False)
+        Job.objects.filter(pk=self.job.pk).update(result_file=self.job.result_file.name)
+
+    def write_csv(self, filename, rows, total=None):
+        # Строки пишутся во временный файл с отметкой прогресса каждые HEARTBEAT_INTERVAL строк
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            count = 0
+            with os.fdopen(handle, 'w', newline='', encoding='utf-8-sig') as output:
+                writer = csv.writer(output)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+                    if count % HEARTBEAT_INTERVAL == 0:
+                        self.progress(count, total)
+            self.progress(count, total if total is not None else count)
+            self.save_result(filename, path)
+        finally:
+            os.remove(path)
+        return count
+
+
+def run_on_commit():
+    return getattr(settings, 'JOBS_RUN_ON_COMMIT', False)
+
+
+def submit_job(kind, **params):
+    """
+    Ставит задачу в очередь; её выполняет manage.py run_worker. С JOBS_RUN_ON_COMMIT задача выполняется
+    сразу после коммита в том же процессе — для установки без отдельного исполнителя
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Неизвестный вид задачи: {kind}')
+    job = Job.objects.create(kind=kind, params=params)
+    if run_on_commit():
+        transaction.on_commit(lambda: run_after_commit(job.pk))
+    return job
+
+
+def run_after_commit(job_id):
+    # Задачу мог уже забрать запущенный исполнитель — тогда условный UPDATE ничего не захватит
+    if claim(job_id, worker_name()):
+        execute_job(job_id)
+
+
+def get_or_submit_job(kind, **params):
+    # Повторное нажатие кнопки не ставит вторую такую же задачу, пока первая не завершилась
+    job = Job.objects.filter(kind=kind, params=params, status__in=('queued', 'running')).order_by('pk').first()
+    return job or submit_job(kind, **params)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_job(worker=None):
+    """
+    Забирает самую старую задачу из очереди условным UPDATE: из нескольких исполнителей задачу получит один
+    """
+    for _ in range(CLAIM_ATTEMPTS):
+        job_id = Job.objects.filter(status='queued').order_by('pk').values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        if claim(job_id, worker or worker_name()):
+            return job_id
+    return None
+
+
+def claim(job_id, worker):
+    moment = now()
+    return Job.objects.filter(pk=job_id, status='queued').update(
+        status='running',
+        worker=worker,
+        started_at=moment,
+        heartbeat=moment,
+        attempts=F('attempts') + 1,
+    )
+
+
+def release_connections():
+    # Поток или процесс пула живёт долго: соединения закрываем по CONN_MAX_AGE, но не внутри
+    # чужой транзакции (задача, выполняемая напрямую из теста или замера)
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def execute_job(job_id):
+    """
+    Выполняет уже захваченную задачу; подходит и для потока, и для отдельного процесса
+    """
+    release_connections()
+    job = Job.objects.get(pk=job_id)
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f'Неизвестный вид задачи: {job.kind}')
+        message = handler.func(JobContext(job), **job.params)
+        Job.objects.filter(pk=job.pk).update(status='done', finished_at=now(), message=message or job.message)
+    except ValidationError as e:
+        # Ошибка проверки данных — ожидаемый исход, пользователю нужен её текст, а не трассировка
+        Job.objects.filter(pk=job.pk).update(status='failed', finished_at=now(), message='\n'.join(e.messages))
+    except Exception as e:
+        logger.exception('Job %s failed', job.pk)
+        Job.objects.filter(pk=job.pk).update(
+            status='failed',
+            finished_at=now(),
+            message=f'{e}\n\n{traceback.format_exc()}',
+        )
+    finally:
+        release_connections()
+    return job_id
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    # Задачи исполнителя, который умер без отметки прогресса дольше stale_after, возвращаются в очередь
+    return Job.objects.filter(status='running', heartbeat__lt=now() - stale_after).update(
+        status='queued',
+        worker='',
+    )
@@ -0,0 +1,211 @@
+import datetime
+import json
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.core import signing
+from django.db.models import Q
+
+CHUNK_SIZE = 2000
+PAGE_SIZE = 50
+APPROXIMATE_TOTAL_LIMIT = 10000
+CURSOR_SALT = 'warehouse.keyset'
+
+
+def field_name(field):
+    return field.lstrip('-')
+
+
+def reverse_ordering(ordering):
+    return tuple(field_name(field) if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def keyset_filter(ordering, values):
+    # (a, b, pk) > (x, y, z) в виде Q: a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z);
+    # для поля с '-' "после" означает "меньше"
+    conditions = [ ]
+    for i, field in enumerate(ordering):
+        equal = { field_name(ordering[ j ]): values[ j ] for j in range(i) }
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        conditions.append(Q(**equal, **{ f'{field_name(field)}__{lookup}': values[ i ] }))
+    return reduce(or_, conditions)
+
+
+def keyset_values(obj, ordering):
+    return [ getattr(obj, field_name(field)) for field in ordering ]
+
+
+def iterate_in_chunks(queryset, chunk_size=CHUNK_SIZE, ordering=('pk',)):
+    # Читаем queryset порциями по ключу, а не OFFSET: память постоянна, prefetch_related работает на каждой порции
+    queryset = queryset.order_by(*ordering)
+    last_values = None
+    while True:
+        chunk = queryset
+        if last_values is not None:
+            chunk = chunk.filter(keyset_filter(ordering, last_values))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_values = keyset_values(chunk[ -1 ], ordering)
+
+
+def encode_cursor(values):
+    # Курсор подписан: подделанный или устаревший токен просто открывает первую страницу
+    return signing.dumps(values, salt=CURSOR_SALT, serializer=CursorSerializer, compress=True)
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CURSOR_SALT, serializer=CursorSerializer)
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+# Значения ключа с типом: datetime с микросекундами и Decimal без потери точности. DjangoJSONEncoder
+# обрезает время до миллисекунд, и курсор на границе страницы повторял бы или пропускал строки
+CURSOR_TYPES = {
+    'datetime': (datetime.datetime, datetime.datetime.fromisoformat),
+    'date': (datetime.date, datetime.date.fromisoformat),
+    'time': (datetime.time, datetime.time.fromisoformat),
+    'decimal': (Decimal, Decimal),
+}
+
+
+def encode_cursor_value(value):
+    # datetime проверяется раньше date: он её подкласс
+    for name, (value_type, _) in CURSOR_TYPES.items():
+        if isinstance(value, value_type):
+            return { 'type': name, 'value': value.isoformat() if name != 'decimal' else str(value) }
+    return value
+
+
+def decode_cursor_value(value):
+    if isinstance(value, dict):
+        _, parse = CURSOR_TYPES[ value[ 'type' ] ]
+        return parse(value[ 'value' ])
+    return value
+
+
+class CursorSerializer:
+    def dumps(self, obj):
+        return json.dumps([ encode_cursor_value(value) for value in obj ], separators=(',', ':')).encode()
+
+    def loads(self, data):
+        try:
+            return [ decode_cursor_value(value) for value in json.loads(data) ]
+        except (KeyError, TypeError) as e:
+            raise ValueError(e)
+
+
+def page_query(params, **cursor):
+    # Параметры текущего запроса (фильтры, total) переходят на соседнюю страницу, меняется только курсор
+    params = params.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    params.update(cursor)
+    return params.urlencode()
+
+
+class KeysetPage:
+    """
+    Страница keyset-пагинации: вместо номера страницы — курсоры на соседние страницы
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, approximate_total=None,
+                 total_is_capped=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_total = approximate_total
+        self.total_is_capped = total_is_capped
+        self.next_query = None
+        self.previous_query = None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def approximate_total(queryset, limit=APPROXIMATE_TOTAL_LIMIT):
+    # Считаем не дальше limit строк: стоимость ограничена, сколько бы строк ни было в таблице
+    count = queryset.order_by()[ :limit + 1 ].count()
+    return min(count, limit), count > limit
+
+
+def paginate_keyset(queryset, ordering, after=None, before=None, page_size=PAGE_SIZE, with_total=False):
+    """
+    Страница после курсора after (или до курсора before): одна выборка по индексу на ordering без OFFSET,
+    поэтому любая страница читается так же быстро, как первая
+    """
+    after_values = decode_cursor(after)
+    before_values = decode_cursor(before) if after_values is None else None
+
+    if before_values is not None:
+        chunk = queryset.order_by(*reverse_ordering(ordering)).filter(
+            keyset_filter(reverse_ordering(ordering), before_values)
+        )
+        object_list = list(chunk[ :page_size + 1 ])
+        has_more_before = len(object_list) > page_size
+        object_list = object_list[ :page_size ][ ::-1 ]
+        has_more_after = True
+    else:
+        chunk = queryset.order_by(*ordering)
+        if after_values is not None:
+            chunk = chunk.filter(keyset_filter(ordering, after_values))
+        object_list = list(chunk[ :page_size + 1 ])
+        has_more_after = len(object_list) > page_size
+        object_list = object_list[ :page_size ]
+        has_more_before = after_values is not None
+
+    next_cursor = None
+    previous_cursor = None
+    if object_list and has_more_after:
+        next_cursor = encode_cursor(keyset_values(object_list[ -1 ], ordering))
+    if object_list and has_more_before:
+        previous_cursor = encode_cursor(keyset_values(object_list[ 0 ], ordering))
+
+    total, capped = (None, False)
+    if with_total:
+        total, capped = approximate_total(queryset)
+    return KeysetPage(object_list, next_cursor, previous_cursor, total, capped)
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset-пагинация для ListView по (date_created, pk): ?after=<курсор> / ?before=<курсор>,
+    приблизительное количество — по ?total=1 или keyset_with_total = True
+    """
+    paginate_by = PAGE_SIZE
+    keyset_ordering = ('-date_created', '-pk')
+    keyset_with_total = False
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_keyset(
+            queryset,
+            self.keyset_ordering,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+            page_size=page_size,
+            with_total=self.keyset_with_total or self.request.GET.get('total') == '1',
+        )
+        if page.has_next():
+            page.next_query = page_query(self.request.GET, after=page.next_cursor)
+        if page.has_previous():
+            page.previous_query = page_query(self.request.GET, before=page.previous_cursor)
+        return None, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,170 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Sum, Max
+
+from ..models import Product, ProductInLot, LotCost, Lot, ProductInWarehouse
+from ..utils import add_costs_out_from_lot_if_not_exists
+from .stock import apply_stock_changes, stock_changes
+from .fifo import create_cost_layers
+
+RECEIPT_BATCH_SIZE = 500
+LOT_LINES_BATCH_SIZE = 500
+
+# Строка ввода со страницы добавления продуктов в лот и ошибка по ней; number — номер строки на странице
+LotLineInput = namedtuple('LotLineInput', [ 'number', 'id', 'quantity', 'purchase_price', 'description' ])
+LotLineError = namedtuple('LotLineError', [ 'number', 'product', 'message' ])
+
+
+def is_empty_amount(value):
+    return value is None or value.strip() in ('', '0')
+
+
+def lot_line_inputs(product_ids, quantities, purchase_prices, descriptions):
+    # Строки, где не указаны ни количество, ни цена, пользователь не заполнял — пропускаем
+    descriptions = list(descriptions) + [ '' ] * (len(product_ids) - len(descriptions))
+    for number, row in enumerate(zip(product_ids, quantities, purchase_prices, descriptions), start=1):
+        product_id, quantity, purchase_price, description = row
+        if is_empty_amount(quantity) and is_empty_amount(purchase_price):
+            continue
+        yield LotLineInput(number, product_id, quantity, purchase_price, description)
+
+
+def validate_lot_lines(inputs):
+    """
+    Проверяет все строки до записи: продукты читаются одним запросом, ошибки собираются по каждой строке
+    """
+    product_ids = { line.id for line in inputs if str(line.id).isdigit() }
+    product_names = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'name'))
+    quantity_field = ProductInLot._meta.get_field('quantity').formfield(min_value=Decimal('0.01'))
+    purchase_price_field = ProductInLot._meta.get_field('purchase_price').formfield(min_value=Decimal('0.01'))
+
+    lines = [ ]
+    errors = [ ]
+    for line in inputs:
+        product_id = int(line.id) if str(line.id).isdigit() else None
+        product_name = product_names.get(product_id)
+        if product_name is None:
+            errors.append(LotLineError(line.number, line.id, 'Продукт не найден'))
+            continue
+        values = { }
+        for name, field, label in (
+            ('quantity', quantity_field, 'Количество'),
+            ('purchase_price', purchase_price_field, 'Закупочная цена'),
+        ):
+            try:
+                values[ name ] = field.clean(getattr(line, name))
+            except ValidationError as e:
+                errors.extend(LotLineError(line.number, product_name, f'{label}: {message}') for message in e.messages)
+        if len(values) == 2:
+            lines.append(ProductInLot(product_id=product_id, description=line.description or None, **values))
+    return lines, errors
+
+
+def add_lot_lines(lot_id, inputs):
+    """
+    Добавляет строки в лот одной транзакцией: при любой ошибке не записывается ни одна строка.
+    Возвращает (созданные строки, ошибки по строкам)
+    """
+    inputs = list(inputs)
+    if not inputs:
+        return [ ], [ LotLineError(None, None, 'Не заполнено ни одной строки') ]
+    lines, errors = validate_lot_lines(inputs)
+    if errors:
+        return [ ], errors
+
+    with transaction.atomic():
+        lot = Lot.objects.select_for_update().get(pk=lot_id)
+        created = insert_lot_lines(lot, lines)
+    return created, [ ]
+
+
+def insert_lot_lines(lot, lines):
+    """
+    Пакетная вставка строк лота с историей; вызывается в транзакции после select_for_update лота
+    """
+    # Блокировка лота упорядочивает параллельные добавления, поэтому новые строки лота — это pk > last_pk
+    last_pk = ProductInLot.objects.aggregate(last_pk=Max('pk'))[ 'last_pk' ] or 0
+    for line in lines:
+        line.lot = lot
+    ProductInLot.objects.bulk_create(lines, batch_size=LOT_LINES_BATCH_SIZE)
+    # bulk_create на SQLite/MySQL не возвращает pk, а история нужна с pk — перечитываем созданные строки
+    created = list(ProductInLot.objects.filter(lot=lot, pk__gt=last_pk).select_related('product').order_by('pk'))
+    ProductInLot.history.bulk_history_create(created, batch_size=LOT_LINES_BATCH_SIZE)
+    return created
+
+
+def allocate_lot_costs(lot_id):
+    # Загружаем строки и расходы лота один раз и распределяем расходы по всем строкам за один проход
+    lines = list(ProductInLot.objects.filter(lot=lot_id).select_related('product').order_by('pk'))
+    amount_spent_by_distribution = dict(
+        LotCost.objects
+        .filter(lot=lot_id)
+        .values_list('distribution')
+        .annotate(Sum('amount_spent'))
+        .order_by()
+    )
+
+    total_quantity = sum([ line.quantity for line in lines ], Decimal(0))
+    total_weight = sum([ line.get_total_weight() for line in lines ], Decimal(0))
+    total_purchase_price = sum([ line.get_total_purchase_price() for line in lines ], Decimal(0))
+
+    equal = amount_spent_by_distribution.get('equal') or Decimal(0)
+    by_weight = amount_spent_by_distribution.get('by_weight') or Decimal(0)
+    by_price = amount_spent_by_distribution.get('by_price') or Decimal(0)
+
+    # Расходы на единицу: поровну на штуку, на кг веса и на единицу закупочной стоимости
+    per_unit = equal / total_quantity if total_quantity else Decimal(0)
+    per_weight = by_weight / total_weight if total_weight else Decimal(0)
+    per_price = by_price / total_purchase_price if total_purchase_price else Decimal(0)
+
+    for line in lines:
+        line.cost_price = (
+            line.purchase_price
+            + per_unit
+            + per_weight * line.product.weight
+            + per_price * line.purchase_price
+        )
+    return lines
+
+
+def receive_lot(lot_id, warehouse_id):
+    with transaction.atomic():
+        # Захватываем лот условным UPDATE: второй кладовщик, принимающий тот же лот, получит 0 строк
+        claimed = Lot.objects.filter(pk=lot_id, status='delivered').update(status='delivered_to_warehouse')
+        if not claimed:
+            raise ValidationError('Лот уже принят на склад или ещё не доставлен')
+        lot = Lot.objects.get(pk=lot_id)
+
+        lines = allocate_lot_costs(lot_id)
+        if not lines:
+            raise ValidationError('В лоте нет товаров')
+        errors = [
+            f'Продукт {line.product.name}: количество должно быть больше нуля'
+            for line in lines if line.quantity <= 0
+        ]
+        if errors:
+            raise ValidationError(errors)
+
+        movements = [
+            ProductInWarehouse(
+                product=line.product,
+                warehouse_id=warehouse_id,
+                quantity=line.quantity,
+                cost_price=line.cost_price.quantize(Decimal('0.01')),
+                transaction='in',
+                lot=lot,
+            )
+            for line in lines
+        ]
+        ProductInWarehouse.objects.bulk_create(movements, batch_size=RECEIPT_BATCH_SIZE)
+        # bulk_create не вызывает сигналы, поэтому остатки и слои FIFO обновляем сами
+        apply_stock_changes(stock_changes(movements))
+        # Лот принимается один раз, поэтому по нему однозначно находим созданные движения вместе с pk
+        create_cost_layers(ProductInWarehouse.objects.filter(lot=lot, transaction='in').order_by('pk'))
+        add_costs_out_from_lot_if_not_exists(lot)
+        # Сохраняем лот, чтобы смена статуса попала в историю
+        lot.save()
+    return movements
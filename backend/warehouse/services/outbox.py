@@ -0,0 +1,117 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from ..models import OutboxEvent
+from .reservations import serialize_writes
+
+logger = logging.getLogger('warehouse.outbox')
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+OUTBOX_HANDLERS = { }
+
+
+def outbox_handler(kind):
+    """
+    Регистрирует функцию func(**payload) как обработчик событий вида kind. Обработчик должен быть
+    идемпотентным: после сбоя между его работой и отметкой события он выполнится ещё раз
+    """
+    def decorator(func):
+        OUTBOX_HANDLERS[ kind ] = func
+        return func
+    return decorator
+
+
+def process_on_commit():
+    return getattr(settings, 'OUTBOX_PROCESS_ON_COMMIT', True)
+
+
+def publish(kind, key, **payload):
+    """
+    Записывает событие в текущей транзакции; событие с тем же ключом уже есть — ничего не меняется.
+    После коммита события выполняются сразу (OUTBOX_PROCESS_ON_COMMIT), иначе их забирает process_outbox
+    """
+    if kind not in OUTBOX_HANDLERS:
+        raise ValueError(f'Неизвестный вид события: {kind}')
+    # INSERT ... ON CONFLICT DO NOTHING: повторное сохранение не пишет второе событие и не гоняется с соседним
+    OutboxEvent.objects.bulk_create([ OutboxEvent(kind=kind, key=key, payload=payload) ], ignore_conflicts=True)
+    if process_on_commit():
+        transaction.on_commit(lambda: process_after_commit(key))
+
+
+def process_after_commit(key):
+    # Ошибка побочного эффекта не должна ломать уже закоммиченный запрос: событие останется для повтора
+    try:
+        process_events(OutboxEvent.objects.filter(key=key))
+    except Exception:
+        logger.exception('Outbox event %s failed after commit', key)
+
+
+def retry_delay(attempts):
+    return min(timedelta(seconds=2 ** attempts), MAX_RETRY_DELAY)
+
+
+def execute_event(event):
+    """
+    Событие выполняется в своей транзакции вместе с отметкой "выполнено": эффект и отметка фиксируются
+    или откатываются вместе. Условный UPDATE отметки пропускает событие, которое уже выполнил другой исполнитель
+    """
+    try:
+        with transaction.atomic():
+            serialize_writes()
+            claimed = OutboxEvent.objects.filter(pk=event.pk, status='pending').update(
+                status='done',
+                processed_at=now(),
+                attempts=F('attempts') + 1,
+            )
+            if not claimed:
+                return False
+            handler = OUTBOX_HANDLERS.get(event.kind)
+            if handler is None:
+                raise ValueError(f'Неизвестный вид события: {event.kind}')
+            handler(**event.payload)
+        return True
+    except Exception as e:
+        logger.exception('Outbox event %s failed', event.key)
+        attempts = event.attempts + 1
+        OutboxEvent.objects.filter(pk=event.pk, status='pending').update(
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending',
+            attempts=attempts,
+            available_at=now() + retry_delay(attempts),
+            last_error=f'{e}\n\n{traceback.format_exc()}',
+        )
+        return False
+
+
+def process_events(events):
+    processed = 0
+    for event in events.filter(status='pending', available_at__lte=now()).order_by('pk'):
+        processed += execute_event(event)
+    return processed
+
+
+def process_outbox(batch_size=BATCH_SIZE):
+    """
+    Выполняет ожидающие события пакетами по порядку записи, пока есть события, чьё время подошло.
+    Возвращает число выполненных
+    """
+    processed = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            OutboxEvent.objects.filter(status='pending', available_at__lte=now(), pk__gt=last_pk)
+            .order_by('pk')[ :batch_size ]
+        )
+        if not batch:
+            return processed
+        for event in batch:
+            processed += execute_event(event)
+        last_pk = batch[ -1 ].pk
@@ -0,0 +1,116 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+
+from django.db import connections
+
+SLOWEST_COUNT = 5
+
+WHITESPACE_RE = re.compile(r'\s+')
+PLACEHOLDERS_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    # Параметры в SQL Django и так передаются отдельно; сворачиваем ещё списки IN (%s, %s, ...),
+    # чтобы один и тот же запрос с разным числом id считался одним отпечатком
+    return PLACEHOLDERS_RE.sub('(...)', WHITESPACE_RE.sub(' ', sql).strip())
+
+
+class QueryRecorder:
+    """
+    Обёртка execute_wrapper: число запросов, время в базе, самые медленные запросы и повторяющиеся отпечатки.
+    Работает без DEBUG, поэтому годится и для боевых настроек
+    """
+    def __init__(self, slowest_count=SLOWEST_COUNT):
+        self.slowest_count = slowest_count
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = [ ]
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[ fingerprint(sql) ] += 1
+        self.slowest.append((duration, sql))
+        self.slowest.sort(key=lambda item: item[ 0 ], reverse=True)
+        del self.slowest[ self.slowest_count: ]
+
+    def get_duplicates(self):
+        # Один и тот же запрос несколько раз за запрос пользователя — почти всегда N+1
+        return [ (sql, count) for sql, count in self.fingerprints.most_common() if count > 1 ]
+
+    def get_duration_ms(self):
+        return self.duration * 1000
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'db_ms': round(self.get_duration_ms(), 2),
+            'duplicates': sum([ count - 1 for _, count in self.get_duplicates() ]),
+            'slowest': [ { 'ms': round(duration * 1000, 2), 'sql': sql } for duration, sql in self.slowest ],
+            'duplicate_fingerprints': [ { 'count': count, 'sql': sql } for sql, count in self.get_duplicates() ],
+        }
+
+
+@contextmanager
+def record_queries(using=None, slowest_count=SLOWEST_COUNT, recorder=None):
+    """
+    with record_queries() as recorder: ... — запросы ко всем базам (или только к using) внутри блока;
+    с recorder — дописывает в уже начатый счётчик
+    """
+    recorder = recorder or QueryRecorder(slowest_count=slowest_count)
+    aliases = [ using ] if using else [ connection.alias for connection in connections.all() ]
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[ alias ].execute_wrapper(recorder))
+        yield recorder
+
+
+def recorded_iterator(iterator, recorder, on_close):
+    """
+    Потоковый ответ (csv) читает базу уже после выхода из вью: считаем запросы на каждом шаге генератора
+    в тот же recorder, а по закрытию потока вызываем on_close(completed)
+    """
+    iterator = iter(iterator)
+    completed = False
+    try:
+        while True:
+            with record_queries(recorder=recorder):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    completed = True
+                    return
+            yield item
+    finally:
+        on_close(completed)
+
+
+def query_budget(budget):
+    """
+    Бюджет запросов для функции-вью; у классов-вью достаточно атрибута query_budget
+    """
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'query_budget', None)
+    return getattr(view_func, 'query_budget', None)
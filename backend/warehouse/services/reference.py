@@ -0,0 +1,207 @@
+import threading
+from collections import namedtuple
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+
+from ..models import Category, Product
+
+CACHE_TIMEOUT = 24 * 60 * 60
+KEY_PREFIX = 'warehouse:reference'
+# Продукты кэшируются пакетами по диапазону pk: сохранение продукта перечитывает только его пакет,
+# и ни одна запись кэша не упирается в max_allowed_packet MySQL
+PRODUCT_CHUNK_SIZE = 1000
+
+
+class CategoryRef(namedtuple('CategoryRef', [ 'id', 'name' ])):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class ProductRef(namedtuple('ProductRef', [ 'id', 'name', 'retail_price', 'weight', 'category_id' ])):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return f'{self.name}, вес: {round(self.weight)} кг. рц: {round(self.retail_price)}'
+
+
+def load_categories():
+    return {
+        pk: CategoryRef(pk, name)
+        for pk, name in Category.objects.order_by('pk').values_list('pk', 'name')
+    }
+
+
+def product_chunk(product_id):
+    return int(product_id) // PRODUCT_CHUNK_SIZE
+
+
+def chunk_name(chunk):
+    return f'products:{chunk}'
+
+
+def load_last_product_chunk():
+    last_pk = Product.objects.aggregate(last_pk=Max('pk'))[ 'last_pk' ]
+    return -1 if last_pk is None else product_chunk(last_pk)
+
+
+def load_products(chunk):
+    # Пакет — продукты с pk из [chunk * PRODUCT_CHUNK_SIZE, (chunk + 1) * PRODUCT_CHUNK_SIZE)
+    first = chunk * PRODUCT_CHUNK_SIZE
+    products = Product.objects.filter(pk__gte=first, pk__lt=first + PRODUCT_CHUNK_SIZE).order_by('pk')
+    return {
+        row[ 0 ]: ProductRef(*row)
+        for row in products.values_list('pk', 'name', 'retail_price', 'weight', 'category_id')
+    }
+
+
+LOADERS = {
+    'categories': load_categories,
+    'last_product_chunk': load_last_product_chunk,
+}
+
+# Второй уровень — память процесса: пока версия в общем кэше не изменилась, словарь не перечитывается
+_local = { }
+_local_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[ getattr(settings, 'REFERENCE_CACHE_ALIAS', 'default') ]
+
+
+def version_key(name):
+    return f'{KEY_PREFIX}:{name}:version'
+
+
+def get_version(name):
+    cache = get_cache()
+    version = cache.get(version_key(name))
+    if version is None:
+        cache.add(version_key(name), 1, timeout=None)
+        version = cache.get(version_key(name), 1)
+    return version
+
+
+def fetch_references(loaders):
+    """
+    Справочники по версиям из общего кэша: память процесса -> общий кэш -> база.
+    loaders: имя -> функция загрузки. Версии и данные читаются из кэша одним get_many каждые,
+    из базы загружается только то, чего нет ни в памяти, ни в кэше. Возвращает имя -> (версия, данные)
+    """
+    cache = get_cache()
+    versions = cache.get_many([ version_key(name) for name in loaders ])
+    result = { }
+    stale = { }
+    for name in loaders:
+        version = versions.get(version_key(name)) or get_version(name)
+        local = _local.get(name)
+        if local is not None and local[ 0 ] == version:
+            result[ name ] = local
+        else:
+            stale[ name ] = version
+    if not stale:
+        return result
+
+    data_keys = { name: f'{KEY_PREFIX}:{name}:{version}' for name, version in stale.items() }
+    cached = cache.get_many(list(data_keys.values()))
+    loaded = { }
+    for name, data_key in data_keys.items():
+        data = cached.get(data_key)
+        if data is None:
+            data = loaders[ name ]()
+            loaded[ data_key ] = data
+        result[ name ] = (stale[ name ], data)
+    if loaded:
+        cache.set_many(loaded, timeout=CACHE_TIMEOUT)
+    with _local_lock:
+        _local.update({ name: result[ name ] for name in stale })
+    return result
+
+
+def get_reference(name):
+    return fetch_references({ name: LOADERS[ name ] })[ name ][ 1 ]
+
+
+def fetch_product_chunks(chunks):
+    return fetch_references({ chunk_name(chunk): partial(load_products, chunk) for chunk in chunks })
+
+
+def bump_version(name):
+    # Новая версия делает старые данные недостижимыми во всех процессах; сами данные истекут по таймауту
+    cache = get_cache()
+    try:
+        cache.incr(version_key(name))
+    except ValueError:
+        cache.add(version_key(name), 2, timeout=None)
+
+
+def all_reference_names():
+    # Полный сброс: все справочники и все пакеты продуктов до последнего по базе
+    return [ *LOADERS, *(chunk_name(chunk) for chunk in range(load_last_product_chunk() + 1)) ]
+
+
+def invalidate_reference(*names):
+    # После коммита: иначе другой процесс успеет перечитать из базы ещё старые данные под новой версией
+    transaction.on_commit(lambda: [ bump_version(name) for name in names or all_reference_names() ])
+
+
+def invalidate_products(*product_ids, created=False):
+    # Сбрасываются только пакеты изменённых продуктов; новый продукт может открыть следующий пакет
+    names = { chunk_name(product_chunk(product_id)) for product_id in product_ids }
+    if created:
+        names.add('last_product_chunk')
+    if names:
+        invalidate_reference(*sorted(names))
+
+
+def get_categories():
+    return get_reference('categories')
+
+
+def get_products():
+    """
+    Все продукты по возрастанию pk. Собранный словарь хранится в памяти процесса, пока не изменилась
+    версия ни одного пакета
+    """
+    chunks = fetch_product_chunks(range(get_reference('last_product_chunk') + 1))
+    versions = tuple((name, version) for name, (version, _) in chunks.items())
+    local = _local.get('products')
+    if local is not None and local[ 0 ] == versions:
+        return local[ 1 ]
+    products = { }
+    for _, data in chunks.values():
+        products.update(data)
+    with _local_lock:
+        _local[ 'products' ] = (versions, products)
+    return products
+
+
+def get_category(category_id):
+    return get_categories().get(int(category_id))
+
+
+def get_product(product_id):
+    # Нужен только пакет этого продукта
+    chunk = product_chunk(product_id)
+    return fetch_product_chunks([ chunk ])[ chunk_name(chunk) ][ 1 ].get(int(product_id))
+
+
+def get_category_list():
+    return sorted(get_categories().values(), key=lambda category: category.name)
+
+
+def get_product_list(category_id=None):
+    products = get_products().values()
+    if category_id:
+        products = [ product for product in products if product.category_id == int(category_id) ]
+    return list(products)
@@ -0,0 +1,137 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = 'db_primary_until'
+WRITE_STATEMENTS = { 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER' }
+
+# Включены ли чтения с реплики в текущем потоке/контексте и была ли уже запись в основную базу
+_replica_reads = ContextVar('replica_reads', default=False)
+_wrote = ContextVar('replica_wrote', default=False)
+
+
+def get_replica_alias():
+    # Без реплики в DATABASES всё читается из основной базы
+    alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def get_lag_tolerance():
+    return getattr(settings, 'REPLICA_LAG_TOLERANCE', 5)
+
+
+def get_read_alias():
+    """
+    Алиас для чтения: реплика, если чтения с неё включены, не идёт транзакция и в этом контексте ещё не писали
+    """
+    if not _replica_reads.get() or _wrote.get():
+        return None
+    if connections[ DEFAULT_DB_ALIAS ].in_atomic_block:
+        return None
+    return get_replica_alias()
+
+
+def is_write(sql):
+    statement = sql.lstrip().split(None, 1)
+    return bool(statement) and statement[ 0 ].upper() in WRITE_STATEMENTS
+
+
+class WriteDetector:
+    """
+    execute_wrapper основной базы: замечает первую запись, после неё чтения этого контекста идут в основную базу
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if is_write(sql):
+            self.count += 1
+            _wrote.set(True)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def track_writes():
+    detector = WriteDetector()
+    wrote_token = _wrote.set(False)
+    try:
+        with connections[ DEFAULT_DB_ALIAS ].execute_wrapper(detector):
+            yield detector
+    finally:
+        _wrote.reset(wrote_token)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    with replica_reads(): ... — чтения моделей внутри блока идут на реплику (см. ReplicaRouter)
+    """
+    token = _replica_reads.set(enabled and get_replica_alias() is not None)
+    wrote_token = _wrote.set(_wrote.get())
+    try:
+        with connections[ DEFAULT_DB_ALIAS ].execute_wrapper(WriteDetector()):
+            yield
+    finally:
+        _wrote.reset(wrote_token)
+        _replica_reads.reset(token)
+
+
+def replica_iterator(iterator):
+    # Потоковый ответ (csv) читается уже после выхода из вью: включаем реплику на каждый шаг генератора
+    iterator = iter(iterator)
+    while True:
+        with replica_reads():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def primary_pinned(request):
+    """
+    После своей записи пользователь REPLICA_LAG_TOLERANCE секунд читает из основной базы (read-your-writes)
+    """
+    try:
+        return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_primary(response):
+    lag = get_lag_tolerance()
+    response.set_cookie(PRIMARY_COOKIE, f'{time.time() + lag:.3f}', max_age=max(1, round(lag)), httponly=True,
+                        samesite='Lax')
+    return response
+
+
+def call_with_replica_reads(request, view, *args, **kwargs):
+    if primary_pinned(request) or get_replica_alias() is None:
+        return view(request, *args, **kwargs)
+    with replica_reads():
+        response = view(request, *args, **kwargs)
+    if getattr(response, 'streaming', False):
+        response.streaming_content = replica_iterator(response.streaming_content)
+    return response
+
+
+def replica_reads_view(view_func):
+    """
+    Отчётная функция-вью читает с реплики; у классов-вью то же делает ReplicaReadsMixin
+    """
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        return call_with_replica_reads(request, view_func, *args, **kwargs)
+    return wrapped
+
+
+class ReplicaReadsMixin:
+    """
+    Отчёты (оценка складов, история, выгрузки) читают с реплики, если пользователь недавно ничего не записывал
+    """
+    def dispatch(self, request, *args, **kwargs):
+        return call_with_replica_reads(request, super().dispatch, *args, **kwargs)
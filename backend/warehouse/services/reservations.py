@@ -0,0 +1,154 @@
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import F, Sum
+from django.template.defaultfilters import floatformat
+
+from ..models import Order, ProductInOrder, StockBalance, StockReservation
+
+
+def serialize_writes(using=None):
+    """
+    SQLite не знает SELECT ... FOR UPDATE, а транзакция, которая начала с чтения, при конкурентной записи получает
+    "database is locked" сразу, без ожидания. Пустой UPDATE первым запросом транзакции берёт блокировку записи
+    на всю базу: параллельные транзакции ждут её (timeout соединения) и проходят по очереди.
+    На остальных базах блокируются строки, см. lock_balances
+    """
+    connection = connections[ using or router.db_for_write(StockBalance) ]
+    if connection.vendor == 'sqlite' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {StockBalance._meta.db_table} SET id = id WHERE 0')
+
+
+def take(product_id, warehouse_id, quantity):
+    """
+    Резервирует товар одним условным UPDATE строки остатка: проверка "остаток - резерв >= количество"
+    и увеличение резерва идут в одном запросе, поэтому два заказа не займут один и тот же остаток
+    """
+    if quantity <= 0:
+        return
+    updated = StockBalance.objects.filter(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+        quantity__gte=F('reserved') + quantity,
+    ).update(reserved=F('reserved') + quantity)
+    if not updated:
+        balance = StockBalance.objects.filter(product_id=product_id, warehouse_id=warehouse_id).first()
+        available = max(balance.get_available(), 0) if balance is not None else 0
+        raise ValidationError(f'На складе доступно только {floatformat(available, -2)}')
+
+
+def give_back(product_id, warehouse_id, quantity):
+    if quantity > 0:
+        StockBalance.objects.filter(product_id=product_id, warehouse_id=warehouse_id).update(
+            reserved=F('reserved') - quantity,
+        )
+
+
+def reservation_target(order):
+    # Склад, на котором строки заказа держат резерв; None — резерв не нужен
+    if order.warehouse_id is None or order.status in Order.RELEASED_STATUSES:
+        return None
+    return order.warehouse_id
+
+
+def reserve_order_line(line, order=None):
+    """
+    Приводит резерв строки к её товару и количеству: меняется только разница, при смене товара или склада
+    старый резерв возвращается, а новый берётся заново. ValidationError, если доступного остатка не хватает
+    """
+    order = order or line.order
+    warehouse_id = reservation_target(order)
+    with transaction.atomic():
+        reservation = StockReservation.objects.select_for_update().filter(order_line=line).first()
+        if reservation is not None and (reservation.product_id, reservation.warehouse_id) == (line.product_id,
+                                                                                             warehouse_id):
+            delta = line.quantity - reservation.quantity
+            if delta:
+                take(line.product_id, warehouse_id, delta)
+                give_back(line.product_id, warehouse_id, -delta)
+                reservation.quantity = line.quantity
+                reservation.save(update_fields=[ 'quantity' ])
+            return reservation
+
+        if reservation is not None:
+            give_back(reservation.product_id, reservation.warehouse_id, reservation.quantity)
+            reservation.delete()
+        if warehouse_id is None:
+            return None
+        take(line.product_id, warehouse_id, line.quantity)
+        return StockReservation.objects.create(
+            order_line=line,
+            product_id=line.product_id,
+            warehouse_id=warehouse_id,
+            quantity=line.quantity,
+        )
+
+
+def release_order_line(line):
+    # Сама запись резерва удаляется каскадом вместе со строкой заказа
+    reservation = StockReservation.objects.filter(order_line_id=line.pk).first()
+    if reservation is not None:
+        give_back(reservation.product_id, reservation.warehouse_id, reservation.quantity)
+
+
+def sync_order_reservations(order):
+    # После смены статуса или склада заказа: отгрузка и отмена возвращают резерв, возврат в работу — берёт снова
+    with transaction.atomic():
+        for line in order.productinorder_set.all():
+            reserve_order_line(line, order)
+
+
+def refresh_reserved(warehouse_id=None):
+    """
+    Пересчитывает StockBalance.reserved по таблице резервов
+    """
+    balances = StockBalance.objects.all()
+    reservations = StockReservation.objects.all()
+    if warehouse_id is not None:
+        balances = balances.filter(warehouse_id=warehouse_id)
+        reservations = reservations.filter(warehouse_id=warehouse_id)
+    totals = reservations.values('product_id', 'warehouse_id').annotate(total=Sum('quantity')).order_by()
+
+    with transaction.atomic():
+        balances.update(reserved=0)
+        StockBalance.objects.bulk_create(
+            [ StockBalance(product_id=row[ 'product_id' ], warehouse_id=row[ 'warehouse_id' ]) for row in totals ],
+            ignore_conflicts=True,
+        )
+        for row in totals:
+            StockBalance.objects.filter(product_id=row[ 'product_id' ], warehouse_id=row[ 'warehouse_id' ]).update(
+                reserved=row[ 'total' ],
+            )
+
+
+def rebuild_reservations():
+    """
+    Заново создаёт резервы по строкам открытых заказов со складом. Резерв здесь не проверяется
+    по остатку: восстанавливается то, что заказы уже обещали
+    """
+    lines = ProductInOrder.objects.filter(order__warehouse__isnull=False) \
+        .exclude(order__status__in=Order.RELEASED_STATUSES) \
+        .values_list('pk', 'product_id', 'order__warehouse_id', 'quantity')
+    with transaction.atomic():
+        StockReservation.objects.all().delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(order_line_id=pk, product_id=product_id, warehouse_id=warehouse_id, quantity=quantity)
+            for pk, product_id, warehouse_id, quantity in lines.iterator()
+        ], batch_size=1000)
+        refresh_reserved()
+    return StockReservation.objects.count()
+
+
+class ReservationFormMixin:
+    """
+    Резерв берётся, а отгрузка проводится сигналами при сохранении. Если доступный остаток заняли между проверкой
+    формы и записью, сохранение откатывается, а ошибка показывается в форме
+    """
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                serialize_writes()
+                return super().form_valid(form)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
@@ -0,0 +1,184 @@
+import re
+
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, Q
+
+from ..models import Product, Category
+
+SEARCH_LIMIT = 500
+FTS_TABLE = 'warehouse_product_fts'
+MYSQL_SEARCH_TABLE = 'warehouse_productsearch'
+
+# Вес совпадения по колонкам: наименование важнее категории, категория важнее описания
+SQLITE_RANK = f'bm25({FTS_TABLE}, 10.0, 1.0, 3.0)'
+MYSQL_MATCH = f'MATCH(s.name, s.description, s.category_name) AGAINST (%s IN BOOLEAN MODE)'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, description, category_name, tokenize='unicode61 remove_diacritics 2')",
+]
+SQLITE_DROP = [ f'DROP TABLE IF EXISTS {FTS_TABLE}' ]
+MYSQL_CREATE = [
+    f'CREATE TABLE IF NOT EXISTS {MYSQL_SEARCH_TABLE} ('
+    f'product_id BIGINT NOT NULL PRIMARY KEY, '
+    f'name VARCHAR(100) NOT NULL, '
+    f'description LONGTEXT NOT NULL, '
+    f'category_name VARCHAR(100) NOT NULL, '
+    f'FULLTEXT INDEX {MYSQL_SEARCH_TABLE}_fulltext (name, description, category_name)'
+    f') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4',
+]
+MYSQL_DROP = [ f'DROP TABLE IF EXISTS {MYSQL_SEARCH_TABLE}' ]
+
+
+def is_indexed(using=None):
+    # Полнотекстовый индекс есть для SQLite (FTS5) и MySQL (FULLTEXT); на остальных базах ищем через icontains
+    return (using or connection).vendor in ('sqlite', 'mysql')
+
+
+def create_search_index(using=None):
+    using = using or connection
+    statements = { 'sqlite': SQLITE_CREATE, 'mysql': MYSQL_CREATE }.get(using.vendor, [ ])
+    with using.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def drop_search_index(using=None):
+    using = using or connection
+    statements = { 'sqlite': SQLITE_DROP, 'mysql': MYSQL_DROP }.get(using.vendor, [ ])
+    with using.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def document_select(where):
+    # Документ поиска: наименование и описание продукта плюс наименование категории
+    return (
+        f"SELECT p.id, p.name, COALESCE(p.description, ''), COALESCE(c.name, '') "
+        f"FROM {Product._meta.db_table} p LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id "
+        f"WHERE {where}"
+    )
+
+
+def reindex(where, params, using=None):
+    using = using or connection
+    if not is_indexed(using):
+        return
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM {Product._meta.db_table} p WHERE {where})',
+                params,
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category_name) {document_select(where)}',
+                params,
+            )
+        else:
+            cursor.execute(
+                f'REPLACE INTO {MYSQL_SEARCH_TABLE} (product_id, name, description, category_name) '
+                f'{document_select(where)}',
+                params,
+            )
+
+
+def index_products(product_ids, using=None):
+    product_ids = [ int(pk) for pk in product_ids ]
+    if product_ids:
+        placeholders = ', '.join([ '%s' ] * len(product_ids))
+        reindex(f'p.id IN ({placeholders})', product_ids, using)
+
+
+def index_category(category_id, using=None):
+    # Переименование категории меняет документы всех её продуктов: один INSERT ... SELECT
+    reindex('p.category_id = %s', [ category_id ], using)
+
+
+def unindex_products(product_ids, using=None):
+    using = using or connection
+    product_ids = [ int(pk) for pk in product_ids ]
+    if not product_ids or not is_indexed(using):
+        return
+    placeholders = ', '.join([ '%s' ] * len(product_ids))
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+        else:
+            cursor.execute(f'DELETE FROM {MYSQL_SEARCH_TABLE} WHERE product_id IN ({placeholders})', product_ids)
+
+
+def rebuild_search_index(using=None):
+    using = using or connection
+    if not is_indexed(using):
+        return 0
+    with using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE if using.vendor == "sqlite" else MYSQL_SEARCH_TABLE}')
+    reindex('1 = 1', [ ], using)
+    return Product.objects.using(using.alias).count()
+
+
+def search_terms(query):
+    return TOKEN_RE.findall(query or '')
+
+
+def match_expression(terms, vendor):
+    # Каждое слово ищем по префиксу (поиск при наборе), все слова обязательны
+    if vendor == 'sqlite':
+        return ' '.join([ f'"{term}"*' for term in terms ])
+    return ' '.join([ f'+{term}*' for term in terms ])
+
+
+def search_product_ids(query, category_id=None, limit=SEARCH_LIMIT, using=None):
+    """
+    Идентификаторы продуктов, найденных по полнотекстовому индексу, от самого релевантного
+    """
+    using = using or connection
+    terms = search_terms(query)
+    if not terms:
+        return [ ]
+    match = match_expression(terms, using.vendor)
+    category_filter = 'AND p.category_id = %s' if category_id else ''
+    category_params = [ category_id ] if category_id else [ ]
+    if using.vendor == 'sqlite':
+        sql = (
+            f'SELECT p.id FROM {FTS_TABLE} f JOIN {Product._meta.db_table} p ON p.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s {category_filter} ORDER BY {SQLITE_RANK}, p.id LIMIT %s'
+        )
+        params = [ match, *category_params, limit ]
+    else:
+        sql = (
+            f'SELECT p.id FROM {MYSQL_SEARCH_TABLE} s JOIN {Product._meta.db_table} p ON p.id = s.product_id '
+            f'WHERE {MYSQL_MATCH} {category_filter} ORDER BY {MYSQL_MATCH} DESC, p.id LIMIT %s'
+        )
+        params = [ match, *category_params, match, limit ]
+    with using.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [ row[ 0 ] for row in cursor.fetchall() ]
+
+
+def search_products(query, queryset=None, category_id=None, limit=SEARCH_LIMIT):
+    """
+    Единая точка поиска продуктов: queryset, отфильтрованный по запросу и упорядоченный по релевантности
+    (аннотация search_rank, 0 — лучший результат)
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+    if not search_terms(query):
+        return queryset.order_by('name')
+
+    if not is_indexed():
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query)).order_by('name')
+
+    ids = search_product_ids(query, category_id=category_id, limit=limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).annotate(
+        search_rank=Case(
+            *[ When(pk=pk, then=Value(position)) for position, pk in enumerate(ids) ],
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank')
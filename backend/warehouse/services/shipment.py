@@ -0,0 +1,94 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.template.defaultfilters import floatformat
+
+from ..models import Order, ProductInWarehouse, StockBalance
+from .fifo import consume_layers
+from .reservations import serialize_writes
+from .stock import apply_stock_changes, stock_changes
+
+SHIPMENT_BATCH_SIZE = 500
+
+
+def lock_balances(keys):
+    """
+    select_for_update строк остатков пар (продукт, склад) до конца транзакции. Строки блокируются в одном
+    для всех порядке (product_id, warehouse_id), поэтому отгрузки с общими товарами не ждут друг друга по кругу
+    """
+    keys = set(keys)
+    if not keys:
+        return { }
+    balances = StockBalance.objects.select_for_update().filter(
+        product_id__in={ product_id for product_id, _ in keys },
+        warehouse_id__in={ warehouse_id for _, warehouse_id in keys },
+    ).order_by('product_id', 'warehouse_id')
+    return {
+        (balance.product_id, balance.warehouse_id): balance
+        for balance in balances
+        if (balance.product_id, balance.warehouse_id) in keys
+    }
+
+
+def ship_order_lines(order):
+    """
+    Проводит расход по всем строкам заказа одной транзакцией: остатки блокируются, заново проверяются
+    и только потом списываются. Если хоть одного товара не хватает — ValidationError и ничего не проводится.
+    Повторный вызов для уже отгруженного заказа ничего не делает
+    """
+    if order.warehouse_id is None:
+        return [ ]
+    with transaction.atomic():
+        serialize_writes()
+        lines = list(order.productinorder_set.select_related('product').order_by('pk'))
+        needed = defaultdict(Decimal)
+        for line in lines:
+            needed[ (line.product_id, order.warehouse_id) ] += line.quantity
+        balances = lock_balances(needed)
+        # Под блокировкой: параллельная отгрузка того же заказа могла уже провести расход
+        if ProductInWarehouse.objects.filter(order=order).exists():
+            return [ ]
+
+        products = { line.product_id: line.product for line in lines }
+        errors = [ ]
+        for (product_id, warehouse_id), quantity in needed.items():
+            balance = balances.get((product_id, warehouse_id))
+            on_hand = balance.quantity if balance is not None else Decimal(0)
+            if quantity > on_hand:
+                errors.append(f'Продукт {products[ product_id ].name}: к отгрузке {floatformat(quantity, -2)}, '
+                              f'на складе {floatformat(on_hand, -2)}')
+        if errors:
+            raise ValidationError(errors)
+
+        movements = [
+            ProductInWarehouse(
+                product_id=line.product_id,
+                warehouse_id=order.warehouse_id,
+                quantity=line.quantity,
+                transaction='out',
+                order=order,
+            )
+            for line in lines
+        ]
+        ProductInWarehouse.objects.bulk_create(movements, batch_size=SHIPMENT_BATCH_SIZE)
+        # bulk_create не вызывает сигналы: остатки и списание слоёв FIFO проводим сами, движения находим по заказу
+        apply_stock_changes(stock_changes(movements))
+        for movement in ProductInWarehouse.objects.filter(order=order).order_by('pk'):
+            consume_layers(movement)
+    return movements
+
+
+def ship_order(order_id):
+    """
+    Переводит заказ в "отгружен"; расход проводит сигнал заказа через ship_order_lines
+    """
+    with transaction.atomic():
+        serialize_writes()
+        order = Order.objects.select_for_update().get(pk=order_id)
+        if order.status == 'shipped':
+            return order
+        order.status = 'shipped'
+        order.save()
+    return order
@@ -0,0 +1,148 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from ..models import Product, ProductInWarehouse, StockBalance, signed_movement
+from .keyset import iterate_in_chunks
+from .reservations import refresh_reserved
+
+StockChange = namedtuple('StockChange', [ 'product_id', 'warehouse_id', 'quantity', 'cost_price', 'date' ])
+
+REBUILD_BATCH_SIZE = 1000
+AVERAGE_COST_PRECISION = Decimal('0.0001')
+
+
+def signed_quantity(movement_transaction, quantity):
+    # Приход и возврат увеличивают остаток, отгрузка и списание уменьшают
+    quantity = quantity or Decimal(0)
+    if movement_transaction in ProductInWarehouse.INCOMING_TRANSACTIONS:
+        return quantity
+    return -quantity
+
+
+def signed_quantity_expression(prefix=''):
+    # То же правило знака, но для агрегатов в SQL
+    return signed_movement(F(f'{prefix}quantity'), prefix)
+
+
+def stock_changes(movements, sign=1):
+    # cost_price передаётся только для прихода с известной себестоимостью, date — только для прямого изменения
+    for movement in movements:
+        is_incoming = movement.transaction in ProductInWarehouse.INCOMING_TRANSACTIONS
+        yield StockChange(
+            product_id=movement.product_id,
+            warehouse_id=movement.warehouse_id,
+            quantity=sign * signed_quantity(movement.transaction, movement.quantity),
+            cost_price=movement.cost_price if is_incoming else None,
+            date=movement.date_created if sign > 0 else None,
+        )
+
+
+def apply_change(balance, change):
+    # Скользящая средняя: приход с себестоимостью пересчитывает среднюю, расход её не меняет
+    if change.cost_price is not None:
+        held = max(balance.quantity, Decimal(0))
+        quantity = held + change.quantity
+        if quantity > 0:
+            value = held * (balance.average_cost or Decimal(0)) + change.quantity * change.cost_price
+            balance.average_cost = (value / quantity).quantize(AVERAGE_COST_PRECISION)
+    balance.quantity += change.quantity
+    if change.date is not None:
+        if change.cost_price is not None:
+            balance.last_cost_price = change.cost_price
+        if balance.last_date is None or change.date >= balance.last_date:
+            balance.last_date = change.date
+
+
+def apply_stock_changes(changes, create_missing=True):
+    changes = list(changes)
+    keys = { (change.product_id, change.warehouse_id) for change in changes }
+    if not keys:
+        return
+
+    with transaction.atomic():
+        if create_missing:
+            StockBalance.objects.bulk_create(
+                [ StockBalance(product_id=product_id, warehouse_id=warehouse_id) for product_id, warehouse_id in keys ],
+                ignore_conflicts=True,
+            )
+        balances = {
+            (balance.product_id, balance.warehouse_id): balance
+            for balance in StockBalance.objects.select_for_update().filter(
+                product_id__in={ product_id for product_id, _ in keys },
+                warehouse_id__in={ warehouse_id for _, warehouse_id in keys },
+            )
+            if (balance.product_id, balance.warehouse_id) in keys
+        }
+        # Изменения применяем по порядку, чтобы средняя себестоимость считалась так же, как при пересчёте
+        for change in changes:
+            balance = balances.get((change.product_id, change.warehouse_id))
+            if balance is not None:
+                apply_change(balance, change)
+        StockBalance.objects.bulk_update(
+            balances.values(),
+            [ 'quantity', 'average_cost', 'last_cost_price', 'last_date' ],
+        )
+
+
+def refresh_last_movement(product_id, warehouse_id):
+    # После изменения или удаления движения пересчитываем "последние" значения по одной паре
+    movements = ProductInWarehouse.objects.filter(product_id=product_id, warehouse_id=warehouse_id)
+    last_incoming = movements.filter(
+        transaction__in=ProductInWarehouse.INCOMING_TRANSACTIONS,
+        cost_price__isnull=False,
+    ).order_by('-date_created', '-pk').values_list('cost_price', flat=True).first()
+    last_date = movements.order_by('-date_created', '-pk').values_list('date_created', flat=True).first()
+    StockBalance.objects.filter(product_id=product_id, warehouse_id=warehouse_id).update(
+        last_cost_price=last_incoming,
+        last_date=last_date,
+    )
+
+
+def rebuild_stock_balances(warehouse_id=None):
+    # Проигрываем журнал по порядку: так остаток и скользящая средняя совпадают с инкрементальным расчётом
+    movements = ProductInWarehouse.objects.only(
+        'product_id', 'warehouse_id', 'quantity', 'cost_price', 'transaction', 'date_created',
+    )
+    balances = StockBalance.objects.all()
+    if warehouse_id is not None:
+        movements = movements.filter(warehouse_id=warehouse_id)
+        balances = balances.filter(warehouse_id=warehouse_id)
+
+    created = 0
+    batch = [ ]
+    balance = None
+    with transaction.atomic():
+        balances.delete()
+        ordering = ('product_id', 'warehouse_id', 'date_created', 'pk')
+        for movement in iterate_in_chunks(movements, ordering=ordering):
+            if balance is None or (balance.product_id, balance.warehouse_id) != (movement.product_id,
+                                                                                  movement.warehouse_id):
+                balance = StockBalance(product_id=movement.product_id, warehouse_id=movement.warehouse_id)
+                batch.append(balance)
+                if len(batch) > REBUILD_BATCH_SIZE:
+                    StockBalance.objects.bulk_create(batch[ :-1 ])
+                    created += len(batch) - 1
+                    batch = batch[ -1: ]
+            apply_change(balance, next(stock_changes([ movement ])))
+        StockBalance.objects.bulk_create(batch)
+        created += len(batch)
+        # Резерв не выводится из движений: восстанавливаем его по таблице резервов
+        refresh_reserved(warehouse_id)
+    return created
+
+
+def sellable_products(warehouse_id=None, keep_product_id=None):
+    # Товары с доступным остатком (available_quantity = остаток - резерв) по таблице остатков;
+    # без склада — по всем складам. keep_product_id остаётся в списке и без остатка — товар изменяемой строки
+    available = F('stockbalance__quantity') - F('stockbalance__reserved')
+    if warehouse_id is not None:
+        products = Product.objects.filter(stockbalance__warehouse_id=warehouse_id) \
+            .annotate(available_quantity=available)
+    else:
+        products = Product.objects.annotate(
+            available_quantity=Sum(available, filter=Q(stockbalance__quantity__gt=F('stockbalance__reserved'))),
+        )
+    return products.filter(Q(available_quantity__gt=0) | Q(pk=keep_product_id)).order_by('name')
@@ -0,0 +1,122 @@
+import random
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+
+from ..models import (
+    Category,
+    Product,
+    Warehouse,
+    ProductInWarehouse,
+    StockBalance,
+    CostLayer,
+    Consumer,
+    Order,
+    ProductInOrder,
+)
+from .shipment import ship_order
+from .stock import signed_quantity_expression
+
+StressScale = namedtuple('StressScale', [ 'products', 'orders', 'lines', 'stock', 'threads' ])
+StressResult = namedtuple('StressResult', [ 'outcomes', 'seconds', 'violations' ])
+
+DEFAULT_STRESS_SCALE = StressScale(products=3, orders=200, lines=2, stock=100, threads=16)
+
+
+def create_stress_data(scale, seed=0, prefix='stress'):
+    """
+    Несколько товаров с приходом на один склад и заказы, которые вместе просят больше, чем есть.
+    Строки заказов создаются без резерва (bulk_create): так отгрузки спорят за один и тот же остаток
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        category = Category.objects.create(name=f'{prefix} Категория', description='')
+        warehouse = Warehouse.objects.create(name=f'{prefix} Склад', description='')
+        consumer = Consumer.objects.create(name=f'{prefix} Покупатель', description='')
+        products = [
+            Product.objects.create(name=f'{prefix} Продукт {i}', category=category, weight=1, retail_price=100)
+            for i in range(scale.products)
+        ]
+        for product in products:
+            ProductInWarehouse.objects.create(product=product, warehouse=warehouse, quantity=scale.stock,
+                                              cost_price=10, transaction='in')
+        orders = [ Order.objects.create(consumer=consumer, warehouse=warehouse) for _ in range(scale.orders) ]
+        # Товары строк в случайном порядке: блокировки должны браться в своём порядке, а не в порядке строк
+        ProductInOrder.objects.bulk_create([
+            ProductInOrder(order=order, product=product, quantity=Decimal(rng.randint(1, 5)))
+            for order in orders
+            for product in rng.sample(products, min(scale.lines, len(products)))
+        ])
+    return category, warehouse, consumer, orders
+
+
+def ship_in_thread(order_id):
+    try:
+        ship_order(order_id)
+        return 'shipped'
+    except ValidationError:
+        return 'short'
+    except OperationalError:
+        return 'locked'
+    finally:
+        # У каждого потока своё соединение; закрываем, чтобы не держать файл базы и блокировки
+        connection.close()
+
+
+def check_conservation(warehouse, stock):
+    """
+    Инварианты после параллельных отгрузок; возвращает список нарушений
+    """
+    violations = [ ]
+    products = Product.objects.filter(stockbalance__warehouse=warehouse).distinct()
+    for product in products:
+        balance = StockBalance.objects.get(product=product, warehouse=warehouse)
+        journal = ProductInWarehouse.objects.filter(product=product, warehouse=warehouse) \
+            .aggregate(total=Sum(signed_quantity_expression()))[ 'total' ] or 0
+        shipped = ProductInWarehouse.objects.filter(product=product, warehouse=warehouse, transaction='out') \
+            .aggregate(total=Sum('quantity'))[ 'total' ] or 0
+        layers = CostLayer.objects.filter(product=product, warehouse=warehouse) \
+            .aggregate(total=Sum('remaining_quantity'))[ 'total' ] or 0
+        if balance.quantity < 0:
+            violations.append(f'{product.name}: отрицательный остаток {balance.quantity}')
+        if balance.quantity != journal:
+            violations.append(f'{product.name}: остаток {balance.quantity}, по журналу {journal}')
+        if balance.quantity != stock - shipped:
+            violations.append(f'{product.name}: остаток {balance.quantity}, приход {stock} - расход {shipped}')
+        if layers != balance.quantity:
+            violations.append(f'{product.name}: в слоях FIFO {layers}, остаток {balance.quantity}')
+
+    for order in Order.objects.filter(warehouse=warehouse).prefetch_related('productinorder_set'):
+        movements = ProductInWarehouse.objects.filter(order=order).count()
+        expected = len(order.productinorder_set.all()) if order.status == 'shipped' else 0
+        if movements != expected:
+            violations.append(f'Заказ {order.pk} ({order.status}): движений {movements}, ожидалось {expected}')
+    return violations
+
+
+def run_shipment_stress(scale=DEFAULT_STRESS_SCALE, seed=0, prefix='stress', keep=False):
+    """
+    Отгружает все заказы параллельно в scale.threads потоках и проверяет, что товар не появился
+    и не пропал: остаток не ниже нуля и совпадает с журналом, слоями FIFO и приходом за вычетом отгрузок
+    """
+    category, warehouse, consumer, orders = create_stress_data(scale, seed=seed, prefix=prefix)
+    order_ids = [ order.pk for order in orders ]
+    random.Random(seed).shuffle(order_ids)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=scale.threads) as executor:
+            outcomes = Counter(executor.map(ship_in_thread, order_ids))
+        seconds = time.perf_counter() - start
+        violations = check_conservation(warehouse, scale.stock)
+    finally:
+        if not keep:
+            with transaction.atomic():
+                consumer.delete()
+                warehouse.delete()
+                category.delete()
+    return StressResult(outcomes, seconds, violations)
@@ -0,0 +1,335 @@
+import random
+from collections import namedtuple, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from operator import itemgetter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max, F
+
+from ..models import (
+    Category,
+    Product,
+    ProductInLot,
+    LotCost,
+    Lot,
+    Warehouse,
+    ProductInWarehouse,
+    StockBalance,
+    CostLayerConsumption,
+    Consumer,
+    Order,
+    ProductInOrder,
+    Cost,
+)
+from .cash import rebuild_cash_balances
+from .consumers import recompute_all
+from .fifo import rebuild_cost_layers
+from .reference import invalidate_reference
+from .reservations import rebuild_reservations
+from .search import rebuild_search_index
+from .stock import rebuild_stock_balances
+
+BATCH_SIZE = 1000
+PRICE_PRECISION = Decimal('0.01')
+
+DatasetScale = namedtuple('DatasetScale', [
+    'categories', 'products', 'warehouses', 'lots', 'lot_lines', 'consumers', 'orders', 'order_lines', 'costs',
+    'days',
+])
+
+DEFAULT_SCALE = DatasetScale(
+    categories=20,
+    products=2000,
+    warehouses=3,
+    lots=200,
+    lot_lines=10,
+    consumers=300,
+    orders=2000,
+    order_lines=5,
+    costs=1000,
+    days=365,
+)
+
+WORDS = [
+    'Молоко', 'Кефир', 'Сыр', 'Масло', 'Чай', 'Кофе', 'Сахар', 'Мука', 'Рис', 'Гречка', 'Макароны', 'Соль',
+    'Перец', 'Томаты', 'Огурцы', 'Яблоки', 'Груши', 'Сок', 'Вода', 'Печенье', 'Шоколад', 'Конфеты', 'Хлеб',
+]
+ADJECTIVES = [ 'белый', 'чёрный', 'зелёный', 'сладкий', 'солёный', 'свежий', 'домашний', 'отборный', 'лёгкий' ]
+
+
+UNSCALED_FIELDS = ( 'lot_lines', 'order_lines', 'days' )
+
+
+def scaled(scale, factor):
+    # Растёт число сущностей; строк в лоте и заказе и глубина истории в днях не меняются
+    return scale._replace(**{
+        field: max(1, int(getattr(scale, field) * factor)) for field in scale._fields if field not in UNSCALED_FIELDS
+    })
+
+
+def price(rng, low, high):
+    return Decimal(str(rng.uniform(low, high))).quantize(PRICE_PRECISION)
+
+
+def create_and_fetch(model, objs, with_history=False, dates=None):
+    # bulk_create на SQLite/MySQL не возвращает pk: перечитываем созданные строки по возрастанию pk
+    last_pk = model.objects.aggregate(last_pk=Max('pk'))[ 'last_pk' ] or 0
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    created = list(model.objects.filter(pk__gt=last_pk).order_by('pk'))
+    if dates is not None:
+        # auto_now_add проставляет сегодняшнюю дату при создании, нужные даты записываем вторым проходом
+        for obj, day in zip(created, dates):
+            obj.date_created = day
+        model.objects.bulk_update(created, [ 'date_created' ], batch_size=BATCH_SIZE)
+    if with_history:
+        model.history.bulk_history_create(created, batch_size=BATCH_SIZE)
+    return created
+
+
+class AvailableStock:
+    """
+    Доступный остаток пар (продукт, склад) по ходу времени: приход открывается к своей дате, строки заказов
+    забирают товар, пока он есть. Продукты с остатком хранятся списком по складу для выборки за O(строк заказа)
+    """
+    def __init__(self, dated_movements):
+        self.receipts = sorted(
+            ((day, movement) for day, movement in dated_movements if movement.transaction == 'in'),
+            key=itemgetter(0),
+        )
+        self.position = 0
+        self.quantities = { }
+        self.in_stock = defaultdict(list)
+        self.indexes = { }
+
+    def advance(self, day):
+        while self.position < len(self.receipts) and self.receipts[ self.position ][ 0 ] <= day:
+            movement = self.receipts[ self.position ][ 1 ]
+            self.put(movement.warehouse_id, movement.product_id, movement.quantity)
+            self.position += 1
+
+    def put(self, warehouse_id, product_id, quantity):
+        key = (warehouse_id, product_id)
+        if key not in self.indexes:
+            self.indexes[ key ] = len(self.in_stock[ warehouse_id ])
+            self.in_stock[ warehouse_id ].append(product_id)
+        self.quantities[ key ] = self.quantities.get(key, 0) + quantity
+
+    def remove(self, warehouse_id, product_id):
+        # Последний продукт списка занимает место выбывшего
+        products = self.in_stock[ warehouse_id ]
+        index = self.indexes.pop((warehouse_id, product_id))
+        last = products.pop()
+        if last != product_id:
+            products[ index ] = last
+            self.indexes[ (warehouse_id, last) ] = index
+
+    def take(self, rng, warehouse_id, count, max_quantity=10):
+        products = self.in_stock[ warehouse_id ]
+        taken = [ ]
+        for product_id in rng.sample(products, min(count, len(products))):
+            key = (warehouse_id, product_id)
+            quantity = min(Decimal(rng.randint(1, max_quantity)), self.quantities[ key ])
+            self.quantities[ key ] -= quantity
+            taken.append((product_id, quantity))
+        for product_id, _ in taken:
+            if not self.quantities[ (warehouse_id, product_id) ]:
+                self.remove(warehouse_id, product_id)
+        return taken
+
+
+def check_dataset(warehouses):
+    """
+    Инварианты сгенерированного набора: остаток не ниже нуля и не меньше резерва, каждое списание — со слоя FIFO.
+    Возвращает список нарушений
+    """
+    violations = [ ]
+    balances = StockBalance.objects.filter(warehouse__in=warehouses).select_related('product', 'warehouse')
+    for balance in balances.filter(quantity__lt=0):
+        violations.append(f'{balance.warehouse.name}, {balance.product.name}: отрицательный остаток {balance.quantity}')
+    for balance in balances.filter(reserved__gt=F('quantity')):
+        violations.append(f'{balance.warehouse.name}, {balance.product.name}: '
+                          f'резерв {balance.reserved} больше остатка {balance.quantity}')
+    unmatched = CostLayerConsumption.objects.filter(movement__warehouse__in=warehouses, layer__isnull=True).count()
+    if unmatched:
+        violations.append(f'Списаний без слоя FIFO: {unmatched}')
+    return violations
+
+
+def generate_dataset(scale=DEFAULT_SCALE, seed=0, prefix='bench', today=None):
+    """
+    Воспроизводимый набор данных: один seed — один и тот же набор. Производные таблицы
+    (остатки, слои FIFO, дневные итоги, поисковый индекс) пересчитываются в конце, после чего проверяются
+    инварианты (check_dataset); при нарушении генерация откатывается с ValidationError
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    start = today - timedelta(days=scale.days)
+
+    def random_day():
+        return start + timedelta(days=rng.randint(0, scale.days))
+
+    with transaction.atomic():
+        categories = create_and_fetch(Category, [
+            Category(name=f'{prefix} {rng.choice(WORDS)} {i}', description=f'Категория {i}')
+            for i in range(scale.categories)
+        ])
+        products = create_and_fetch(Product, [
+            Product(
+                name=f'{prefix} {rng.choice(WORDS)} {rng.choice(ADJECTIVES)} {i}',
+                description=f'{rng.choice(ADJECTIVES)} {rng.choice(WORDS).lower()}, партия {rng.randint(1, 99)}',
+                category=rng.choice(categories),
+                weight=price(rng, 0.1, 25),
+                retail_price=price(rng, 10, 5000),
+            )
+            for i in range(scale.products)
+        ], with_history=True)
+        warehouses = create_and_fetch(Warehouse, [
+            Warehouse(name=f'{prefix} Склад {i}', description='') for i in range(scale.warehouses)
+        ])
+
+        # Лоты: строки, затраты и (для доставленных на склад) приходы с себестоимостью
+        lot_dates = [ random_day() for _ in range(scale.lots) ]
+        statuses = rng.choices(
+            [ 'new', 'paid', 'delivered', 'delivered_to_warehouse' ], weights=[ 1, 2, 2, 5 ], k=scale.lots,
+        )
+        lots = create_and_fetch(Lot, [
+            Lot(status=status, description=f'Закупка {i}') for i, status in enumerate(statuses)
+        ], with_history=True, dates=lot_dates)
+        lines = [ ]
+        lot_costs = [ ]
+        for lot in lots:
+            for product in rng.sample(products, min(scale.lot_lines, len(products))):
+                lines.append(ProductInLot(
+                    product=product,
+                    lot=lot,
+                    quantity=Decimal(rng.randint(1, 200)),
+                    purchase_price=(product.retail_price * Decimal(rng.uniform(0.4, 0.8))).quantize(PRICE_PRECISION),
+                ))
+            for name in rng.sample([ code for code, _ in LotCost.LOT_COST_CHOICES ], rng.randint(0, 3)):
+                lot_costs.append(LotCost(
+                    lot=lot,
+                    name=name,
+                    distribution=rng.choice([ code for code, _ in LotCost.DISTRIBUTION_CHOICES ]),
+                    amount_spent=price(rng, 100, 20000),
+                ))
+        lines = create_and_fetch(ProductInLot, lines, with_history=True)
+        lot_costs = create_and_fetch(LotCost, lot_costs, with_history=True,
+                                     dates=[ lot_cost.lot.date_created for lot_cost in lot_costs ])
+        lots_by_pk = { lot.pk: lot for lot in lots }
+
+        received = {
+            lot.pk: (lot, rng.choice(warehouses)) for lot in lots if lot.status == 'delivered_to_warehouse'
+        }
+        movements = [ ]
+        movement_dates = [ ]
+        for line in lines:
+            if line.lot_id in received:
+                lot, warehouse = received[ line.lot_id ]
+                movements.append(ProductInWarehouse(
+                    product_id=line.product_id,
+                    warehouse=warehouse,
+                    quantity=line.quantity,
+                    cost_price=line.purchase_price,
+                    transaction='in',
+                    lot=lot,
+                ))
+                movement_dates.append(lot.date_created + timedelta(days=rng.randint(0, 14)))
+
+        consumers = create_and_fetch(Consumer, [
+            Consumer(name=f'{prefix} Покупатель {i}', description='') for i in range(scale.consumers)
+        ])
+
+        # Заказы: создаются новыми, затем переходят в итоговый статус — в истории остаётся переход
+        order_dates = [ random_day() for _ in range(scale.orders) ]
+        orders = create_and_fetch(Order, [
+            Order(consumer=rng.choice(consumers), warehouse=rng.choice(warehouses), status='new')
+            for _ in range(scale.orders)
+        ], dates=order_dates)
+        Order.history.bulk_history_create(orders, batch_size=BATCH_SIZE)
+        for order in orders:
+            order.status = rng.choices([ 'new', 'paid', 'not_paid', 'shipped' ], weights=[ 1, 3, 1, 5 ])[ 0 ]
+
+        # Строки заказов берут товар из остатка склада на дату заказа: отгрузка его списывает, открытый заказ
+        # резервирует. Заказ, которому на складе ничего не досталось, отменяется
+        stock = AvailableStock(zip(movement_dates, movements))
+        order_lines = [ ]
+        for order in sorted(orders, key=lambda order: (order.date_created, order.pk)):
+            stock.advance(order.date_created)
+            taken = stock.take(rng, order.warehouse_id, scale.order_lines)
+            if not taken:
+                order.status = 'cancelled'
+            for product_id, quantity in taken:
+                order_lines.append(ProductInOrder(order=order, product_id=product_id, quantity=quantity))
+        Order.objects.bulk_update(orders, [ 'status' ], batch_size=BATCH_SIZE)
+        Order.history.bulk_history_create(orders, batch_size=BATCH_SIZE, update=True)
+        order_lines = create_and_fetch(ProductInOrder, order_lines, with_history=True)
+
+        products_by_pk = { product.pk: product for product in products }
+        orders_by_pk = { order.pk: order for order in orders }
+        order_totals = defaultdict(Decimal)
+        for line in order_lines:
+            order = orders_by_pk[ line.order_id ]
+            order_totals[ order.pk ] += line.quantity * products_by_pk[ line.product_id ].retail_price
+            if order.status == 'shipped':
+                movements.append(ProductInWarehouse(
+                    product_id=line.product_id,
+                    warehouse_id=order.warehouse_id,
+                    quantity=line.quantity,
+                    transaction='out',
+                    order=order,
+                ))
+                movement_dates.append(order.date_created)
+        create_and_fetch(ProductInWarehouse, movements, dates=movement_dates)
+
+        # Деньги: оплата лотов и затрат на них, продажи и произвольные приходы/расходы
+        costs = [ ]
+        lot_totals = defaultdict(Decimal)
+        for line in lines:
+            lot_totals[ line.lot_id ] += line.quantity * line.purchase_price
+        for lot in lots:
+            if lot.status != 'new':
+                costs.append(Cost(name=f'Оплата лота {lot.pk}', amount=lot_totals[ lot.pk ], transaction='out',
+                                  date_created=lot.date_created, lot=lot, lot_payment=lot))
+        for lot_cost in lot_costs:
+            if lots_by_pk[ lot_cost.lot_id ].status != 'new':
+                costs.append(Cost(name=f'Затраты {lot_cost.pk} на лот #{lot_cost.lot_id}', amount=lot_cost.amount_spent,
+                                  transaction='out', date_created=lot_cost.date_created, lot_id=lot_cost.lot_id,
+                                  lot_cost=lot_cost))
+        for order in orders:
+            if order.status in ('paid', 'shipped'):
+                costs.append(Cost(name=f'Продажа {order.pk}', amount=order_totals[ order.pk ], transaction='in',
+                                  date_created=order.date_created, order=order))
+        for i in range(scale.costs):
+            costs.append(Cost(name=f'{prefix} Операция {i}', amount=price(rng, 100, 50000),
+                              transaction=rng.choice([ 'in', 'out' ]), date_created=random_day()))
+        create_and_fetch(Cost, costs, with_history=True)
+
+        # Сумма покупок, число заказов, долг и уровень — тем же пересчётом, что и manage.py recompute_consumers
+        recompute_all(Consumer.objects.filter(pk__in=[ consumer.pk for consumer in consumers ]))
+
+        rebuild_stock_balances()
+        rebuild_reservations()
+        rebuild_cost_layers()
+        rebuild_cash_balances()
+        rebuild_search_index()
+        invalidate_reference()
+
+        violations = check_dataset(warehouses)
+        if violations:
+            raise ValidationError(violations)
+
+    return {
+        'categories': len(categories),
+        'products': len(products),
+        'warehouses': len(warehouses),
+        'lots': len(lots),
+        'lot_lines': len(lines),
+        'lot_costs': len(lot_costs),
+        'movements': len(movements),
+        'consumers': len(consumers),
+        'orders': len(orders),
+        'order_lines': len(order_lines),
+        'costs': len(costs),
+    }
@@ -1,27 +1,8 @@
 from django.shortcuts import render, redirect
 
-from ..models import ProductInLot, Lot, LotCost, Warehouse, ProductInWarehouse, ProductInOrder
-from ..utils import add_costs_out_from_lot_if_not_exists
-
-
-def product_cost_price(lot_id=None, product_in_lot_id=None):
-    lot = Lot.objects.get(id=lot_id)
-    product_in_lot = ProductInLot.objects.get(id=product_in_lot_id)
-    products_in_lot_total_quantity = lot.get_products_quantity()
-    product_in_lot_total_weight = lot.get_products_weight()
-    lots_costs = LotCost.objects.filter(lot=lot_id)
-    cost_price = 0
-    for lot_cost in lots_costs:
-        if lot_cost.distribution == 'equal':
-            cost_price += lot_cost.amount_spent / products_in_lot_total_quantity
-        elif lot_cost.distribution == 'by_weight':
-            cost_price += lot_cost.amount_spent / product_in_lot_total_weight * product_in_lot.product.weight
-        elif lot_cost.distribution == 'by_price':
-            cost_price += lot_cost.amount_spent * product_in_lot.purchase_price / lot.get_total_lot_purchase_price()
-
-    product_in_lot_cost_price = product_in_lot.purchase_price + cost_price
-
-    return product_in_lot_cost_price
+from ..models import Lot, Warehouse, ProductInWarehouse, ProductInOrder
+from .jobs import get_or_submit_job
+from .lot import allocate_lot_costs
 
 
 def get_wholesale_price(product_in_lot=None, warehouse_id=None):
@@ -49,7 +30,7 @@ def lot_to_warehouse(request, warehouse_id=None, lot_id=None):
     })
 
 
-def get_product_for_transfer(products_in_lot, warehouse_id, lot_id):
+def get_product_for_transfer(products_in_lot, warehouse_id):
     products_for_transfer = [ ]
     for pil in products_in_lot:
         pft = {
@@ -58,7 +39,7 @@ def get_product_for_transfer(products_in_lot, warehouse_id, lot_id):
             'warehouse': warehouse_id,
             'description': pil.description,
             'price': pil.purchase_price,
-            'cost_price': product_cost_price(lot_id, pil.pk),
+            'cost_price': pil.cost_price,
             'quantity': pil.quantity,
             'total_weight': pil.get_total_weight,
         }
@@ -71,27 +52,18 @@ def lot_to_warehouse_detail(request, warehouse_id=None, lot_id=None):
     if lot.status != 'delivered':
         return redirect('warehouse:warehouse_list')
     warehouse = Warehouse.objects.get(pk=warehouse_id)
-    products_in_lot_pre_transfer = ProductInLot.objects.filter(lot=lot_id)
-    products_in_lot = get_product_for_transfer(products_in_lot_pre_transfer, warehouse_id, lot_id)
     if request.method == 'GET':
+        products_in_lot_pre_transfer = allocate_lot_costs(lot_id)
+        products_in_lot = get_product_for_transfer(products_in_lot_pre_transfer, warehouse_id)
         return render(request, 'warehouse/services/transfer_to_warehouse/to_warehouse_detail.html', {
             'lot': lot,
             'products_in_lot': products_in_lot,
             'warehouse': warehouse,
         })
     elif request.method == 'POST':
-        for pil in products_in_lot:
-            ProductInWarehouse.objects.create(
-                product=pil[ 'product' ],
-                warehouse=warehouse,
-                quantity=pil[ 'quantity' ],
-                cost_price=pil[ 'cost_price' ],
-                transaction='in',
-            )
-        add_costs_out_from_lot_if_not_exists(Lot.objects.get(pk=lot_id))
-        lot.status = 'delivered_to_warehouse'
-        lot.save()
-        return redirect('warehouse:warehouse_list')
+        # Приём большого лота проводится фоновым исполнителем, кладовщик следит за задачей
+        job = get_or_submit_job('receive_lot', lot_id=lot.pk, warehouse_id=warehouse.pk)
+        return redirect('warehouse:job_detail', job.pk)
 
 
 def warehouse_to_order(warehouse_id=None, order_id=None):
@@ -1,78 +1,189 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
 from django.dispatch import receiver
-from django.db.models import Q
 
-from .models import Order, ProductInWarehouse, Lot, Cost
+from .models import Order, ProductInOrder, ProductInWarehouse, Lot, LotCost, Cost, Product, Category
+from .services.stock import apply_stock_changes, stock_changes, refresh_last_movement
+from .services.fifo import sync_cost_layers, release_layers
+from .services.shipment import ship_order_lines
+from .services.cash import apply_cash_changes, cash_changes
+from .services import consumers
+from .services.outbox import publish
+from .services.reference import invalidate_reference, invalidate_products
+from .services.reservations import reserve_order_line, release_order_line, reservation_target, sync_order_reservations
+from .services.search import index_products, index_category, unindex_products
 from django.dispatch import Signal
 
 # Define the signal
 lot_costs_excluded = Signal(providing_args=['instance', 'excluded_lot_costs'])
 
 
+@receiver(pre_save, sender=Order)
+def remember_previous_order(sender, instance, **kwargs):
+    # Статус и склад до сохранения: отгрузка проводится и резерв меняется только при их смене
+    instance._previous_order = None
+    if instance.pk:
+        instance._previous_order = Order.objects.filter(pk=instance.pk).only('status', 'warehouse_id').first()
+
+
 @receiver(post_save, sender=Order)
 def create_cost_in_and_out_product_in_warehouse(sender, instance, created, **kwargs):
-    if instance.status == 'paid':
-        # Create an instance of Credit
-        name = f'Продажа {instance.pk}'
-        description = f'Продажа от {instance.date}'
-        amount = instance.get_total_order_retail_price()
-        consumer = instance.consumer
-        consumer.total_cost += amount
-        consumer.save()
-        Cost.objects.create(name=name, description=description, amount=amount, transaction='in')
-
-    if instance.status == 'shipped' and instance.warehouse:
-        # Create instances of ProductInWarehouse
-        for product_in_order in instance.productinorder_set.all():
-            ProductInWarehouse.objects.create(
-                product=product_in_order.product,
-                warehouse=instance.warehouse,
-                quantity=product_in_order.quantity,
-                transaction='out'
-            )
+    previous = getattr(instance, '_previous_order', None)
+    if instance.status == 'paid' and (previous is None or previous.status != 'paid'):
+        # Продажа проводится после коммита событием outbox; ключ по заказу — одна продажа на заказ
+        publish('order_sale', f'order_sale:{instance.pk}', order_id=instance.pk)
 
+    if instance.status == 'shipped' and (previous is None or previous.status != 'shipped'):
+        # Расход по всем строкам — одной транзакцией под блокировкой остатков. Остаётся синхронным:
+        # если товара не хватает, сохранение заказа должно откатиться с ошибкой
+        ship_order_lines(instance)
+
+
+@receiver(post_save, sender=Order)
+def sync_reservations_with_order(sender, instance, created, **kwargs):
+    # Регистрируется после проведения отгрузки: резерв возвращается, когда расход уже записан
+    previous = getattr(instance, '_previous_order', None)
+    if previous is not None and reservation_target(instance) != reservation_target(previous):
+        sync_order_reservations(instance)
+
+
+@receiver(post_save, sender=Order)
+def update_consumer_statistics(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_order', None)
+    if created or previous is not None:
+        consumers.order_saved(instance, previous)
 
-@receiver(post_save, sender=Lot)
-def create_cost_out_for_buy_lot(sender, instance, created, **kwargs):
-    if created and instance.status == 'paid':
-        # Проверяем, существует ли уже запись для данного лота
-        existing_cost_out = Cost.objects.filter(name=f'Оплата лота {instance.pk}').exists()
-
-        if not existing_cost_out:
-            # Создаем объект Cost только если его еще нет
-            name = f'Оплата лота {instance.pk}'
-            description = f'Оплата за товары лота #{instance.pk} от {instance.date}'
-            amount = instance.get_total_lot_purchase_price()
-            date = instance.date
-            Cost.objects.create(name=name, description=description, amount=amount, date=date, transaction='out')
-
-        lot_costs = instance.lotcost_set.all()
-
-        for lot_cost in lot_costs:
-            # Проверяем, существует ли уже запись для данного расхода на лот
-            existing_cost_out = Cost.objects.filter(name=f'Затраты {lot_cost.pk} на лот #{instance.pk}').exists()
-
-            if not existing_cost_out:
-                # Создаем объект Cost только если его еще нет
-                name = f'Затраты {lot_cost.pk} на лот #{instance.pk}'
-                description = f'Затраты #{lot_cost.pk} ({lot_cost.get_display_name()}) от {lot_cost.date} ' \
-                              f'на лот #{instance.pk} от {instance.date}'
-                amount = lot_cost.amount_spent
-                date = lot_cost.date
-                Cost.objects.create(name=name, description=description, amount=amount, date=date, transaction='out')
+
+@receiver(post_delete, sender=Order)
+def revert_consumer_statistics(sender, instance, **kwargs):
+    consumers.order_deleted(instance)
+
+
+@receiver(pre_save, sender=ProductInOrder)
+def remember_previous_line(sender, instance, **kwargs):
+    instance._previous_line = None
+    if instance.pk:
+        instance._previous_line = ProductInOrder.objects.filter(pk=instance.pk).select_related('product').first()
+
+
+@receiver(post_save, sender=ProductInOrder)
+def reserve_product_in_order(sender, instance, **kwargs):
+    reserve_order_line(instance)
+    consumers.line_saved(instance, getattr(instance, '_previous_line', None))
+
+
+@receiver(pre_delete, sender=ProductInOrder)
+def release_product_in_order(sender, instance, **kwargs):
+    # pre_delete: резерв и проводка продажи ещё на месте и при каскадном удалении заказа
+    release_order_line(instance)
+    consumers.line_deleted(instance)
 
 
 @receiver(post_save, sender=Lot)
-def check_lot_costs(sender, instance, created, **kwargs):
+def create_cost_out_for_buy_lot(sender, instance, created, **kwargs):
     if instance.status == 'paid':
-        # Get existing cost_out expenses related to the lot
-        existing_costs_out = Cost.objects.filter(Q(name__startswith=f'Затраты {instance.pk} на лот')
-                                               | Q(name__startswith=f'Оплата лота {instance.pk}'))
+        # Оплата лота и затраты на него проводятся событием outbox, повторное сохранение события не добавляет
+        publish('lot_paid', f'lot_paid:{instance.pk}', lot_id=instance.pk)
+
+
+@receiver(post_save, sender=LotCost)
+def create_cost_out_for_lot_cost(sender, instance, created, **kwargs):
+    # Затрата, добавленная к уже оплаченному лоту, проводится отдельно — оплата лота проводится один раз
+    if created and instance.lot.status != 'new':
+        publish('lot_cost', f'lot_cost:{instance.pk}', lot_id=instance.lot_id)
+
+
+@receiver(pre_save, sender=ProductInWarehouse)
+def remember_previous_movement(sender, instance, **kwargs):
+    # Запоминаем движение до изменения, чтобы отменить его вклад в остаток
+    instance._previous_movement = None
+    if instance.pk:
+        instance._previous_movement = ProductInWarehouse.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=ProductInWarehouse)
+def update_stock_balance(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_movement', None)
+    changes = [ ]
+    if previous is not None:
+        changes.extend(stock_changes([ previous ], sign=-1))
+    changes.extend(stock_changes([ instance ]))
+    apply_stock_changes(changes)
+    if previous is not None:
+        refresh_last_movement(previous.product_id, previous.warehouse_id)
+        refresh_last_movement(instance.product_id, instance.warehouse_id)
+    sync_cost_layers(instance, previous)
+
+
+@receiver(pre_delete, sender=ProductInWarehouse)
+def release_cost_layers(sender, instance, **kwargs):
+    # Списания удаляются каскадом вместе с расходом, поэтому слои возвращаем до удаления
+    if instance.transaction not in ProductInWarehouse.INCOMING_TRANSACTIONS:
+        release_layers(instance)
+
+
+@receiver(post_delete, sender=ProductInWarehouse)
+def revert_stock_balance(sender, instance, **kwargs):
+    # Строку остатка не создаём: при каскадном удалении продукта или склада её уже может не быть
+    apply_stock_changes(stock_changes([ instance ], sign=-1), create_missing=False)
+    refresh_last_movement(instance.product_id, instance.warehouse_id)
+
+
+@receiver(pre_save, sender=Cost)
+def remember_previous_cost(sender, instance, **kwargs):
+    instance._previous_cost = None
+    if instance.pk:
+        instance._previous_cost = Cost.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Cost)
+def update_daily_cash_balance(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_cost', None)
+    changes = [ ]
+    if previous is not None:
+        changes.extend(cash_changes([ previous ], sign=-1))
+    changes.extend(cash_changes([ instance ]))
+    apply_cash_changes(changes)
+
+
+@receiver(post_delete, sender=Cost)
+def revert_daily_cash_balance(sender, instance, **kwargs):
+    apply_cash_changes(cash_changes([ instance ], sign=-1))
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_price(sender, instance, **kwargs):
+    instance._previous_retail_price = None
+    if instance.pk:
+        instance._previous_retail_price = Product.objects.filter(pk=instance.pk) \
+            .values_list('retail_price', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def reprice_unpaid_orders(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_retail_price', None)
+    if previous is not None and previous != instance.retail_price:
+        consumers.price_changed(instance.pk, previous, instance.retail_price)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, created, **kwargs):
+    index_products([ instance.pk ])
+    invalidate_products(instance.pk, created=created)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    unindex_products([ instance.pk ])
+    invalidate_products(instance.pk)
+
 
-        existing_cost_out_names = [cost_out.name for cost_out in existing_costs_out]
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        index_category(instance.pk)
+    invalidate_reference('categories')
 
-        # Get lot costs that were not included in cost_out
-        excluded_lot_costs = instance.lotcost_set.exclude(name__in=existing_cost_out_names)
 
-        # Send signal indicating excluded lot costs
-        lot_costs_excluded.send(sender=Lot, instance=instance, excluded_lot_costs=excluded_lot_costs)
\ No newline at end of file
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, instance, **kwargs):
+    invalidate_reference('categories')
@@ -0,0 +1,85 @@
+from django.core.files.storage import default_storage
+from django.utils.timezone import now
+
+from .models import Lot, Warehouse, Order, Cost, Product
+from .services.consumers import sale_posted
+from .services.csv import product_rows, warehouse_rows, PRODUCT_SIGNATURE_ROWS
+from .services.imports import import_products, import_lot_lines
+from .services.jobs import job_handler
+from .services.lot import receive_lot
+from .services.outbox import outbox_handler
+from .signals import lot_costs_excluded
+from .utils import add_costs_out_from_lot_if_not_exists, unposted_lot_costs
+
+
+@job_handler('product_csv', 'Выгрузка справочника продуктов')
+def export_products(context):
+    # Заголовок, по строке на продукт и подписи
+    total = 1 + Product.objects.count() + len(PRODUCT_SIGNATURE_ROWS)
+    context.write_csv(f'Справочник продуктов от {now().strftime("%Y-%m-%d")}.csv', product_rows(), total=total)
+
+
+@job_handler('warehouse_csv', 'Выгрузка складов')
+def export_warehouses(context):
+    context.write_csv(f'Список складов от {now().strftime("%Y-%m-%d")}.csv', warehouse_rows())
+
+
+@job_handler('receive_lot', 'Приём лота на склад')
+def receive_lot_to_warehouse(context, lot_id, warehouse_id):
+    lot = Lot.objects.get(pk=lot_id)
+    warehouse = Warehouse.objects.get(pk=warehouse_id)
+    context.progress(0, 1, f'Лот {lot} принимается на склад {warehouse.name}')
+    receive_lot(lot_id, warehouse_id)
+    context.progress(1, 1)
+    return f'Лот {lot} принят на склад {warehouse.name}'
+
+
+def import_progress(context):
+    def progress(report):
+        context.progress(report.rows, message=report.summary())
+    return progress
+
+
+def finish_import(context, report):
+    # Ошибки по строкам выгружаются файлом результата задачи
+    if report.error_count:
+        context.write_csv(f'Ошибки импорта {context.job.pk}.csv', report.error_rows())
+    context.progress(report.rows, report.rows)
+    return report.summary()
+
+
+@job_handler('import_products', 'Импорт справочника продуктов')
+def import_products_from_file(context, path):
+    with default_storage.open(path, 'rb') as file:
+        report = import_products(file, progress=import_progress(context))
+    return finish_import(context, report)
+
+
+@job_handler('import_lot_lines', 'Импорт товаров в лот')
+def import_lot_lines_from_file(context, path, lot_id):
+    with default_storage.open(path, 'rb') as file:
+        report = import_lot_lines(file, lot_id, progress=import_progress(context))
+    if report.error_count:
+        return f'Лот не изменён. {finish_import(context, report)}'
+    return finish_import(context, report)
+
+
+@outbox_handler('order_sale')
+def post_order_sale(order_id):
+    # Продажа проводится один раз: повтор события находит её по order
+    order = Order.objects.get(pk=order_id)
+    if Cost.objects.filter(order=order).exists():
+        return
+    amount = order.get_total_order_retail_price()
+    sale_posted(order, amount)
+    Cost.objects.create(name=f'Продажа {order.pk}', description=f'Продажа от {order.date_created}', amount=amount,
+                        transaction='in', order=order)
+
+
+@outbox_handler('lot_paid')
+@outbox_handler('lot_cost')
+def post_lot_costs(lot_id):
+    # Оплата лота и затраты на него проводятся только если их ещё нет
+    lot = Lot.objects.get(pk=lot_id)
+    add_costs_out_from_lot_if_not_exists(lot)
+    lot_costs_excluded.send(sender=Lot, instance=lot, excluded_lot_costs=unposted_lot_costs([ lot ]))
@@ -0,0 +1,31 @@
+from django.db.models import Sum
+
+from ..models import Category, Product, Warehouse, ProductInWarehouse, StockBalance, Consumer
+from ..services.stock import signed_quantity_expression
+
+
+class WarehouseDataMixin:
+    """
+    Категория, продукт, склад и покупатель; приход на склад — через receive
+    """
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Категория', description='')
+        self.product = Product.objects.create(name='Продукт', category=self.category, weight=2, retail_price=10)
+        self.warehouse = Warehouse.objects.create(name='Склад', description='')
+        self.consumer = Consumer.objects.create(name='Покупатель', description='')
+
+    def receive(self, quantity, cost_price, product=None):
+        return ProductInWarehouse.objects.create(product=product or self.product, warehouse=self.warehouse,
+                                                 quantity=quantity, cost_price=cost_price, transaction='in')
+
+    def move_out(self, quantity, product=None):
+        return ProductInWarehouse.objects.create(product=product or self.product, warehouse=self.warehouse,
+                                                 quantity=quantity, transaction='out')
+
+    def balance(self, product=None):
+        return StockBalance.objects.get(product=product or self.product, warehouse=self.warehouse)
+
+    def ledger_quantity(self, product=None):
+        return ProductInWarehouse.objects.filter(product=product or self.product, warehouse=self.warehouse) \
+            .aggregate(total=Sum(signed_quantity_expression()))[ 'total' ] or 0
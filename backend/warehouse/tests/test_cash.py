@@ -0,0 +1,34 @@
+import datetime
+
+from django.test import TestCase
+
+from ..models import Cost, DailyCashBalance, CashBalanceNode
+from ..services.cash import CASH_TREE_DEPTH, get_period_totals, get_total_balance, rebuild_cash_balances
+
+
+class CashBalanceTests(TestCase):
+    def test_back_dated_cost_changes_only_its_day(self):
+        Cost.objects.create(name='Приход', amount=100, transaction='in', date_created=datetime.date(2026, 3, 1))
+        Cost.objects.create(name='Расход', amount=30, transaction='out', date_created=datetime.date(2026, 3, 5))
+        Cost.objects.create(name='Задним числом', amount=10, transaction='in', date_created=datetime.date(2026, 2, 1))
+        self.assertEqual(DailyCashBalance.objects.count(), 3)
+        self.assertEqual(get_period_totals(datetime.date(2026, 3, 1), datetime.date(2026, 3, 31)), (100, 30))
+        self.assertEqual(get_total_balance(), 80)
+        nodes = list(CashBalanceNode.objects.order_by('node').values_list('node', 'total_in', 'total_out'))
+        rebuild_cash_balances()
+        self.assertEqual(get_total_balance(), 80)
+        self.assertEqual(list(CashBalanceNode.objects.order_by('node').values_list('node', 'total_in', 'total_out')),
+                         nodes)
+
+    def test_back_dated_change_touches_logarithmic_number_of_nodes(self):
+        for day in range(1, 29):
+            Cost.objects.create(name='Приход', amount=day, transaction='in', date_created=datetime.date(2026, 2, day))
+        nodes = CashBalanceNode.objects.count()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_period_totals(datetime.date(2026, 2, 3), datetime.date(2026, 2, 10)), (52, 0))
+        cost = Cost.objects.create(name='Задним числом', amount=5, transaction='out',
+                                   date_created=datetime.date(2020, 1, 1))
+        self.assertLessEqual(CashBalanceNode.objects.count() - nodes, CASH_TREE_DEPTH + 1)
+        self.assertEqual(get_period_totals(datetime.date(2019, 1, 1), datetime.date(2026, 2, 2)), (3, 5))
+        cost.delete()
+        self.assertEqual(get_total_balance(), sum(range(1, 29)))
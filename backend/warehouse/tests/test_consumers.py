@@ -0,0 +1,69 @@
+import io
+
+from django.test import TestCase, override_settings
+
+from ..models import Consumer, Order, ProductInOrder
+from ..services.consumers import recompute_all
+from ..services.imports import import_products
+from .base import WarehouseDataMixin
+
+
+class ConsumerStatisticsTests(WarehouseDataMixin, TestCase):
+    def statistics(self):
+        consumer = Consumer.objects.get(pk=self.consumer.pk)
+        return consumer.total_cost, consumer.order_count, consumer.last_order_date, consumer.unpaid_amount
+
+    def assertRecomputeKeeps(self):
+        expected = self.statistics()
+        recompute_all()
+        self.assertEqual(self.statistics(), expected)
+
+    def test_incremental_statistics_match_recompute(self):
+        order = Order.objects.create(consumer=self.consumer)
+        order_date = Order.objects.get(pk=order.pk).date_created
+        line = ProductInOrder.objects.create(order=order, product=self.product, quantity=3)
+        self.assertEqual(self.statistics(), (0, 1, order_date, 30))
+        line.quantity = 5
+        line.save()
+        self.product.retail_price = 12
+        self.product.save()
+        self.assertEqual(self.statistics()[ 3 ], 60)
+        self.assertRecomputeKeeps()
+
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.statistics(), (0, 0, None, 0))
+        self.assertRecomputeKeeps()
+        order.status = 'new'
+        order.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'paid'
+            order.save()
+        self.assertEqual(self.statistics(), (60, 1, order_date, 0))
+        self.assertRecomputeKeeps()
+
+        other = Order.objects.create(consumer=self.consumer)
+        ProductInOrder.objects.create(order=other, product=self.product, quantity=1)
+        other.delete()
+        self.assertEqual(self.statistics(), (60, 1, order_date, 0))
+        self.assertRecomputeKeeps()
+
+    def test_imported_price_change_reprices_unpaid_orders(self):
+        order = Order.objects.create(consumer=self.consumer)
+        ProductInOrder.objects.create(order=order, product=self.product, quantity=3)
+        self.assertEqual(self.statistics()[ 3 ], 30)
+        csv_file = io.BytesIO('Наименование,Категория,Розничная цена,Вес\nПродукт,Категория,15,2\n'.encode())
+        report = import_products(csv_file)
+        self.assertEqual(report.updated, 1)
+        self.assertEqual(self.statistics()[ 3 ], 45)
+        self.assertRecomputeKeeps()
+
+    @override_settings(CONSUMER_TIER_RULES=[ { 'level': 5, 'min_revenue': 50, 'min_orders': 1, 'max_unpaid': 5 } ])
+    def test_level_follows_tier_rules(self):
+        order = Order.objects.create(consumer=self.consumer)
+        ProductInOrder.objects.create(order=order, product=self.product, quantity=6)
+        self.assertEqual(Consumer.objects.get(pk=self.consumer.pk).level, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'paid'
+            order.save()
+        self.assertEqual(Consumer.objects.get(pk=self.consumer.pk).level, 5)
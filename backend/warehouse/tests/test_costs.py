@@ -0,0 +1,41 @@
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from ..models import Lot, LotCost, ProductInLot, Cost
+from ..utils import add_costs_out_from_lot_if_not_exists, unposted_lot_costs
+from .base import WarehouseDataMixin
+
+
+class CostSourceTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.lot = Lot.objects.create(description='Закупка')
+        ProductInLot.objects.create(lot=self.lot, product=self.product, quantity=10, purchase_price=5)
+        self.lot_cost = LotCost.objects.create(lot=self.lot, name='customs', distribution='equal', amount_spent=20)
+
+    def pay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lot.status = 'paid'
+            self.lot.save()
+
+    def test_lot_payment_and_costs_are_posted_once(self):
+        self.pay()
+        self.pay()
+        payment = Cost.objects.get(lot_payment=self.lot)
+        self.assertEqual((payment.amount, payment.transaction, payment.lot_id), (50, 'out', self.lot.pk))
+        self.assertEqual(Cost.objects.get(lot_cost=self.lot_cost).amount, 20)
+        self.assertEqual(Cost.objects.filter(lot=self.lot).count(), 2)
+        self.assertEqual(add_costs_out_from_lot_if_not_exists(self.lot), [ ])
+        self.assertFalse(unposted_lot_costs([ self.lot ]).exists())
+
+    def test_cost_added_to_paid_lot_is_posted_separately(self):
+        self.pay()
+        with self.captureOnCommitCallbacks(execute=True):
+            lot_cost = LotCost.objects.create(lot=self.lot, name='other', distribution='by_weight', amount_spent=7)
+        self.assertEqual(Cost.objects.get(lot_cost=lot_cost).lot_id, self.lot.pk)
+        self.assertEqual(Cost.objects.filter(lot_payment=self.lot).count(), 1)
+
+    def test_source_can_be_linked_to_one_cost_only(self):
+        self.pay()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cost.objects.create(name='Повтор оплаты', amount=50, transaction='out', lot=self.lot, lot_payment=self.lot)
@@ -0,0 +1,67 @@
+import csv
+import io
+
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Product, Warehouse, ProductInWarehouse
+from ..services.csv import (
+    SIGNATURE_ROWS,
+    PRODUCT_SIGNATURE_ROWS,
+    PRODUCT_CSV_COLUMNS,
+    queryset_rows,
+    product_rows,
+    warehouse_rows,
+)
+from .base import WarehouseDataMixin
+
+
+def read_csv(response):
+    return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+
+def signature_values(rows):
+    return [ [ str(value) for value in row ] for row in rows ]
+
+
+class CsvExportTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            Product.objects.create(name=f'Продукт {i}', category=self.category, weight=1, retail_price=i + 1)
+
+    def test_category_list_streams_products_with_blank_signatures(self):
+        response = self.client.get(reverse('warehouse:category_list'), { 'format': 'csv' })
+        self.assertTrue(response.streaming)
+        self.assertIn("filename*=UTF-8''", response[ 'Content-Disposition' ])
+        rows = read_csv(response)
+        self.assertEqual(rows[ 0 ], PRODUCT_CSV_COLUMNS)
+        names = list(Product.objects.order_by('pk').values_list('name', flat=True))
+        self.assertEqual([ row[ 1 ] for row in rows[ 1:len(names) + 1 ] ], names)
+        self.assertEqual(rows[ -len(SIGNATURE_ROWS): ], signature_values(SIGNATURE_ROWS))
+
+    def test_product_directory_is_signed_by_name(self):
+        rows = list(product_rows())
+        self.assertEqual(rows[ -len(PRODUCT_SIGNATURE_ROWS): ], PRODUCT_SIGNATURE_ROWS)
+        self.assertIn('Иванов А.Н', rows[ -2 ])
+
+    def test_rows_are_read_lazily_in_chunks(self):
+        with self.assertNumQueries(0):
+            rows = queryset_rows(Product.objects.all(), [ '#' ], [ 'pk' ], chunk_size=2)
+            next(rows)
+        # 5 продуктов порциями по 2: три запроса по ключу, без OFFSET
+        with self.assertNumQueries(3):
+            rows = list(rows)
+        self.assertEqual(len(rows), Product.objects.count())
+
+    def test_warehouse_rows_group_movements_by_warehouse(self):
+        other = Warehouse.objects.create(name='Второй склад', description='')
+        self.receive(3, 1)
+        ProductInWarehouse.objects.create(product=self.product, warehouse=other, quantity=7, cost_price=1,
+                                          transaction='in')
+        self.receive(5, 1)
+        rows = list(warehouse_rows())
+        first = rows.index([ self.warehouse.pk, self.warehouse.name, '' ])
+        second = rows.index([ other.pk, other.name, '' ])
+        self.assertEqual([ row[ 2 ] for row in rows[ first + 2:second ] ], [ 3, 5 ])
+        self.assertEqual([ row[ 2 ] for row in rows[ second + 2:-len(SIGNATURE_ROWS) ] ], [ 7 ])
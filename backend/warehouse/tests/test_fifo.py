@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..models import CostLayer, CostLayerConsumption
+from ..services.fifo import rebuild_cost_layers
+from .base import WarehouseDataMixin
+
+
+class CostLayerTests(WarehouseDataMixin, TestCase):
+    def test_shipment_consumes_oldest_layers_first(self):
+        self.receive(5, 10)
+        self.receive(5, 20)
+        movement = self.move_out(7)
+        consumptions = CostLayerConsumption.objects.filter(movement=movement).order_by('pk')
+        self.assertEqual([ (c.quantity, c.cost_price) for c in consumptions ], [ (5, 10), (2, 20) ])
+        movement.refresh_from_db()
+        self.assertEqual(movement.cost_price, Decimal('12.86'))
+        self.assertEqual(list(CostLayer.objects.order_by('pk').values_list('remaining_quantity', 'is_open')),
+                         [ (0, False), (3, True) ])
+
+    def test_deleting_shipment_returns_quantity_to_layers(self):
+        self.receive(5, 10)
+        movement = self.move_out(4)
+        movement.delete()
+        layer = CostLayer.objects.get()
+        self.assertEqual((layer.remaining_quantity, layer.is_open), (5, True))
+        self.assertFalse(CostLayerConsumption.objects.exists())
+
+    def test_rebuild_matches_incremental(self):
+        self.receive(5, 10)
+        self.move_out(3)
+        self.receive(5, 20)
+        self.move_out(4)
+        snapshot = lambda: (
+            list(CostLayer.objects.order_by('movement_id').values_list('movement_id', 'remaining_quantity')),
+            list(CostLayerConsumption.objects.order_by('movement_id', 'layer__movement_id')
+                 .values_list('movement_id', 'quantity', 'cost_price')),
+        )
+        expected = snapshot()
+        rebuild_cost_layers()
+        self.assertEqual(snapshot(), expected)
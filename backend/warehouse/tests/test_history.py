@@ -0,0 +1,103 @@
+import gzip
+import io
+import json
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from ..models import Lot, HistoryCompaction
+from ..services.history import compact_history, compaction_victims, get_archive_dir, get_cutoff
+
+
+class CompactionVictimsTests(TestCase):
+    def test_last_edit_of_each_run_and_status_changes_are_kept(self):
+        records = [
+            { 'history_id': 1, 'history_type': '+', 'status': 'new' },
+            { 'history_id': 2, 'history_type': '~', 'status': 'new' },
+            { 'history_id': 3, 'history_type': '~', 'status': 'new' },
+            { 'history_id': 4, 'history_type': '~', 'status': 'paid' },
+            { 'history_id': 5, 'history_type': '~', 'status': 'paid' },
+            { 'history_id': 6, 'history_type': '~', 'status': 'paid' },
+            { 'history_id': 7, 'history_type': '-', 'status': 'paid' },
+        ]
+        self.assertEqual([ record[ 'history_id' ] for record in compaction_victims(records, 'status') ], [ 2, 5 ])
+        self.assertEqual([ record[ 'history_id' ] for record in compaction_victims(records) ], [ 2, 3, 4, 5 ])
+
+
+class CompactHistoryTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings = override_settings(HISTORY_ARCHIVE_DIR=archive_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.lots = [ self.create_lot(f'Закупка {i}') for i in range(3) ]
+        Lot.history.update(history_date=now() - timedelta(days=200))
+        self.recent_lot = self.create_lot('Свежая закупка')
+
+    def create_lot(self, description):
+        # Создание, две правки, оплата и ещё две правки: после сжатия остаётся 4 записи из 6
+        lot = Lot.objects.create(description=description)
+        for change in ('правка 1', 'правка 2', 'paid', 'правка 3', 'правка 4'):
+            if change == 'paid':
+                lot.status = 'paid'
+            else:
+                lot.description = f'{description}, {change}'
+            lot.save()
+        return lot
+
+    def history_types(self, lot):
+        return list(lot.history.order_by('history_date', 'history_id').values_list('history_type', 'status'))
+
+    def archived_records(self):
+        records = [ ]
+        for path in sorted(get_archive_dir().rglob('*.jsonl.gz')):
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                records += [ json.loads(line) for line in archive ]
+        return records
+
+    def test_old_history_is_compacted_and_archived(self):
+        self.assertEqual(compact_history(Lot, get_cutoff(), chunk_size=2), 6)
+        for lot in self.lots:
+            self.assertEqual(self.history_types(lot), [ ('+', 'new'), ('~', 'new'), ('~', 'paid'), ('~', 'paid') ])
+            self.assertEqual(lot.history.first().description, lot.description)
+        self.assertEqual(self.recent_lot.history.count(), 6)
+        archived = self.archived_records()
+        self.assertEqual(len(archived), 6)
+        self.assertEqual({ record[ 'id' ] for record in archived }, { lot.pk for lot in self.lots })
+        checkpoint = HistoryCompaction.objects.get(model_label='warehouse.lot')
+        self.assertEqual((checkpoint.finished, checkpoint.rows_archived), (True, 6))
+
+    def test_dry_run_changes_nothing(self):
+        self.assertEqual(compact_history(Lot, get_cutoff(), dry_run=True), 6)
+        self.assertEqual(Lot.history.count(), 24)
+        self.assertEqual(self.archived_records(), [ ])
+        self.assertFalse(HistoryCompaction.objects.exists())
+
+    def test_interrupted_run_continues_from_checkpoint(self):
+        def interrupt(model, last_object_id, removed):
+            raise KeyboardInterrupt
+
+        cutoff = get_cutoff()
+        with self.assertRaises(KeyboardInterrupt):
+            compact_history(Lot, cutoff, chunk_size=1, progress=interrupt)
+        self.assertEqual(HistoryCompaction.objects.get().last_object_id, self.lots[ 0 ].pk)
+        self.assertEqual(compact_history(Lot, get_cutoff(days=0), chunk_size=1), 4)
+        # Продолжение идёт со старой границей: свежая закупка не тронута
+        self.assertEqual(self.recent_lot.history.count(), 6)
+        self.assertEqual(compact_history(Lot, cutoff), 0)
+        self.assertEqual(len(self.archived_records()), 6)
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command('compact_history', '--models', 'lot', '--dry-run', stdout=stdout)
+        self.assertIn('Можно убрать: 6', stdout.getvalue())
+        call_command('compact_history', '--models', 'lot', stdout=stdout)
+        self.assertIn('Убрано в архив: 6', stdout.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('compact_history', '--models', 'category', stdout=stdout)
@@ -0,0 +1,119 @@
+import io
+import tempfile
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Category, Product, Lot, ProductInLot, Job
+from ..services.imports import import_products, import_lot_lines
+from ..services.jobs import claim_job, execute_job
+from ..services.search import search_product_ids
+from .base import WarehouseDataMixin
+
+
+def csv_file(text):
+    return io.BytesIO(text.encode('utf-8-sig'))
+
+
+PRODUCTS_CSV = (
+    'Наименование;Категория;Розничная цена;Вес кг.\n'
+    'Гайка;Крепёж;1 250,50;0,1\n'
+    'Шайба;Крепёж;3;0\n'
+    'Отвёртка;Инструмент;300;0,2\n'
+)
+
+
+class ProductImportTests(WarehouseDataMixin, TestCase):
+    def products(self):
+        return { name: (category, price) for name, category, price
+                 in Product.objects.values_list('name', 'category__name', 'retail_price') }
+
+    def test_products_and_categories_are_created(self):
+        report = import_products(csv_file(PRODUCTS_CSV), chunk_size=2)
+        self.assertEqual((report.rows, report.created, report.updated, report.error_count), (3, 3, 0, 0))
+        self.assertEqual(self.products()[ 'Гайка' ], ('Крепёж', Decimal('1250.5')))
+        self.assertEqual(Category.objects.filter(name__in=[ 'Крепёж', 'Инструмент' ]).count(), 2)
+        self.assertEqual(Product.history.filter(name='Шайба', history_type='+').count(), 1)
+        self.assertEqual(len(search_product_ids('гайка')), 1)
+
+    def test_reimport_is_idempotent(self):
+        import_products(csv_file(PRODUCTS_CSV))
+        history = Product.history.count()
+        report = import_products(csv_file(PRODUCTS_CSV))
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 0, 3))
+        self.assertEqual(Product.history.count(), history)
+
+    def test_changed_rows_are_updated_and_missing_columns_kept(self):
+        import_products(csv_file(PRODUCTS_CSV))
+        report = import_products(csv_file(
+            'name,category,retail_price\n'
+            'Гайка,Крепёж,2\n'
+            'Шайба,Инструмент,3\n'
+            'Отвёртка,Инструмент,300\n'
+        ))
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 2, 1))
+        self.assertEqual(self.products()[ 'Гайка' ], ('Крепёж', 2))
+        self.assertEqual(self.products()[ 'Шайба' ], ('Инструмент', 3))
+        self.assertEqual(Product.objects.get(name='Гайка').weight, Decimal('0.1'))
+        self.assertEqual(Product.history.filter(name='Гайка', history_type='~').count(), 1)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        report = import_products(csv_file(
+            'Наименование;Категория;Розничная цена\n'
+            'Гайка;Крепёж;-1\n'
+            'Шайба;;3\n'
+            'Болт;Крепёж;5\n'
+        ))
+        self.assertEqual((report.created, report.error_count), (1, 2))
+        self.assertEqual([ (error.line, error.name) for error in report.errors ], [ (2, 'Гайка'), (3, 'Шайба') ])
+        self.assertIn('Болт', self.products())
+        self.assertNotIn('Гайка', self.products())
+
+    def test_file_without_name_column_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            import_products(csv_file('Категория;Цена\nКрепёж;1\n'))
+
+
+class LotLineImportTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.lot = Lot.objects.create(description='Закупка')
+
+    def test_lines_are_added_by_product_name(self):
+        report = import_lot_lines(csv_file(
+            'Товар;Количество;Закупочная цена\n'
+            'Продукт;10;2,5\n'
+            'Продукт;1;3\n'
+        ), self.lot.pk, chunk_size=1)
+        self.assertEqual((report.rows, report.created, report.error_count), (2, 2, 0))
+        self.assertEqual(list(ProductInLot.objects.filter(lot=self.lot).values_list('quantity', 'purchase_price')),
+                         [ (10, Decimal('2.5')), (1, 3) ])
+
+    def test_any_error_leaves_lot_unchanged(self):
+        report = import_lot_lines(csv_file(
+            'Товар;Количество;Закупочная цена\n'
+            'Продукт;10;2\n'
+            'Нет такого;1;1\n'
+            'Продукт;0;1\n'
+        ), self.lot.pk, chunk_size=1)
+        self.assertEqual((report.created, report.error_count), (0, 2))
+        self.assertEqual([ error.line for error in report.errors ], [ 3, 4 ])
+        self.assertFalse(ProductInLot.objects.filter(lot=self.lot).exists())
+
+
+class ImportViewTests(WarehouseDataMixin, TestCase):
+    def test_uploaded_file_is_imported_by_job(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            upload = SimpleUploadedFile('products.csv', PRODUCTS_CSV.encode('utf-8-sig'))
+            response = self.client.post(reverse('warehouse:product_import'), { 'file': upload })
+            job = Job.objects.get(kind='import_products')
+            self.assertRedirects(response, reverse('warehouse:job_detail', args=[ job.pk ]),
+                                 fetch_redirect_response=False)
+            execute_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertTrue(job.message.startswith('Строк: 3, добавлено: 3'))
+        self.assertTrue(Product.objects.filter(name='Отвёртка').exists())
@@ -0,0 +1,132 @@
+import io
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+
+from ..models import Job
+from ..services.jobs import (
+    JOB_HANDLERS,
+    JobHandler,
+    submit_job,
+    get_or_submit_job,
+    claim,
+    claim_job,
+    execute_job,
+    requeue_stale_jobs,
+)
+
+
+def succeed(context, value):
+    context.progress(1, 1)
+    return f'Готово: {value}'
+
+
+def reject(context):
+    raise ValidationError('Неверные данные')
+
+
+def crash(context):
+    raise RuntimeError('Сбой')
+
+
+TEST_HANDLERS = {
+    'test_succeed': JobHandler('test_succeed', 'Успешная задача', succeed),
+    'test_reject': JobHandler('test_reject', 'Неверные данные', reject),
+    'test_crash': JobHandler('test_crash', 'Сбой', crash),
+}
+
+
+@mock.patch.dict(JOB_HANDLERS, TEST_HANDLERS)
+class JobQueueTests(TestCase):
+    def test_unknown_kind_is_not_submitted(self):
+        with self.assertRaises(ValueError):
+            submit_job('unknown')
+        self.assertFalse(Job.objects.exists())
+
+    def test_repeated_submit_returns_unfinished_job(self):
+        job = get_or_submit_job('test_succeed', value=1)
+        self.assertEqual(get_or_submit_job('test_succeed', value=1), job)
+        self.assertNotEqual(get_or_submit_job('test_succeed', value=2), job)
+        Job.objects.filter(pk=job.pk).update(status='done')
+        self.assertNotEqual(get_or_submit_job('test_succeed', value=1), job)
+
+    def test_job_is_claimed_by_one_worker(self):
+        first = submit_job('test_succeed', value=1)
+        second = submit_job('test_succeed', value=2)
+        self.assertEqual(claim_job('worker-1'), first.pk)
+        self.assertEqual(claim(first.pk, 'worker-2'), 0)
+        self.assertEqual(claim_job('worker-2'), second.pk)
+        self.assertIsNone(claim_job('worker-3'))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.worker, first.attempts), ('running', 'worker-1', 1))
+
+    def test_execute_records_result(self):
+        job = submit_job('test_succeed', value=7)
+        execute_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message, job.progress_done), ('done', 'Готово: 7', 1))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_validation_error_fails_with_its_message(self):
+        job = submit_job('test_reject')
+        execute_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message), ('failed', 'Неверные данные'))
+
+    def test_unexpected_error_fails_with_traceback(self):
+        job = submit_job('test_crash')
+        with self.assertLogs('warehouse.jobs', level='ERROR'):
+            execute_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.message.startswith('Сбой'))
+        self.assertIn('Traceback', job.message)
+
+    def test_stale_running_job_is_requeued(self):
+        stale = submit_job('test_succeed', value=1)
+        alive = submit_job('test_succeed', value=2)
+        claim(stale.pk, 'dead')
+        claim(alive.pk, 'alive')
+        Job.objects.filter(pk=stale.pk).update(heartbeat=now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_job('worker'), stale.pk)
+        self.assertEqual(Job.objects.get(pk=alive.pk).worker, 'alive')
+
+    def test_job_waits_for_worker_by_default(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = submit_job('test_succeed', value=1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'queued')
+
+    @override_settings(JOBS_RUN_ON_COMMIT=True)
+    def test_job_runs_on_commit_when_enabled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = submit_job('test_succeed', value=1)
+            self.assertEqual(Job.objects.get(pk=job.pk).status, 'queued')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+
+    def test_csv_export_saves_result_file(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            job = submit_job('product_csv')
+            execute_job(claim_job())
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'done')
+            with job.result_file.open('rb') as result:
+                self.assertIn('Наименование'.encode(), result.read())
+
+
+@mock.patch.dict(JOB_HANDLERS, TEST_HANDLERS)
+class RunWorkerTests(TransactionTestCase):
+    def test_once_runs_queued_jobs_and_stops(self):
+        jobs = [ submit_job('test_succeed', value=i) for i in range(3) ] + [ submit_job('test_reject') ]
+        stdout = io.StringIO()
+        call_command('run_worker', '--once', '--workers', '2', stdout=stdout)
+        self.assertEqual(
+            [ Job.objects.get(pk=job.pk).status for job in jobs ],
+            [ 'done', 'done', 'done', 'failed' ],
+        )
+        self.assertIn('Исполнитель остановлен', stdout.getvalue())
@@ -0,0 +1,46 @@
+import datetime
+import html
+import re
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Job
+from ..services.keyset import paginate_keyset, encode_cursor, decode_cursor
+
+
+class KeysetPaginationTests(TestCase):
+    def test_cursor_keeps_microseconds(self):
+        value = datetime.datetime(2026, 1, 1, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor([ value, Decimal('1.2345'), 7 ])), [ value, Decimal('1.2345'), 7 ])
+        self.assertIsNone(decode_cursor('подделка'))
+
+    def test_pages_cover_rows_once_in_both_directions(self):
+        Job.objects.bulk_create([ Job(kind='product_csv') for _ in range(30) ])
+        start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        # Все строки в одной миллисекунде: порядок задают только микросекунды
+        for i, pk in enumerate(Job.objects.order_by('pk').values_list('pk', flat=True)):
+            Job.objects.filter(pk=pk).update(date_created=start + datetime.timedelta(microseconds=(i * 7) % 30))
+        for ordering in [ ('-date_created', '-pk'), ('date_created', 'pk') ]:
+            seen, after = [ ], None
+            while True:
+                page = paginate_keyset(Job.objects.all(), ordering, after=after, page_size=4)
+                seen += [ job.pk for job in page ]
+                if not page.has_next():
+                    break
+                after = page.next_cursor
+            self.assertCountEqual(seen, Job.objects.values_list('pk', flat=True))
+            previous = paginate_keyset(Job.objects.all(), ordering, before=after, page_size=4)
+            self.assertEqual(len(previous), 4)
+
+    def test_page_links_keep_query_parameters(self):
+        Job.objects.bulk_create([ Job(kind='product_csv') for _ in range(60) ])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('warehouse:job_list'), { 'total': '1', 'status': 'done' })
+        query = html.unescape(re.findall(r'href="\?([^"]+)"', response.content.decode())[ -1 ])
+        self.assertIn('status=done', query)
+        self.assertIn('after=', query)
+        response = self.client.get(f'{reverse("warehouse:job_list")}?{query}')
+        self.assertEqual(len(response.context[ 'page_obj' ]), 10)
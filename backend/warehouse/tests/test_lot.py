@@ -0,0 +1,194 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Product, Lot, LotCost, ProductInLot, ProductInWarehouse, CostLayer, Cost
+from ..services.lot import LotLineInput, allocate_lot_costs, add_lot_lines, receive_lot
+from .base import WarehouseDataMixin
+
+
+class LotDataMixin(WarehouseDataMixin):
+    """
+    Лот с двумя строками: 10 шт. продукта весом 2 кг по 5 и 30 шт. продукта весом 1 кг по 10
+    """
+    def setUp(self):
+        super().setUp()
+        self.light_product = Product.objects.create(name='Лёгкий продукт', category=self.category, weight=1,
+                                                    retail_price=20)
+        self.lot = Lot.objects.create(description='Закупка')
+        ProductInLot.objects.create(lot=self.lot, product=self.product, quantity=10, purchase_price=5)
+        ProductInLot.objects.create(lot=self.lot, product=self.light_product, quantity=30, purchase_price=10)
+
+    def add_cost(self, distribution, amount):
+        return LotCost.objects.create(lot=self.lot, name='transportation', distribution=distribution,
+                                      amount_spent=amount)
+
+
+class LotCostAllocationTests(LotDataMixin, TestCase):
+    def test_costs_are_allocated_by_each_rule(self):
+        self.add_cost('equal', 40)
+        self.add_cost('by_weight', 60)
+        self.add_cost('by_weight', 40)
+        self.add_cost('by_price', 35)
+        # Строки с продуктами и суммы расходов по способам распределения — два запроса на весь лот
+        with self.assertNumQueries(2):
+            lines = allocate_lot_costs(self.lot.pk)
+        # На штуку 40 / 40 = 1, на кг 100 / 50 = 2, на единицу закупочной стоимости 35 / 350 = 0.1
+        self.assertEqual([ line.cost_price for line in lines ], [ Decimal('10.5'), Decimal('14') ])
+        allocated = sum(line.quantity * (line.cost_price - line.purchase_price) for line in lines)
+        self.assertEqual(allocated, 175)
+
+    def test_lot_without_costs_keeps_purchase_price(self):
+        lines = allocate_lot_costs(self.lot.pk)
+        self.assertEqual([ line.cost_price for line in lines ], [ 5, 10 ])
+        self.assertEqual(allocate_lot_costs(Lot.objects.create(description='Пустой').pk), [ ])
+
+
+class LotTotalsTests(LotDataMixin, TestCase):
+    def test_totals_are_annotated_in_sql(self):
+        self.add_cost('equal', 40)
+        self.add_cost('by_price', 35)
+        empty = Lot.objects.create(description='Пустая закупка')
+        lots = { lot.pk: lot for lot in Lot.objects.with_totals() }
+        lot = lots[ self.lot.pk ]
+        self.assertEqual(
+            (lot.total_lot_purchase_price, lot.products_quantity, lot.products_weight, lot.total_lot_amount_spent,
+             lot.total),
+            (350, 40, 50, 75, 425),
+        )
+        self.assertEqual((lots[ empty.pk ].products_quantity, lots[ empty.pk ].total), (0, 0))
+        # Лот без аннотации досчитывает все итоги одним запросом
+        lot = Lot.objects.get(pk=self.lot.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual((lot.get_total(), lot.get_products_weight()), (425, 50))
+
+    def test_lot_list_queries_do_not_grow_with_lots(self):
+        self.client.get(reverse('warehouse:lot_list'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('warehouse:lot_list'))
+        for i in range(5):
+            lot = Lot.objects.create(description=f'Закупка {i}')
+            ProductInLot.objects.create(lot=lot, product=self.product, quantity=i + 1, purchase_price=1)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('warehouse:lot_list'))
+        self.assertEqual(len(response.context[ 'object_list' ]), 6)
+        self.assertEqual(len(many), len(few))
+
+
+class LotReceiptTests(LotDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Lot.objects.filter(pk=self.lot.pk).update(status='delivered')
+        self.add_cost('equal', 40)
+
+    def test_lot_is_received_once(self):
+        movements = receive_lot(self.lot.pk, self.warehouse.pk)
+        self.assertEqual([ (movement.quantity, movement.cost_price) for movement in movements ], [ (10, 6), (30, 11) ])
+        self.assertEqual(self.balance().quantity, 10)
+        self.assertEqual(self.balance(self.light_product).quantity, 30)
+        self.assertEqual(CostLayer.objects.count(), 2)
+        self.assertEqual(sorted(Cost.objects.filter(lot=self.lot).values_list('amount', flat=True)), [ 40, 350 ])
+        self.lot.refresh_from_db()
+        self.assertEqual(self.lot.status, 'delivered_to_warehouse')
+        self.assertEqual(self.lot.history.first().status, 'delivered_to_warehouse')
+
+        with self.assertRaises(ValidationError):
+            receive_lot(self.lot.pk, self.warehouse.pk)
+        self.assertEqual(ProductInWarehouse.objects.filter(lot=self.lot).count(), 2)
+
+    def test_invalid_lot_changes_nothing(self):
+        ProductInLot.objects.create(lot=self.lot, product=self.product, quantity=0, purchase_price=5)
+        with self.assertRaises(ValidationError):
+            receive_lot(self.lot.pk, self.warehouse.pk)
+        self.assertEqual(Lot.objects.get(pk=self.lot.pk).status, 'delivered')
+        self.assertFalse(ProductInWarehouse.objects.exists())
+        self.assertFalse(Cost.objects.exists())
+
+    def test_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as small:
+            receive_lot(self.lot.pk, self.warehouse.pk)
+        lot = Lot.objects.create(description='Большая закупка', status='delivered')
+        products = [
+            Product.objects.create(name=f'Продукт {i}', category=self.category, weight=1, retail_price=1)
+            for i in range(12)
+        ]
+        ProductInLot.objects.bulk_create([
+            ProductInLot(lot=lot, product=product, quantity=i + 1, purchase_price=2) for i, product in enumerate(products)
+        ])
+        LotCost.objects.create(lot=lot, name='customs', distribution='by_price', amount_spent=100)
+        with CaptureQueriesContext(connection) as large:
+            receive_lot(lot.pk, self.warehouse.pk)
+        self.assertEqual(len(large), len(small))
+
+
+class LotLinesTests(LotDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.new_lot = Lot.objects.create(description='Новая закупка')
+
+    def line(self, number, product, quantity='1', purchase_price='1', description=''):
+        return LotLineInput(number, str(getattr(product, 'pk', product)), quantity, purchase_price, description)
+
+    def test_lines_are_added_with_history(self):
+        lines, errors = add_lot_lines(self.new_lot.pk, [
+            self.line(1, self.product, '3', '4.5', 'Первая'),
+            self.line(2, self.light_product, '2', '7'),
+        ])
+        self.assertEqual(errors, [ ])
+        self.assertEqual([ (line.product, line.quantity, line.purchase_price) for line in lines ],
+                         [ (self.product, 3, Decimal('4.5')), (self.light_product, 2, 7) ])
+        self.assertEqual(ProductInLot.objects.filter(lot=self.new_lot).count(), 2)
+        self.assertEqual(ProductInLot.history.filter(lot=self.new_lot, history_type='+').count(), 2)
+
+    def test_any_error_rejects_all_lines(self):
+        lines, errors = add_lot_lines(self.new_lot.pk, [
+            self.line(1, self.product),
+            self.line(2, self.light_product, quantity='-1'),
+            self.line(3, 999999),
+        ])
+        self.assertEqual(lines, [ ])
+        self.assertEqual([ (error.number, error.product) for error in errors ],
+                         [ (2, 'Лёгкий продукт'), (3, '999999') ])
+        self.assertFalse(ProductInLot.objects.filter(lot=self.new_lot).exists())
+        self.assertEqual(add_lot_lines(self.new_lot.pk, [ ])[ 1 ][ 0 ].message, 'Не заполнено ни одной строки')
+
+    def test_insert_queries_do_not_grow_with_lines(self):
+        products = [ Product.objects.create(name=f'Продукт {i}', category=self.category, retail_price=1)
+                     for i in range(20) ]
+        with CaptureQueriesContext(connection) as few:
+            add_lot_lines(self.new_lot.pk, [ self.line(i, product) for i, product in enumerate(products[ :2 ]) ])
+        with CaptureQueriesContext(connection) as many:
+            add_lot_lines(self.new_lot.pk, [ self.line(i, product) for i, product in enumerate(products[ 2: ]) ])
+        self.assertEqual(len(many), len(few))
+
+    def post_lines(self, rows):
+        return self.client.post(reverse('warehouse:productinlot_create', kwargs={ 'lot_id': self.new_lot.pk }), {
+            'selected_objects': [ row[ 0 ] for row in rows ],
+            'quantities': [ row[ 1 ] for row in rows ],
+            'purchase_prices': [ row[ 2 ] for row in rows ],
+            'descriptions': [ '' for _ in rows ],
+        })
+
+    def test_view_adds_filled_rows_only(self):
+        response = self.post_lines([
+            (self.product.pk, '2', '3'),
+            (self.light_product.pk, '', ''),
+        ])
+        self.assertRedirects(response, reverse('warehouse:lot_detail', kwargs={ 'pk': self.new_lot.pk }),
+                             fetch_redirect_response=False)
+        self.assertEqual(list(ProductInLot.objects.filter(lot=self.new_lot).values_list('product', 'quantity')),
+                         [ (self.product.pk, 2) ])
+
+    def test_view_shows_row_errors_and_keeps_input(self):
+        response = self.post_lines([
+            (self.product.pk, '2', '3'),
+            (self.light_product.pk, '2', 'abc'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context[ 'line_error_numbers' ], { 2 })
+        self.assertEqual([ line.purchase_price for line in response.context[ 'product_list' ] ], [ '3', 'abc' ])
+        self.assertFalse(ProductInLot.objects.filter(lot=self.new_lot).exists())
@@ -0,0 +1,53 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ..models import Order, ProductInOrder, Cost, OutboxEvent
+from ..services import outbox
+from ..services.outbox import process_outbox
+from .base import WarehouseDataMixin
+
+
+class OutboxTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(consumer=self.consumer)
+        ProductInOrder.objects.create(order=self.order, product=self.product, quantity=3)
+
+    def pay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'paid'
+            self.order.save()
+
+    def test_sale_is_posted_once(self):
+        self.pay()
+        self.pay()
+        self.assertEqual(OutboxEvent.objects.get().status, 'done')
+        self.assertEqual(process_outbox(), 0)
+        self.assertEqual(Cost.objects.get(order=self.order).amount, 30)
+        self.consumer.refresh_from_db()
+        self.assertEqual(self.consumer.total_cost, 30)
+
+    def test_failed_event_is_retried_without_partial_effects(self):
+        def fail(**payload):
+            Cost.objects.create(name='Частичная проводка', amount=1, transaction='in')
+            raise RuntimeError('fail')
+
+        with mock.patch.dict(outbox.OUTBOX_HANDLERS, { 'order_sale': fail }), \
+                self.assertLogs('warehouse.outbox', level='ERROR'):
+            self.pay()
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertFalse(Cost.objects.exists())
+        OutboxEvent.objects.update(available_at=event.available_at - datetime.timedelta(hours=1))
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(Cost.objects.filter(order=self.order).count(), 1)
+
+    @override_settings(OUTBOX_PROCESS_ON_COMMIT=False)
+    def test_event_waits_for_process_outbox(self):
+        self.pay()
+        self.assertEqual(OutboxEvent.objects.get().status, 'pending')
+        self.assertFalse(Cost.objects.exists())
+        self.assertEqual(process_outbox(), 1)
+        self.assertEqual(Cost.objects.get(order=self.order).amount, 30)
@@ -0,0 +1,46 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Product
+from ..services.queries import QueryBudgetExceeded, fingerprint, record_queries
+from ..views import WarehouseListView
+from .base import WarehouseDataMixin
+
+
+class QueryRecorderTests(WarehouseDataMixin, TestCase):
+    def test_fingerprint_folds_in_lists(self):
+        self.assertEqual(fingerprint('SELECT *\n  FROM t WHERE id IN (%s, %s,%s)'), 'SELECT * FROM t WHERE id IN (...)')
+
+    def test_repeated_queries_are_reported_as_duplicates(self):
+        with record_queries() as recorder:
+            Product.objects.get(pk=self.product.pk)
+            Product.objects.filter(pk__in=[ 1, 2 ]).count()
+            Product.objects.filter(pk__in=[ 1, 2, 3 ]).count()
+        summary = recorder.summary()
+        self.assertEqual(summary[ 'queries' ], 3)
+        self.assertEqual(summary[ 'duplicates' ], 1)
+        self.assertEqual(summary[ 'duplicate_fingerprints' ][ 0 ][ 'count' ], 2)
+
+
+class QueryInstrumentationTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.receive(5, 1)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_streamed_export_is_counted_on_close(self):
+        with self.assertLogs('warehouse.queries', level='INFO') as logs:
+            response = self.client.get(reverse('warehouse:warehouse_list'), { 'format': 'csv' })
+            self.assertIn('partial=1', response[ 'X-Query-Stats' ])
+            b''.join(response.streaming_content)
+        self.assertTrue(any('Streamed' in line for line in logs.output))
+
+    @override_settings(QUERY_BUDGET_MODE='raise')
+    def test_streamed_export_respects_budget(self):
+        with mock.patch.object(WarehouseListView, 'query_budget', 1):
+            response = self.client.get(reverse('warehouse:warehouse_list'), { 'format': 'csv' })
+            with self.assertRaises(QueryBudgetExceeded):
+                b''.join(response.streaming_content)
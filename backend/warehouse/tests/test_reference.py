@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Category, Product
+from ..services import reference
+from ..services.reference import get_categories, get_category_list, get_product, get_products, get_product_list
+
+
+@mock.patch('warehouse.services.reference.PRODUCT_CHUNK_SIZE', 2)
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        reference._local.clear()
+        self.category = Category.objects.create(name='Категория', description='')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products = [
+                Product.objects.create(name=f'Продукт {i}', category=self.category, weight=1, retail_price=10 + i)
+                for i in range(5)
+            ]
+
+    def product_queries(self, queries):
+        return [ query for query in queries if 'FROM "warehouse_product"' in query[ 'sql' ] ]
+
+    def test_saving_product_reloads_only_its_chunk(self):
+        self.assertEqual([ product.pk for product in get_product_list() ], [ product.pk for product in self.products ])
+        with CaptureQueriesContext(connection) as queries:
+            get_product_list()
+        self.assertEqual(self.product_queries(queries), [ ])
+
+        product = self.products[ 3 ]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.retail_price = 99
+            product.save()
+        with CaptureQueriesContext(connection) as queries:
+            products = get_products()
+        self.assertEqual(products[ product.pk ].retail_price, 99)
+        self.assertEqual(len(self.product_queries(queries)), 1)
+
+    def test_new_product_opens_next_chunk(self):
+        get_products()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5, 8):
+                Product.objects.create(name=f'Продукт {i}', category=self.category, weight=1, retail_price=1)
+        self.assertEqual(len(get_product_list(category_id=self.category.pk)), 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[ 0 ].delete()
+        self.assertNotIn(self.products[ 0 ].pk, get_products())
+
+    def test_get_product_reads_only_its_chunk(self):
+        product = self.products[ 4 ]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(get_product(product.pk).name, product.name)
+        self.assertEqual(len(self.product_queries(queries)), 1)
+        self.assertIsNone(get_product(product.pk + 100))
+
+    def test_product_change_is_visible_after_commit(self):
+        get_products()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.products[ 0 ].name = 'Новое наименование'
+            self.products[ 0 ].save()
+        self.assertEqual(get_products()[ self.products[ 0 ].pk ].name, 'Продукт 0')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_products()[ self.products[ 0 ].pk ].name, 'Новое наименование')
+
+    def test_category_changes_invalidate_categories(self):
+        self.assertEqual([ category.name for category in get_category_list() ], [ 'Категория' ])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Переименована'
+            self.category.save()
+            Category.objects.create(name='Another', description='')
+        self.assertEqual([ category.name for category in get_category_list() ], [ 'Another', 'Переименована' ])
+        with CaptureQueriesContext(connection) as queries:
+            get_categories()
+        self.assertFalse(any('"warehouse_category"' in query[ 'sql' ] for query in queries))
+
+    def test_full_reset_reloads_every_chunk(self):
+        get_products()
+        Product.objects.filter(pk=self.products[ 0 ].pk).update(retail_price=1)
+        Product.objects.filter(pk=self.products[ 4 ].pk).update(retail_price=2)
+        self.assertEqual(get_products()[ self.products[ 0 ].pk ].retail_price, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            reference.invalidate_reference()
+        products = get_products()
+        self.assertEqual((products[ self.products[ 0 ].pk ].retail_price, products[ self.products[ 4 ].pk ].retail_price),
+                         (1, 2))
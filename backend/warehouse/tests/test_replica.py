@@ -0,0 +1,102 @@
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from ..models import Category, Product
+from ..routers import ReplicaRouter
+from ..services.replica import PRIMARY_COOKIE, call_with_replica_reads, get_read_alias, replica_reads
+from .base import WarehouseDataMixin
+
+
+def read_alias_view(request):
+    return HttpResponse(str(get_read_alias()))
+
+
+def streamed_read_alias_view(request):
+    return StreamingHttpResponse(str(get_read_alias()) for _ in range(2))
+
+
+def replica_configured():
+    # Маршрутизацию проверяем без второй базы: запросы к ней в этих тестах не выполняются
+    return mock.patch('warehouse.services.replica.get_replica_alias', return_value='replica')
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_without_replica_everything_reads_from_default(self):
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(Product))
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_reads_inside_block_go_to_replica(self):
+        with replica_configured():
+            self.assertIsNone(self.router.db_for_read(Product))
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(Product), 'replica')
+                self.assertEqual(self.router.db_for_write(Product), 'default')
+            with replica_reads(enabled=False):
+                self.assertIsNone(self.router.db_for_read(Product))
+
+    @mock.patch('warehouse.routers.get_replica_alias', return_value='replica')
+    def test_relations_between_primary_and_replica_are_allowed(self, get_replica_alias):
+        product, category = Product(pk=1), Category(pk=1)
+        product._state.db, category._state.db = 'replica', 'default'
+        self.assertTrue(self.router.allow_relation(product, category))
+        category._state.db = 'other'
+        self.assertIsNone(self.router.allow_relation(product, category))
+
+    def test_write_switches_block_to_primary(self):
+        with replica_configured(), replica_reads():
+            with connection.cursor() as cursor:
+                cursor.execute('UPDATE warehouse_category SET description = description')
+            self.assertIsNone(self.router.db_for_read(Category))
+        with replica_configured(), replica_reads():
+            self.assertEqual(self.router.db_for_read(Category), 'replica')
+
+    def test_transaction_reads_from_primary(self):
+        with replica_configured(), replica_reads(), transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_report_view_reads_from_replica_until_pinned(self):
+        with replica_configured():
+            response = call_with_replica_reads(self.factory.get('/'), read_alias_view)
+            self.assertEqual(response.content, b'replica')
+            request = self.factory.get('/')
+            request.COOKIES[ PRIMARY_COOKIE ] = str(time.time() + 60)
+            self.assertEqual(call_with_replica_reads(request, read_alias_view).content, b'None')
+            request.COOKIES[ PRIMARY_COOKIE ] = str(time.time() - 1)
+            self.assertEqual(call_with_replica_reads(request, read_alias_view).content, b'replica')
+
+    def test_streamed_report_reads_from_replica(self):
+        with replica_configured():
+            response = call_with_replica_reads(self.factory.get('/'), streamed_read_alias_view)
+            self.assertEqual(b''.join(response.streaming_content), b'replicareplica')
+
+    def test_sync_replica_requires_replica(self):
+        with self.assertRaises(CommandError):
+            call_command('sync_replica')
+
+
+class ReadYourWritesTests(WarehouseDataMixin, TestCase):
+    def test_write_pins_user_to_primary(self):
+        with replica_configured(), mock.patch('warehouse.middleware.get_replica_alias', return_value='replica'):
+            response = self.client.get(reverse('warehouse:category_list'))
+            self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+            response = self.client.post(reverse('warehouse:category_create'), { 'name': 'Новая', 'description': '' })
+            self.assertEqual(response.status_code, 302)
+            pinned_until = float(response.cookies[ PRIMARY_COOKIE ].value)
+            self.assertAlmostEqual(pinned_until, time.time() + 5, delta=2)
+
+    def test_no_cookie_without_replica(self):
+        response = self.client.post(reverse('warehouse:category_create'), { 'name': 'Новая', 'description': '' })
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
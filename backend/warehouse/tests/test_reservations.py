@@ -0,0 +1,49 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from ..models import Order, ProductInOrder, StockReservation
+from .base import WarehouseDataMixin
+
+
+class ReservationTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.receive(10, 5)
+        self.order = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse)
+
+    def test_lines_reserve_available_stock(self):
+        line = ProductInOrder.objects.create(order=self.order, product=self.product, quantity=4)
+        self.assertEqual(self.balance().reserved, 4)
+        other = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse)
+        with self.assertRaises(ValidationError):
+            ProductInOrder.objects.create(order=other, product=self.product, quantity=7)
+        # Строка без резерва не записана: сохранение откатилось вместе с сигналом
+        self.assertFalse(ProductInOrder.objects.filter(order=other).exists())
+        self.assertEqual(self.balance().reserved, 4)
+        line.quantity = 6
+        line.save()
+        self.assertEqual(self.balance().get_available(), 4)
+
+    def test_cancel_and_ship_release_reservation(self):
+        ProductInOrder.objects.create(order=self.order, product=self.product, quantity=4)
+        self.order.status = 'cancelled'
+        self.order.save()
+        self.assertEqual(self.balance().reserved, 0)
+        self.order.status = 'new'
+        self.order.save()
+        self.assertEqual(self.balance().reserved, 4)
+        self.order.status = 'shipped'
+        self.order.save()
+        balance = self.balance()
+        self.assertEqual((balance.quantity, balance.reserved), (6, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reopening_beyond_stock_keeps_order_cancelled(self):
+        cancelled = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse, status='cancelled')
+        ProductInOrder.objects.create(order=cancelled, product=self.product, quantity=8)
+        ProductInOrder.objects.create(order=self.order, product=self.product, quantity=5)
+        cancelled.status = 'new'
+        with self.assertRaises(ValidationError):
+            cancelled.save()
+        self.assertEqual(Order.objects.get(pk=cancelled.pk).status, 'cancelled')
+        self.assertEqual(self.balance().reserved, 5)
@@ -0,0 +1,68 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from ..models import Category, Product
+from ..services.search import FTS_TABLE, search_products, search_product_ids, rebuild_search_index
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.tools = Category.objects.create(name='Инструмент', description='')
+        self.fasteners = Category.objects.create(name='Крепёж болты', description='')
+        self.by_name = Product.objects.create(name='Болт М8', description='Оцинкованный', category=self.tools,
+                                              retail_price=1)
+        self.by_category = Product.objects.create(name='Шайба', description='Плоская', category=self.fasteners,
+                                                  retail_price=1)
+        self.by_description = Product.objects.create(name='Ключ', description='Для болтов', category=self.tools,
+                                                     retail_price=1)
+
+    def found(self, query, **kwargs):
+        return list(search_products(query, **kwargs).values_list('name', flat=True))
+
+    def test_name_match_ranks_above_category_and_description(self):
+        self.assertEqual(self.found('болт'), [ 'Болт М8', 'Шайба', 'Ключ' ])
+
+    def test_all_terms_are_required_and_matched_by_prefix(self):
+        self.assertEqual(self.found('бол м'), [ 'Болт М8' ])
+        self.assertEqual(self.found('болт гайка'), [ ])
+
+    def test_category_filter(self):
+        self.assertEqual(self.found('болт', category_id=self.tools.pk), [ 'Болт М8', 'Ключ' ])
+
+    def test_empty_query_returns_products_ordered_by_name(self):
+        self.assertEqual(self.found(''), [ 'Болт М8', 'Ключ', 'Шайба' ])
+        self.assertEqual(self.found('  ,. '), [ 'Болт М8', 'Ключ', 'Шайба' ])
+
+    def test_product_changes_are_indexed(self):
+        self.by_name.name = 'Гайка М8'
+        self.by_name.save()
+        self.assertEqual(self.found('гайка'), [ 'Гайка М8' ])
+        self.assertNotIn('Гайка М8', self.found('болт'))
+
+    def test_category_rename_reindexes_its_products(self):
+        self.tools.name = 'Слесарный'
+        self.tools.save()
+        self.assertEqual(self.found('слесар'), [ 'Болт М8', 'Ключ' ])
+
+    def test_deleted_product_is_removed_from_index(self):
+        pk = self.by_name.pk
+        self.by_name.delete()
+        self.assertNotIn(pk, search_product_ids('болт'))
+
+    def test_rebuild_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        self.assertEqual(self.found('болт'), [ ])
+        self.assertEqual(rebuild_search_index(), 3)
+        self.assertEqual(self.found('болт'), [ 'Болт М8', 'Шайба', 'Ключ' ])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        stdout = io.StringIO()
+        call_command('rebuild_search_index', stdout=stdout)
+        self.assertIn('3 продуктов', stdout.getvalue())
+        self.assertEqual(self.found('шайба'), [ 'Шайба' ])
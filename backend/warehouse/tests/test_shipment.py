@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+
+from ..models import ProductInWarehouse, StockBalance, CostLayer, Order, ProductInOrder
+from ..services.shipment import ship_order_lines
+from .base import WarehouseDataMixin
+
+
+class ShipmentTests(WarehouseDataMixin, TestCase):
+    def test_shipment_is_idempotent(self):
+        self.receive(10, 5)
+        order = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse)
+        ProductInOrder.objects.create(order=order, product=self.product, quantity=4)
+        self.assertEqual(len(ship_order_lines(order)), 1)
+        self.assertEqual(ship_order_lines(order), [ ])
+        self.assertEqual(self.balance().quantity, 6)
+
+    def test_short_shipment_changes_nothing(self):
+        self.receive(3, 5)
+        order = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse)
+        ProductInOrder.objects.bulk_create([ ProductInOrder(order=order, product=self.product, quantity=4) ])
+        with self.assertRaises(ValidationError):
+            ship_order_lines(order)
+        self.assertEqual(self.balance().quantity, 3)
+        self.assertFalse(ProductInWarehouse.objects.filter(order=order).exists())
+
+
+def ship_in_thread(order):
+    try:
+        ship_order_lines(order)
+        return 'shipped', StockBalance.objects.get(product_id=order.productinorder_set.get().product_id).quantity
+    except ValidationError:
+        return 'short', None
+    finally:
+        connection.close()
+
+
+class ConcurrentShipmentTests(WarehouseDataMixin, TransactionTestCase):
+    """
+    Отгрузки одного товара в нескольких потоках: остаток не уходит в минус и сходится с журналом движений
+    """
+    THREADS = 8
+    ORDERS = 24
+    STOCK = 50
+    QUANTITY = 3
+
+    def test_parallel_shipments_conserve_stock(self):
+        self.receive(self.STOCK, 5)
+        orders = [ Order.objects.create(consumer=self.consumer, warehouse=self.warehouse) for _ in range(self.ORDERS) ]
+        # Без резерва: все заказы спорят за один и тот же остаток при отгрузке
+        ProductInOrder.objects.bulk_create([
+            ProductInOrder(order=order, product=self.product, quantity=self.QUANTITY) for order in orders
+        ])
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            outcomes = list(executor.map(ship_in_thread, orders))
+
+        shipped = [ quantity for outcome, quantity in outcomes if outcome == 'shipped' ]
+        self.assertEqual(len(shipped), self.STOCK // self.QUANTITY)
+        self.assertEqual(len(outcomes) - len(shipped), self.ORDERS - self.STOCK // self.QUANTITY)
+        self.assertTrue(all(quantity >= 0 for quantity in shipped))
+        balance = self.balance()
+        self.assertEqual(balance.quantity, self.STOCK % self.QUANTITY)
+        self.assertEqual(balance.quantity, self.ledger_quantity())
+        self.assertEqual(CostLayer.objects.aggregate(total=Sum('remaining_quantity'))[ 'total' ], balance.quantity)
@@ -0,0 +1,129 @@
+from django.test import TestCase
+
+from ..forms import ProductInOrderForm
+from ..models import Product, Warehouse, ProductInWarehouse, StockBalance, Order, ProductInOrder
+from ..services.stock import rebuild_stock_balances, sellable_products
+from .base import WarehouseDataMixin
+
+
+class StockBalanceTests(WarehouseDataMixin, TestCase):
+    def test_movements_update_balance(self):
+        self.receive(10, 5)
+        self.receive(10, 7)
+        balance = self.balance()
+        self.assertEqual((balance.quantity, balance.last_cost_price), (20, 7))
+        self.move_out(4)
+        self.assertEqual(self.balance().quantity, 16)
+        self.assertEqual(self.balance().quantity, self.ledger_quantity())
+
+    def test_edit_and_delete_revert_previous_movement(self):
+        movement = self.receive(10, 5)
+        movement.quantity = 3
+        movement.save()
+        self.assertEqual(self.balance().quantity, 3)
+        movement.delete()
+        self.assertEqual(self.balance().quantity, 0)
+
+    def test_rebuild_matches_incremental(self):
+        self.receive(10, 5)
+        self.move_out(3)
+        self.receive(2, 9)
+        expected = StockBalance.objects.values_list('quantity', 'last_cost_price', 'last_date').get()
+        StockBalance.objects.all().delete()
+        rebuild_stock_balances()
+        self.assertEqual(StockBalance.objects.values_list('quantity', 'last_cost_price', 'last_date').get(), expected)
+
+    def test_warehouse_valuation_reads_balances(self):
+        self.receive(10, 5)
+        self.move_out(4)
+        warehouse = Warehouse.objects.with_valuation().get(pk=self.warehouse.pk)
+        self.assertEqual(warehouse.total_quantity, 6)
+        self.assertEqual(warehouse.total_cost_price, 30)
+        self.assertEqual(warehouse.total_retail_price, 60)
+        self.assertEqual(warehouse.total_weight, 12)
+        # Склад без with_valuation досчитывает всю оценку одним запросом по строкам остатков
+        warehouse = Warehouse.objects.get(pk=self.warehouse.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                (warehouse.get_total_warehouse_cost_price(), warehouse.get_total_warehouse_retail_price(),
+                 warehouse.get_total_warehouse_weight()),
+                (30, 60, 12),
+            )
+
+
+class AverageCostTests(WarehouseDataMixin, TestCase):
+    def test_receipts_move_weighted_average_cost(self):
+        self.receive(10, 5)
+        self.receive(10, 7)
+        self.assertEqual(self.balance().average_cost, 6)
+        # Расход не меняет среднюю, правка прихода пересчитывает её так, будто приход был таким сразу
+        self.move_out(4)
+        movement = self.receive(4, 11)
+        self.assertEqual(self.balance().average_cost, 7)
+        movement.cost_price = 6
+        movement.save()
+        self.assertEqual(self.balance().average_cost, 6)
+        movement.delete()
+        self.assertEqual(self.balance().average_cost, 6)
+
+    def test_rebuild_matches_incremental(self):
+        self.receive(10, 5)
+        self.move_out(3)
+        self.receive(7, 9)
+        expected = StockBalance.objects.values_list('quantity', 'average_cost').get()
+        StockBalance.objects.all().delete()
+        rebuild_stock_balances()
+        self.assertEqual(StockBalance.objects.values_list('quantity', 'average_cost').get(), expected)
+
+    def test_order_margin_uses_average_cost_of_its_warehouse(self):
+        self.receive(10, 4)
+        self.receive(10, 6)
+        order = Order.objects.create(consumer=self.consumer, warehouse=self.warehouse)
+        line = ProductInOrder.objects.create(order=order, product=self.product, quantity=3)
+        self.assertEqual(line.get_total_cost_price(), 15)
+        with self.assertNumQueries(2):
+            self.assertEqual(order.get_margin(), 15)
+
+
+
+class SellableProductsTests(WarehouseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_warehouse = Warehouse.objects.create(name='Другой склад', description='')
+        self.other_product = Product.objects.create(name='Другой продукт', category=self.category, weight=1,
+                                                    retail_price=5)
+        self.receive(10, 5)
+        ProductInWarehouse.objects.create(product=self.other_product, warehouse=self.other_warehouse, quantity=3,
+                                          cost_price=1, transaction='in')
+
+    def available(self, warehouse_id=None, **kwargs):
+        return { product.name: product.available_quantity
+                 for product in sellable_products(warehouse_id, **kwargs) }
+
+    def test_lists_products_with_stock_in_the_warehouse(self):
+        self.assertEqual(self.available(self.warehouse.pk), { 'Продукт': 10 })
+        self.assertEqual(self.available(self.other_warehouse.pk), { 'Другой продукт': 3 })
+        self.assertEqual(self.available(), { 'Другой продукт': 3, 'Продукт': 10 })
+
+    def test_stock_movements_update_the_list(self):
+        self.move_out(10)
+        self.assertEqual(self.available(self.warehouse.pk), { })
+        self.receive(2, 5, product=self.other_product)
+        self.assertEqual(self.available(self.warehouse.pk), { 'Другой продукт': 2 })
+
+    def test_reserved_stock_is_not_available(self):
+        StockBalance.objects.filter(product=self.product, warehouse=self.warehouse).update(reserved=4)
+        self.assertEqual(self.available(self.warehouse.pk), { 'Продукт': 6 })
+        StockBalance.objects.filter(product=self.product, warehouse=self.warehouse).update(reserved=10)
+        self.assertEqual(self.available(self.warehouse.pk), { })
+        self.assertEqual(self.available(self.warehouse.pk, keep_product_id=self.product.pk), { 'Продукт': 0 })
+
+    def test_order_line_form_offers_only_sellable_products(self):
+        form = ProductInOrderForm(warehouse_id=self.warehouse.pk,
+                                  data={ 'product': self.other_product.pk, 'quantity': 1 })
+        self.assertEqual(list(form.fields[ 'product' ].queryset), [ self.product ])
+        self.assertIn('product', form.errors)
+        form = ProductInOrderForm(warehouse_id=self.warehouse.pk, data={ 'product': self.product.pk, 'quantity': 11 })
+        self.assertIn('quantity', form.errors)
+        form = ProductInOrderForm(warehouse_id=self.warehouse.pk, data={ 'product': self.product.pk, 'quantity': 10 })
+        self.assertTrue(form.is_valid(), form.errors)
@@ -0,0 +1,55 @@
+from django.db import transaction
+from django.test import TestCase
+
+from ..models import Warehouse, ProductInWarehouse, StockBalance, Job
+from ..services.benchmark import benchmark_cases, request_once, run_case, run_benchmarks, compare_results, percentile
+from ..services.synthetic import DEFAULT_SCALE, generate_dataset, check_dataset
+
+SCALE = DEFAULT_SCALE._replace(categories=2, products=20, warehouses=2, lots=10, lot_lines=5, consumers=5,
+                               orders=60, order_lines=4, costs=10, days=60)
+
+
+class SyntheticDatasetTests(TestCase):
+    def test_generated_stock_is_consistent(self):
+        counts = generate_dataset(SCALE, seed=1, prefix='test')
+        self.assertEqual(counts[ 'orders' ], 60)
+        self.assertEqual(check_dataset(Warehouse.objects.all()), [ ])
+        shipped = ProductInWarehouse.objects.filter(transaction='out')
+        self.assertEqual(shipped.exclude(order__status='shipped').count(), 0)
+        self.assertFalse(StockBalance.objects.filter(quantity__lt=0).exists())
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        generate_dataset(SCALE, seed=1, prefix='test')
+        self.receive_case = next(case for case in benchmark_cases() if case.name == 'lot_to_warehouse_receive')
+
+    def test_receive_case_times_the_submitted_job(self):
+        rows = ProductInWarehouse.objects.count()
+        with transaction.atomic():
+            status, elapsed, recorder = request_once(self.client, self.receive_case)
+            self.assertEqual(status, 302)
+            self.assertEqual(Job.objects.get(kind='receive_lot').status, 'done')
+            self.assertGreater(ProductInWarehouse.objects.count(), rows)
+            transaction.set_rollback(True)
+        self.assertEqual(ProductInWarehouse.objects.count(), rows)
+
+    def test_rollback_case_leaves_data_unchanged(self):
+        rows = ProductInWarehouse.objects.count()
+        result = run_case(self.client, self.receive_case, iterations=3, warmup=1)
+        self.assertEqual((result[ 'status' ], result[ 'iterations' ]), (302, 3))
+        self.assertEqual(ProductInWarehouse.objects.count(), rows)
+        self.assertFalse(Job.objects.exists())
+
+    def test_report_covers_all_cases(self):
+        report = run_benchmarks(iterations=1, warmup=0, host='testserver')
+        self.assertEqual([ result[ 'name' ] for result in report[ 'results' ] ],
+                         [ case.name for case in benchmark_cases() ])
+        self.assertTrue(all(result[ 'status' ] in (200, 302) for result in report[ 'results' ]))
+        self.assertEqual(report[ 'dataset' ][ 'order' ], 60)
+        deltas = list(compare_results(report, report))
+        self.assertEqual({ delta[ 'queries' ] for delta in deltas }, { 0 })
+
+    def test_percentile_is_nearest_rank(self):
+        timings = list(range(1, 21))
+        self.assertEqual((percentile(timings, 50), percentile(timings, 95), percentile(timings, 100)), (10, 19, 20))
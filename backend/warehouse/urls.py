@@ -17,12 +17,14 @@ from .views import (
      ProductDetailView,
      ProductUpdateView,
      ProductDeleteView,
+     ProductImportView,
 
      ProductInLotListView,
      ProductInLotCreateView,
      ProductInLotDetailView,
      ProductInLotUpdateView,
      ProductInLotDeleteView,
+     ProductInLotImportView,
 
      LotCostListView,
      LotCostCreateView,
@@ -72,7 +74,12 @@ from .views import (
      CostUpdateView,
      CostDeleteView,
 
-     get_balance_by_date
+     get_balance_by_date,
+
+     job_create,
+     JobListView,
+     JobDetailView,
+     job_download,
 
 )
 
@@ -92,12 +99,14 @@ urlpatterns = [
      path('product/<int:pk>/', ProductDetailView.as_view(), name='product_detail'),
      path('product/<int:pk>/update/', ProductUpdateView.as_view(), name='product_update'),
      path('product/<int:pk>/delete/', ProductDeleteView.as_view(), name='product_delete'),
+     path('product/import/', ProductImportView.as_view(), name='product_import'),
 
      path('productinlot/list/<int:lot_id>/', ProductInLotListView.as_view(), name='productinlot_list'),
      path('productinlot/<int:lot_id>/create/', ProductInLotCreateView.as_view(), name='productinlot_create'),
      path('productinlot/<int:pk>/', ProductInLotDetailView.as_view(), name='productinlot_detail'),
      path('productinlot/<int:pk>/update/', ProductInLotUpdateView.as_view(), name='productinlot_update'),
      path('productinlot/<int:pk>/delete/', ProductInLotDeleteView.as_view(), name='productinlot_delete'),
+     path('productinlot/<int:lot_id>/import/', ProductInLotImportView.as_view(), name='productinlot_import'),
 
      path('lotcost/list/<int:lot_id>/', LotCostListView.as_view(), name='lotcost_list'),
      path('lotcost/<int:lot_id>/create/', LotCostCreateView.as_view(), name='lotcost_create'),
@@ -147,6 +156,7 @@ urlpatterns = [
           name='productinorder_update'),
      path('productinorder/<int:pk>/delete/', ProductInOrderDeleteView.as_view(), name='productinorder_delete'),
 
+     path('cost/list/', CostListView.as_view(), name='cost_list'),
      path('cost/create/', CostCreateView.as_view(), name='cost_create'),
      path('cost/<int:pk>/', CostDetailView.as_view(), name='cost_detail'),
      path('cost/<int:pk>/update/', CostUpdateView.as_view(), name='cost_update'),
@@ -159,4 +169,9 @@ urlpatterns = [
 
      path('balance/list/', get_balance_by_date, name='balance_list'),
 
+     path('job/list/', JobListView.as_view(), name='job_list'),
+     path('job/create/', job_create, name='job_create'),
+     path('job/<int:pk>/', JobDetailView.as_view(), name='job_detail'),
+     path('job/<int:pk>/download/', job_download, name='job_download'),
+
 ]
@@ -1,18 +1,17 @@
-import csv
 from datetime import date
 from typing import Any, Dict
-from urllib.parse import quote
 from django import http
 from django.db.models import Q
 from django.shortcuts import redirect
 from django.contrib import messages
 
-from django.db.models import Sum, F, Subquery, OuterRef, Case, When, Q
-from django.http import HttpResponse
-from django.shortcuts import render
+from django.db.models import Sum, F, Q
+from django.shortcuts import render, get_object_or_404
+from django.views.decorators.http import require_POST
 from django.urls import reverse_lazy
 from django.utils.timezone import now
-from django.views.generic import CreateView, ListView, DetailView, UpdateView, DeleteView
+from django.views.generic import CreateView, ListView, DetailView, UpdateView, DeleteView, FormView
+from django.core.files.storage import default_storage
 from django.core.paginator import Paginator
 
 from .forms import (
@@ -31,6 +30,7 @@ from .forms import (
     ProductInOrderForm,
     BalanceForm,
     CostForm,
+    ImportForm,
 )
 
 from .models import (
@@ -41,46 +41,44 @@ from .models import (
     Lot,
     Warehouse,
     ProductInWarehouse,
+    StockBalance,
     Consumer,
     Order,
     ProductInOrder,
     Cost,
+    Job,
 )
-from .utils import add_costs_out_from_lot_if_not_exists
+from .utils import unposted_lot_costs
+from .services.csv import CsvExportMixin, product_rows, warehouse_rows, queryset_rows, SIGNATURE_ROWS
+from .services.keyset import KeysetPaginationMixin
+from .services.search import search_products
+from .services.reference import get_category_list, get_product_list, get_products
+from .services.queries import query_budget
+from .services.replica import ReplicaReadsMixin, replica_reads_view
+from .services.history import status_history
+from .services.reservations import ReservationFormMixin
+from .services.cash import get_period_totals, get_total_balance
+from .services.lot import allocate_lot_costs, lot_line_inputs, add_lot_lines
+from .services.jobs import get_job_title, get_or_submit_job, submit_job
 
 
 def index(request):
     return render(request, 'warehouse/index.html')
 
 
-class CategoryListView(ListView):
+class CategoryListView(ReplicaReadsMixin, CsvExportMixin, ListView):
     model = Category
     template_name = 'warehouse/category/category_list.html'
+    csv_filename = 'Справочник Товаров'
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         kwargs['columns'] = ['#', 'Наименование', 'Описание']
         kwargs['columns_attributes'] = ['pk', 'name', 'description']
         return super().get_context_data(**kwargs)
 
-    def render_to_response(self, context: Dict[str, Any], **response_kwargs: Any) -> HttpResponse:
-        if 'format' in self.request.GET and self.request.GET['format'] == 'csv':
-            filename = f'Справочник Товаров от {now().strftime("%Y-%m-%d")}.csv'
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
-
-            writer = csv.writer(response)
-            writer.writerow(["#", "Наименование", "Розничная цена", "Вес кг."])
-
-            products = Product.objects.all()
-            for product in products:
-                writer.writerow([product.id, product.name,
-                                product.retail_price, product.weight])
-            writer.writerow([])  # Пустая строка
-            writer.writerow(['', 'Ответственный', '______', '______'])
-            writer.writerow(['', 'Принял', '______', '______'])
-            return response
-
-        return super().render_to_response(context, **response_kwargs)
+    def get_csv_rows(self):
+        # Выгрузка из списка категорий исторически с пустыми подписями
+        return product_rows(SIGNATURE_ROWS)
 
 
 class CategoryCreateView(CreateView):
@@ -97,6 +95,7 @@ class CategoryCreateView(CreateView):
 class CategoryDetailView(DetailView):
     model = Category
     template_name = 'warehouse/category/category_detail.html'
+    query_budget = 6
     paginate_by = 10
 
     def get_context_data(self, **kwargs):
@@ -107,11 +106,8 @@ class CategoryDetailView(DetailView):
         # Получаем параметр поиска из GET-запроса
         search_query = self.request.GET.get('q')
         if search_query:
-            # Фильтруем список продуктов по поисковому запросу
-            product_list = product_list.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
+            # Полнотекстовый поиск, результаты по релевантности
+            product_list = search_products(search_query, category_id=self.kwargs['pk'])
 
         paginator = Paginator(product_list, self.paginate_by)
         page_number = self.request.GET.get('page')
@@ -217,6 +213,57 @@ class ProductInLotListView(ListView):
         return ProductInLot.objects.filter(lot=self.kwargs['lot_id'])
 
 
+class ImportView(FormView):
+    """
+    Загрузка csv для импорта: файл сохраняется в хранилище, импорт выполняет фоновая задача
+    """
+    form_class = ImportForm
+    template_name = 'warehouse/import/import_form.html'
+    job_kind = None
+    title = None
+
+    def get_job_params(self):
+        return { }
+
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        kwargs['title'] = self.title
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        # Загруженный файл пишется на диск частями, в память целиком не читается
+        path = default_storage.save(f'imports/{now().strftime("%Y/%m")}/{form.cleaned_data["file"].name}',
+                                    form.cleaned_data['file'])
+        job = submit_job(self.job_kind, path=path, **self.get_job_params())
+        return redirect('warehouse:job_detail', job.pk)
+
+
+class ProductImportView(ImportView):
+    job_kind = 'import_products'
+    title = 'Импорт справочника продуктов'
+
+
+class ProductInLotImportView(ImportView):
+    job_kind = 'import_lot_lines'
+    title = 'Импорт товаров в лот'
+
+    def get_job_params(self):
+        return { 'lot_id': self.kwargs['lot_id'] }
+
+
+class LotLineForm:
+    """
+    Строка таблицы добавления в лот, заполненная введёнными значениями (после ошибки проверки)
+    """
+    def __init__(self, product, line):
+        self.id = line.id
+        self.number = line.number
+        self.name = product.name if product else f'#{line.id}'
+        self.retail_price = product.retail_price if product else None
+        self.quantity = line.quantity
+        self.purchase_price = line.purchase_price
+        self.description = line.description
+
+
 class ProductInLotCreateView(CreateView):
     model = ProductInLot
     template_name = 'includes/create_list.html'
@@ -224,22 +271,18 @@ class ProductInLotCreateView(CreateView):
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         kwargs['title'] = 'продукты в лот'
-        product_list = Product.objects.all()
-
         search_query = self.request.GET.get('q')
-        if search_query:
-            # Фильтруем список продуктов по поисковому запросу
-            product_list = product_list.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
-
         category_field = self.request.GET.get('category')
-        if category_field:
-            product_list = product_list.filter(category=category_field)
-
-        kwargs['category_list'] = Category.objects.all()
-        kwargs['product_list'] = product_list
+        if 'product_list' in kwargs:
+            product_list = kwargs[ 'product_list' ]
+        elif search_query:
+            product_list = search_products(search_query, category_id=category_field or None)
+        else:
+            # Без поиска список берём из кэша справочников, не из базы
+            product_list = get_product_list(category_id=category_field or None)
+
+        kwargs['category_list'] = get_category_list()
+        kwargs.setdefault('product_list', product_list)
         kwargs['lot_id'] = self.kwargs['lot_id']
         return super().get_context_data(**kwargs)
 
@@ -247,30 +290,31 @@ class ProductInLotCreateView(CreateView):
         return reverse_lazy('warehouse:lot_detail', kwargs={'pk': self.kwargs['lot_id']})
 
     def post(self, request, *args, **kwargs):
-        object_ids = self.request.POST.getlist('selected_objects')
-        quantities = self.request.POST.getlist('quantities')
-        purchase_prices = self.request.POST.getlist('purchase_prices')
-        descriptions = self.request.POST.getlist('descriptions')
-        lot_id = self.kwargs['lot_id']
-        lot = Lot.objects.get(pk=lot_id)
-
-        if request.method == 'POST':
-            message_text = ''
-            for object_id, quantity, purchase_price, description in zip(object_ids, quantities, purchase_prices, descriptions):
-                if quantity != '0' and purchase_price != '0':
-                    try:
-                        product = Product.objects.get(pk=object_id)
-                        product_in_lot = ProductInLot(product=product, lot=lot, quantity=int(
-                            quantity), purchase_price=float(purchase_price), description=description)
-                        product_in_lot.save()
-                        message_text += f'Продукт {product.name} в количестве {quantity} добавлен\n'
-                    except:
-                        message_text += f'!!! Внимание: Продукт {product.name} не добавлен\n'
-            messages.success(request, message_text)
-        return super().post(request, *args, **kwargs)
-
-
-class ProductInLotDetailView(DetailView):
+        inputs = list(lot_line_inputs(
+            request.POST.getlist('selected_objects'),
+            request.POST.getlist('quantities'),
+            request.POST.getlist('purchase_prices'),
+            request.POST.getlist('descriptions'),
+        ))
+        lines, errors = add_lot_lines(self.kwargs['lot_id'], inputs)
+        if errors:
+            # Ничего не записано: показываем заполненные строки с введёнными значениями и ошибками по каждой
+            self.object = None
+            products = get_products()
+            product_list = [
+                LotLineForm(products.get(int(line.id)) if str(line.id).isdigit() else None, line)
+                for line in inputs
+            ]
+            return self.render_to_response(self.get_context_data(
+                product_list=product_list,
+                line_errors=errors,
+                line_error_numbers={ error.number for error in errors },
+            ))
+        messages.success(request, f'Добавлено продуктов в лот: {len(lines)}')
+        return redirect(self.get_success_url())
+
+
+class ProductInLotDetailView(ReplicaReadsMixin, DetailView):
     model = ProductInLot
     template_name = 'warehouse/productinlot/productinlot_detail.html'
 
@@ -349,31 +393,27 @@ class LotCostDeleteView(DeleteView):
         return reverse_lazy('warehouse:lot_detail', kwargs={'pk': self.object.lot.id})
 
 
-class LotListView(ListView):
+class LotListView(KeysetPaginationMixin, ListView):
     model = Lot
     template_name = 'warehouse/lot/lot_list.html'
+    query_budget = 5
+
+    def get_queryset(self):
+        return Lot.objects.with_totals()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        excluded_lot_costs = []
-        for lot in context['object_list']:
-            if lot.status == 'paid':
-                existing_costs_out = Cost.objects.filter(Q(name__startswith=f'Затраты {lot.pk} на лот')
-                                                         | Q(name__startswith=f'Оплата лота {lot.pk}'))
-
-                existing_cost_out_names = [
-                    cost_out.name for cost_out in existing_costs_out]
-
-                lot_costs = lot.lotcost_set.exclude(
-                    name__in=existing_cost_out_names)
-
-                excluded_lot_costs.extend(lot_costs)
+        # Непроведённые затраты всех оплаченных лотов страницы одним запросом
+        paid_lots = [ lot.pk for lot in context['object_list'] if lot.status == 'paid' ]
+        excluded_lot_costs = list(unposted_lot_costs(paid_lots)) if paid_lots else [ ]
 
         context['excluded_lot_costs'] = excluded_lot_costs
-        context['columns'] = ['#', 'Дата создания', 'Статус', 'Описание']
+        context['columns'] = ['#', 'Дата создания', 'Статус', 'Кол-во товаров', 'Вес кг.',
+                              'Сумма закупки', 'Сумма расходов', 'Итого', 'Описание']
         context['columns_attributes'] = [
-            'pk', 'date_created', 'status', 'description']
+            'pk', 'date_created', 'status', 'products_quantity', 'products_weight',
+            'total_lot_purchase_price', 'total_lot_amount_spent', 'total', 'description']
         return context
 
 
@@ -391,97 +431,59 @@ class LotCreateView(CreateView):
         return reverse_lazy('warehouse:lot_detail', kwargs={'pk': pk})
 
 
-class LotDetailView(DetailView):
+class LotDetailView(ReplicaReadsMixin, CsvExportMixin, DetailView):
     model = Lot
     template_name = 'warehouse/lot/lot_detail.html'
+    query_budget = 8
+    csv_productinlot_columns = ["#", "Наименование товара", "Количество",
+                                "Вес кг.", "Закупочная стоимость", "Розничная цена"]
+    csv_productinlot_columns_attributes = ['pk', 'product.name', 'quantity',
+                                           'product.weight', 'purchase_price', 'product.retail_price']
+    csv_lotcost_columns = ["#", "Наименование расхода", "Сумма", "Дата"]
+    csv_lotcost_columns_attributes = ['pk', 'get_display_name', 'amount_spent', 'date_created']
+    csv_history_columns = ["#", "Статус", "Дата"]
+    csv_history_columns_attributes = ['pk', 'get_status_display', 'history_date']
+
+    def get_queryset(self):
+        return Lot.objects.with_totals()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # количество продуктов в лоте поштучно
-        product_in_lot_amount_count = ProductInLot.objects.filter(
-            lot=self.object).aggregate(Sum('quantity')).get('quantity__sum')
-        product_in_lot_list = ProductInLot.objects.filter(
-            lot=self.object).select_related('product')
-        product_in_lot_list = list(product_in_lot_list)
-
+        # себестоимость строк считается тем же движком, что и при перемещении лота на склад
+        product_in_lot_list = allocate_lot_costs(self.object.pk)
         lot_cost_queryset = LotCost.objects.filter(lot=self.object)
 
-        for product_in_lot in product_in_lot_list:
-            product_in_lot.cost_price = product_in_lot.purchase_price
-
-            lot_cost = lot_cost_queryset
-
-            if lot_cost_queryset.exists():
-                lot_cost_amount_spent_equal = lot_cost.filter(distribution='equal').aggregate(
-                    Sum('amount_spent')).get('amount_spent__sum')
-                lot_cost_amount_spent_by_weight = lot_cost.filter(
-                    distribution='by_weight').aggregate(Sum('amount_spent')).get('amount_spent__sum')
-                lot_cost_amount_spent_by_price = lot_cost.filter(
-                    distribution='by_price').aggregate(Sum('amount_spent')).get('amount_spent__sum')
-
-                product_in_lot_count = len(product_in_lot_list)
-
-                if product_in_lot_count and lot_cost_amount_spent_equal:
-                    product_in_lot.cost_price += lot_cost_amount_spent_equal / product_in_lot_amount_count
-
-                if self.object.get_products_weight() and lot_cost_amount_spent_by_weight:
-                    product_in_lot.cost_price += (lot_cost_amount_spent_by_weight /
-                                                  self.object.get_products_weight()) * product_in_lot.product.weight
-
-                if self.object.get_total_lot_purchase_price() and lot_cost_amount_spent_by_price:
-                    product_in_lot.cost_price += (lot_cost_amount_spent_by_price /
-                                                  self.object.get_total_lot_purchase_price()) * product_in_lot.purchase_price
-
         context['productinlot_list'] = product_in_lot_list
         context['lotcost_list'] = lot_cost_queryset
-        context['history'] = self.object.history.all()[::-1]
+        context['history'] = status_history(self.object)
         return context
 
-    def render_to_response(self, context, **response_kwargs):
-        if 'format' in self.request.GET and self.request.GET['format'] == 'csv':
-            filename = f'Лот_{self.object.pk}_от_{now().strftime("%Y-%m-%d")}.csv'
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
-
-            writer = csv.writer(response)
-            writer.writerow(["", "Список продуктов в лоте"])
-            writer.writerow(["#", "Наименование товара", "Количество",
-                            "Вес кг.", "Закупочная стоимость", "Розничная цена"])
-
-            productinlot_list = context['productinlot_list']
-            for productinlot in productinlot_list:
-                writer.writerow(
-                    [productinlot.pk, productinlot.product.name, productinlot.quantity, productinlot.product.weight, productinlot.purchase_price, productinlot.product.retail_price])
-            writer.writerow([])
-            writer.writerow(["", "Сумма закупочной стоимости",
-                            self.object.get_total_lot_purchase_price()])
-            writer.writerow([])
-            writer.writerow(
-                ["", "Вес заказа кг.", self.object.get_products_weight()])
-            writer.writerow([])
-            writer.writerow([])
-            writer.writerow(["", "Список расходов по лоту"])
-            writer.writerow(["#", "Наименование расхода", "Сумма", "Дата"])
-            lotcost_list = context['lotcost_list']
-            for lotcost in lotcost_list:
-                writer.writerow(
-                    [lotcost.pk, lotcost.get_display_name(), lotcost.amount_spent, lotcost.date])
-            writer.writerow([])
-            writer.writerow(["", "Сумма расходов по лоту",
-                            self.object.get_total_lot_amount_spent()])
-            writer.writerow([])
-            writer.writerow(
-                ["", "Итоговая стоимость лота", self.object.get_total()])
-            writer.writerow([])
-            writer.writerow(["", "История изменений статуса лота"])
-            writer.writerow(["#", "Статус", "Дата"])
-            history = context['history']
-            for i in history:
-                writer.writerow([i.pk, i.get_status_display(), i.date])
-
-            return response
-
-        return super().render_to_response(context, **response_kwargs)
+    def get_csv_filename(self):
+        return f'Лот_{self.object.pk}_от_{now().strftime("%Y-%m-%d")}.csv'
+
+    def get_csv_rows(self):
+        product_in_lot_list = ProductInLot.objects.filter(lot=self.object).select_related('product')
+        lot_cost_list = LotCost.objects.filter(lot=self.object)
+
+        yield ["", "Список продуктов в лоте"]
+        yield from queryset_rows(product_in_lot_list, self.csv_productinlot_columns,
+                                 self.csv_productinlot_columns_attributes)
+        yield []
+        yield ["", "Сумма закупочной стоимости", self.object.get_total_lot_purchase_price()]
+        yield []
+        yield ["", "Вес заказа кг.", self.object.get_products_weight()]
+        yield []
+        yield []
+        yield ["", "Список расходов по лоту"]
+        yield from queryset_rows(lot_cost_list, self.csv_lotcost_columns, self.csv_lotcost_columns_attributes)
+        yield []
+        yield ["", "Сумма расходов по лоту", self.object.get_total_lot_amount_spent()]
+        yield []
+        yield ["", "Итоговая стоимость лота", self.object.get_total()]
+        yield []
+        yield ["", "История изменений статуса лота"]
+        yield from queryset_rows(self.object.history.all(), self.csv_history_columns,
+                                 self.csv_history_columns_attributes, ordering=('history_id',))
 
 
 class LotUpdateView(UpdateView):
@@ -495,8 +497,6 @@ class LotUpdateView(UpdateView):
         if form.instance.history.first().status == 'delivered':
             form.add_error(None, 'Нельзя изменить лот, который уже доставлен')
             return super().form_invalid(form)
-        if form.instance.status == 'paid':
-            add_costs_out_from_lot_if_not_exists(form.instance)
         if form.instance.history.first().status == 'delivered_to_warehouse':
             form.add_error(
                 None, 'Нельзя изменить лот, который уже находится на складе')
@@ -510,40 +510,25 @@ class LotDeleteView(DeleteView):
     success_url = reverse_lazy('warehouse:lot_list')
 
 
-class WarehouseListView(ListView):
+class WarehouseListView(ReplicaReadsMixin, CsvExportMixin, ListView):
     model = Warehouse
     template_name = 'warehouse/warehouse/warehouse_list.html'
+    query_budget = 5
+    csv_filename = 'Справочник складов'
+
+    def get_queryset(self):
+        # Оценка всех складов считается одним запросом
+        return Warehouse.objects.with_valuation().order_by('pk')
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
-        kwargs['columns'] = ['#', 'Наименование', 'Описание']
-        kwargs['columns_attributes'] = ['pk', 'name', 'description']
+        kwargs['columns'] = ['#', 'Наименование', 'Количество', 'Себестоимость', 'Розничная стоимость',
+                             'Вес кг.', 'Описание']
+        kwargs['columns_attributes'] = ['pk', 'name', 'total_quantity', 'total_cost_price', 'total_retail_price',
+                                        'total_weight', 'description']
         return super().get_context_data(**kwargs)
 
-    def render_to_response(self, context: Dict[str, Any], **response_kwargs: Any) -> HttpResponse:
-        if 'format' in self.request.GET and self.request.GET['format'] == 'csv':
-            filename = f'Справочник складов {now().strftime("%Y-%m-%d")}.csv'
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
-
-            writer = csv.writer(response)
-            writer.writerow([])
-
-            warehouses = Warehouse.objects.all()
-            for warehouse in warehouses:
-                writer.writerow([warehouse.id, warehouse.name,
-                                warehouse.description])
-                products_in_warehouse = ProductInWarehouse.objects.filter(
-                    warehouse=warehouse)
-                writer.writerow(["", "Список продуктов на складе"])
-                for product_in_warehouse in products_in_warehouse:
-                    writer.writerow(
-                        ["", product_in_warehouse.product.name, product_in_warehouse.quantity])
-
-            writer.writerow([])
-            writer.writerow(['', 'Ответственный', '______', '______'])
-            writer.writerow(['', 'Принял', '______', '______'])
-            return response
-        return super().render_to_response(context, **response_kwargs)
+    def get_csv_rows(self):
+        return warehouse_rows()
 
 
 class WarehouseCreateView(CreateView):
@@ -557,55 +542,26 @@ class WarehouseCreateView(CreateView):
         return super().get_context_data(**kwargs)
 
 
-class WarehouseDetailView(DetailView):
+class WarehouseDetailView(ReplicaReadsMixin, DetailView):
     model = Warehouse
     template_name = 'warehouse/warehouse/warehouse_detail.html'
+    query_budget = 6
+
+    def get_queryset(self):
+        return Warehouse.objects.with_valuation()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         delivered_lot_list = Lot.objects.filter(status='delivered')
 
-        last_cost_price_subquery = (
-            ProductInWarehouse.objects
-            .filter(warehouse=self.object)
-            .filter(product_id=OuterRef('product_id'))
-            .order_by('-date_created')[:1]
-            .values('cost_price')
-        )
-
-        last_date_subquery = (
-            ProductInWarehouse.objects
-            .filter(warehouse=self.object)
-            .filter(product_id=OuterRef('product_id'))
-            .order_by('-date_created')[:1]
-            .values('date_created')
-        )
-
+        # Остатки читаем из StockBalance, а не агрегируем весь журнал движений
         product_in_warehouse = (
-            ProductInWarehouse.objects
+            StockBalance.objects
             .filter(warehouse=self.object)
-            .values('product')
-            .annotate(
-                product_name=F('product__name'),  # Отображение имени продукта
-                # Отображение розничной цены
-                retail_price=F('product__retail_price'),
-                total_quantity=Sum(
-                    Case(
-                        When(transaction__in=[
-                             'in', 'return'], then=F('quantity')),
-                        default=-F('quantity'),
-                    )
-                ),
-                last_cost_price=Subquery(last_cost_price_subquery),
-                last_date=Subquery(last_date_subquery),
-            )
+            .exclude(quantity=0)
+            .select_related('product')
+            .order_by('product__name')
         )
-
-        product_in_warehouse_all = ProductInWarehouse.objects.filter(
-            warehouse=self.object,
-            transaction='in'
-        ).order_by('product__name')
-        context['productinwarehouse_all_list'] = product_in_warehouse_all
         context['productinwarehouse_list'] = product_in_warehouse
         context['delivered_lot_list'] = delivered_lot_list
         return context
@@ -624,47 +580,25 @@ class WarehouseDeleteView(DeleteView):
     success_url = reverse_lazy('warehouse:warehouse_list')
 
 
-class ProductInWarehouseListView(ListView):
+class ProductInWarehouseListView(KeysetPaginationMixin, ListView):
     model = ProductInWarehouse
     template_name = 'warehouse/productinwarehouse/productinwarehouse_list.html'
+    query_budget = 5
 
     def get_queryset(self):
-        return ProductInWarehouse.objects.filter(warehouse=self.kwargs['warehouse_id'])
+        return ProductInWarehouse.objects.filter(warehouse=self.kwargs['warehouse_id']).select_related('product')
 
 
 class ProductInWarehouseBalancedListView(ListView):
-    model = ProductInWarehouse
-    template_name = 'warehouse/productinwarehouse/productinwarehouse_balanced_list.html'
+    model = StockBalance
+    template_name = 'warehouse/productinwarehouse/productinwarehouse_balance_list.html'
 
     def get_queryset(self):
-        last_cost_price_subquery = (
-            ProductInWarehouse.objects
-            .filter(product_id=OuterRef('product_id'), warehouse_id=OuterRef('warehouse_id'))
-            .order_by('-date_created')[:1]
-            .values('cost_price')
-        )
-
-        last_date_subquery = (
-            ProductInWarehouse.objects
-            .filter(product_id=OuterRef('product_id'), warehouse_id=OuterRef('warehouse_id'))
-            .order_by('-date_created')[:1]
-            .values('date_created')
-        )
-
-        product_in_warehouse = (
-            ProductInWarehouse.objects
-            .values('product', 'warehouse')
-            .annotate(
-                total_quantity=Sum(
-                    Case(
-                        When(transaction__in=[
-                             'in', 'return'], then=F('quantity')),
-                        default=-F('quantity'),
-                    )
-                ),
-                last_cost_price=Subquery(last_cost_price_subquery),
-                last_date=Subquery(last_date_subquery),
-            )
+        return (
+            StockBalance.objects
+            .exclude(quantity=0)
+            .select_related('product', 'warehouse')
+            .order_by('warehouse__name', 'product__name')
         )
 
 
@@ -681,11 +615,11 @@ class ProductInWarehouseCreateView(CreateView):
     def get_success_url(self):
         return reverse_lazy('warehouse:warehouse_detail', kwargs={'pk': self.kwargs['warehouse_id']})
 
-    def form_valid(self, form):
-        warehouse_id = self.kwargs['warehouse_id']
-        warehouse = Warehouse.objects.get(pk=warehouse_id)
-        form.instance.warehouse = warehouse
-        return super().form_valid(form)
+    def get_form_kwargs(self):
+        # Склад нужен модели до валидации: расход проверяется по остатку этого склада
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = ProductInWarehouse(warehouse=get_object_or_404(Warehouse, pk=self.kwargs['warehouse_id']))
+        return kwargs
 
 
 class ProductInWarehouseDetailView(DetailView):
@@ -716,9 +650,9 @@ class ConsumerListView(ListView):
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         kwargs['columns'] = ['#', 'Наименование',
-                             'Сумма покупок', 'Уровень покупателя', 'Описание']
+                             'Сумма покупок', 'Заказов', 'Не оплачено', 'Уровень покупателя', 'Описание']
         kwargs['columns_attributes'] = [
-            'pk', 'name', 'total_cost', 'level', 'description']
+            'pk', 'name', 'total_cost', 'order_count', 'unpaid_amount', 'level', 'description']
         return super().get_context_data(**kwargs)
 
 
@@ -733,7 +667,7 @@ class ConsumerCreateView(CreateView):
         return super().get_context_data(**kwargs)
 
 
-class ConsumerDetailView(DetailView):
+class ConsumerDetailView(ReplicaReadsMixin, DetailView):
     model = Consumer
     template_name = 'warehouse/consumer/consumer_detail.html'
 
@@ -769,9 +703,13 @@ class ConsumerDeleteView(DeleteView):
     success_url = reverse_lazy('warehouse:consumer_list')
 
 
-class OrderListView(ListView):
+class OrderListView(KeysetPaginationMixin, ListView):
     model = Order
-    template_name = 'warehouse/order/order_list.html'
+    template_name = 'warehouse/order/order_page.html'
+    query_budget = 5
+
+    def get_queryset(self):
+        return Order.objects.filter(consumer=self.kwargs['consumer_id']).select_related('consumer')
 
 
 class OrderCreateView(CreateView):
@@ -793,52 +731,47 @@ class OrderCreateView(CreateView):
         return super().form_valid(form)
 
 
-class OrderDetailView(DetailView):
+class OrderDetailView(ReplicaReadsMixin, CsvExportMixin, DetailView):
     model = Order
     template_name = 'warehouse/order/order_detail.html'
+    query_budget = 10
+    csv_productinorder_columns = ["#", "Наименование товара", "Количество", "Вес кг.", "Цена"]
+    csv_productinorder_columns_attributes = ['pk', 'product.name', 'quantity', 'product.weight',
+                                             'product.retail_price']
+    csv_history_columns = ["#", "Статус", "Дата"]
+    csv_history_columns_attributes = ['pk', 'get_status_display', 'date_created']
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['productinorder_list'] = ProductInOrder.objects.filter(
-            order=self.object)
-        context['history'] = self.object.history.all()[::-1]
+        context['productinorder_list'] = ProductInOrder.objects.filter(order=self.object).select_related(
+            'product',
+        ).annotate(warehouse_quantity=ProductInOrder.warehouse_quantity_subquery(self.object.warehouse_id))
+        context['history'] = status_history(self.object)
         return context
 
-    def render_to_response(self, context: Dict[str, Any], **response_kwargs: Any) -> HttpResponse:
-        if 'format' in self.request.GET and self.request.GET['format'] == 'csv':
-            filename = f'Заказ_{self.object.pk}_от_{now().strftime("%Y-%m-%d")}.csv'
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
-
-            writer = csv.writer(response)
-            writer.writerow(["", "Покупатель", self.object.consumer.name])
-            writer.writerow(["", "Список продуктов в заказе"])
-            writer.writerow(["#", "Наименование товара",
-                            "Количество", "Вес кг.", "Цена"])
-
-            productinorder_list = context['productinorder_list']
-            for productinorder in productinorder_list:
-                writer.writerow(
-                    [productinorder.pk, productinorder.product.name, productinorder.quantity, productinorder.product.weight, productinorder.purchase_price, productinorder.product.retail_price])
-            writer.writerow([])
-            writer.writerow(
-                ["", "Вес заказа кг.", self.object.get_total_order_weight()])
-            writer.writerow([])
-            writer.writerow(["", "Итоговая стоимость заказа",
-                            self.object.get_total_order_cost_price()])
-            writer.writerow([])
-            writer.writerow(["", "История изменений статуса заказа"])
-            writer.writerow(["#", "Статус", "Дата"])
-            history = context['history']
-            for i in history:
-                writer.writerow([i.pk, i.get_status_display(), i.date_created])
-
-            return response
-
-        return super().render_to_response(context, **response_kwargs)
-
-
-class OrderUpdateView(UpdateView):
+    def get_csv_filename(self):
+        return f'Заказ_{self.object.pk}_от_{now().strftime("%Y-%m-%d")}.csv'
+
+    def get_csv_rows(self):
+        product_in_order_list = ProductInOrder.objects.filter(order=self.object).select_related('product')
+        total_weight = product_in_order_list.aggregate(
+            total_weight=Sum(F('quantity') * F('product__weight')))['total_weight'] or 0
+
+        yield ["", "Покупатель", self.object.consumer.name]
+        yield ["", "Список продуктов в заказе"]
+        yield from queryset_rows(product_in_order_list, self.csv_productinorder_columns,
+                                 self.csv_productinorder_columns_attributes)
+        yield []
+        yield ["", "Вес заказа кг.", total_weight]
+        yield []
+        yield ["", "Итоговая стоимость заказа", self.object.get_total_order_cost_price()]
+        yield []
+        yield ["", "История изменений статуса заказа"]
+        yield from queryset_rows(self.object.history.all(), self.csv_history_columns,
+                                 self.csv_history_columns_attributes, ordering=('history_id',))
+
+
+class OrderUpdateView(ReservationFormMixin, UpdateView):
     model = Order
     template_name = 'includes/update.html'
     form_class = OrderUpdateForm
@@ -853,10 +786,6 @@ class OrderUpdateView(UpdateView):
                 form.add_error(
                     None, 'Нельзя изменить статус заказа на "оплачен", т.к. он уже оплачен')
                 return super().form_invalid(form)
-        if form.instance.status == 'shipped':
-            if form.instance.history.first().status != 'paid':
-                Order.objects.filter(pk=self.object.pk).update(
-                    status='not_paid')
         return super().form_valid(form)
 
 
@@ -873,10 +802,13 @@ class ProductInOrderListView(ListView):
     template_name = 'warehouse/productinorder/productinorder_list.html'
 
     def get_queryset(self):
-        return ProductInOrder.objects.filter(order=self.kwargs['order_id'])
+        order = Order.objects.get(pk=self.kwargs['order_id'])
+        return ProductInOrder.objects.filter(order=order).select_related('product').annotate(
+            warehouse_quantity=ProductInOrder.warehouse_quantity_subquery(order.warehouse_id),
+        )
 
 
-class ProductInOrderCreateView(CreateView):
+class ProductInOrderCreateView(ReservationFormMixin, CreateView):
     model = ProductInOrder
     form_class = ProductInOrderForm
     template_name = 'includes/create.html'
@@ -888,11 +820,13 @@ class ProductInOrderCreateView(CreateView):
     def get_success_url(self):
         return reverse_lazy('warehouse:order_detail', kwargs={'pk': self.object.order.pk})
 
-    def form_valid(self, form):
-        order_id = self.kwargs['order_id']
-        order = Order.objects.get(pk=order_id)
-        form.instance.order = order
-        return super().form_valid(form)
+    def get_form_kwargs(self):
+        # Заказ нужен форме до валидации: список товаров и проверка остатка идут по складу заказа
+        kwargs = super().get_form_kwargs()
+        order = Order.objects.get(pk=self.kwargs['order_id'])
+        kwargs['instance'] = ProductInOrder(order=order)
+        kwargs['warehouse_id'] = order.warehouse_id
+        return kwargs
 
 
 class ProductInOrderDetailView(DetailView):
@@ -900,13 +834,18 @@ class ProductInOrderDetailView(DetailView):
     template_name = 'warehouse/productinorder/productinorder_detail.html'
 
 
-class ProductInOrderUpdateView(UpdateView):
+class ProductInOrderUpdateView(ReservationFormMixin, UpdateView):
     model = ProductInOrder
     template_name = 'includes/update.html'
     form_class = ProductInOrderForm
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['warehouse_id'] = self.object.order.warehouse_id
+        return kwargs
+
     def get_success_url(self):
-        return reverse_lazy('warehouse:order_detail', kwargs={'pk': self.kwargs['order_id']})
+        return reverse_lazy('warehouse:order_detail', kwargs={'pk': self.object.order_id})
 
 
 class ProductInOrderDeleteView(DeleteView):
@@ -914,12 +853,13 @@ class ProductInOrderDeleteView(DeleteView):
     template_name = 'includes/delete.html'
 
     def get_success_url(self):
-        return reverse_lazy('warehouse:order_detail', kwargs={'pk': self.kwargs['order_id']})
+        return reverse_lazy('warehouse:order_detail', kwargs={'pk': self.object.order_id})
 
 
-class CostListView(ListView):
+class CostListView(ReplicaReadsMixin, KeysetPaginationMixin, ListView):
     model = Cost
-    template_name = 'warehouse/cost/cost_list.html'
+    template_name = 'warehouse/cost/cost_page.html'
+    query_budget = 5
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         kwargs['columns'] = ['#', 'Наименование', 'Сумма', 'Дата', 'Описание']
@@ -957,43 +897,87 @@ class CostDeleteView(DeleteView):
     success_url = reverse_lazy('warehouse:balance_list')
 
 
+BALANCE_COSTS_LIMIT = 50
+
+
+@replica_reads_view
+@query_budget(8)
 def get_balance_by_date(request):
+    # Итоги — разность двух накопленных сумм из дерева CashBalanceNode (O(log дней) строк), а списки ограничены
+    # последними записями периода, поэтому время ответа не зависит ни от числа дней, ни от числа записей Cost
     form = BalanceForm()
-    costs_in = None
-    costs_out = None
-    balance = None
-    costs_in_all = Cost.objects.filter(transaction='in')
-    costs_out_all = Cost.objects.filter(transaction='out')
-    balance_all = (costs_in_all.aggregate(Sum('amount'))['amount__sum'] or 0) - (
-        costs_out_all.aggregate(Sum('amount'))['amount__sum'] or 0)
-
-    if request.method == 'GET':
-        today = date.today()
-        start_of_month = date(today.year, today.month, 1)
-        costs_in = Cost.objects.filter(
-            date_created__gte=start_of_month, transaction='in')
-        costs_out = Cost.objects.filter(
-            date_created__gte=start_of_month, transaction='out')
-        balance = (costs_in.aggregate(Sum('amount'))['amount__sum'] or 0) - (
-            costs_out.aggregate(Sum('amount'))['amount__sum'] or 0)
-
-    elif request.method == 'POST':
+    today = date.today()
+    date_from = date(today.year, today.month, 1)
+    date_to = today
+
+    if request.method == 'POST':
         form = BalanceForm(request.POST)
 
         if form.is_valid():
             date_from = form.cleaned_data['date_from']
             date_to = form.cleaned_data['date_to']
-            costs_in = Cost.objects.filter(
-                date_created__gte=date_from, date_created__lte=date_to, transaction='in')
-            costs_out = Cost.objects.filter(
-                date_created__gte=date_from, date_created__lte=date_to, transaction='out')
-            balance = (costs_in.aggregate(Sum('amount'))['amount__sum'] or 0) - (
-                costs_out.aggregate(Sum('amount'))['amount__sum'] or 0)
+
+    total_in, total_out = get_period_totals(date_from, date_to)
+    costs = Cost.objects.filter(date_created__gte=date_from, date_created__lte=date_to).order_by('-date_created', '-pk')
 
     return render(request, 'warehouse/balance/balance_list.html', {
         'form': form,
-        'costs_in': costs_in,
-        'costs_out': costs_out,
-        'balance': balance,
-        'balance_all': balance_all,
+        'date_from': date_from,
+        'date_to': date_to,
+        'costs_in': costs.filter(transaction='in')[:BALANCE_COSTS_LIMIT],
+        'costs_out': costs.filter(transaction='out')[:BALANCE_COSTS_LIMIT],
+        'costs_limit': BALANCE_COSTS_LIMIT,
+        'total_in': total_in,
+        'total_out': total_out,
+        'balance': total_in - total_out,
+        'balance_all': get_total_balance(),
     })
+
+
+"""
+Фоновые задачи
+"""
+
+# С кнопок страниц можно поставить только выгрузки без параметров; проводки ставят свои вью
+SUBMITTABLE_JOB_KINDS = ( 'product_csv', 'warehouse_csv' )
+
+
+@require_POST
+def job_create(request):
+    kind = request.POST.get('kind')
+    if kind not in SUBMITTABLE_JOB_KINDS:
+        raise http.Http404('Неизвестный вид задачи')
+    job = get_or_submit_job(kind)
+    return redirect('warehouse:job_detail', job.pk)
+
+
+class JobListView(KeysetPaginationMixin, ListView):
+    model = Job
+    template_name = 'warehouse/job/job_list.html'
+    query_budget = 5
+
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        kwargs['columns'] = ['#', 'Вид задачи', 'Статус', 'Выполнено', 'Дата создания']
+        kwargs['columns_attributes'] = ['pk', 'kind', 'status', 'progress_done', 'date_created']
+        return super().get_context_data(**kwargs)
+
+
+class JobDetailView(DetailView):
+    model = Job
+    template_name = 'warehouse/job/job_detail.html'
+    query_budget = 3
+
+    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
+        kwargs['title'] = get_job_title(self.object.kind)
+        return super().get_context_data(**kwargs)
+
+
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, status='done')
+    if not job.result_file:
+        raise http.Http404('У задачи нет файла результата')
+    return http.FileResponse(
+        job.result_file.open('rb'),
+        as_attachment=True,
+        filename=job.result_file.name.rsplit('/', 1)[ -1 ],
+    )